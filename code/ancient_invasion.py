@@ -10,10 +10,20 @@ Author: DtjiSoftwareDeveloper
 # Importing necessary libraries
 
 import sys
+import bisect
 import uuid
+import json
+import time
 import pickle
+import argparse
+import functools
+import itertools
+import threading
+import weakref
+from array import array
 import copy
 import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 import os
 from mpmath import *
@@ -24,11 +34,17 @@ mp.pretty = True
 # Creating static functions to be used throughout the game.
 
 
+NUMBER_TYPES: tuple = (int, float, mpf)
+
+
 def is_number(string: str) -> bool:
+    if isinstance(string, NUMBER_TYPES):
+        return not isinstance(string, bool)
+
     try:
         mpf(string)
         return True
-    except ValueError:
+    except (ValueError, TypeError):
         return False
 
 
@@ -37,19 +53,134 @@ def triangular(n: int) -> int:
 
 
 def mpf_sum_of_list(a_list: list) -> mpf:
-    return mpf(str(sum(mpf(str(elem)) for elem in a_list if is_number(str(elem)))))
+    # Numbers are summed directly and only other elements are parsed from their string forms.
+    return fsum(elem if isinstance(elem, NUMBER_TYPES) else mpf(str(elem)) for elem in a_list
+                if (isinstance(elem, NUMBER_TYPES) and not isinstance(elem, bool)) or is_number(str(elem)))
 
 
 def load_game_data(file_name):
     # type: (str) -> Game
-    return pickle.load(open(file_name, "rb"))
+    game_data: Game = pickle.load(open(file_name, "rb"))
+    if isinstance(game_data, Game):
+        game_data.convert_battle_areas_to_descriptors()  # saves from before enemy descriptors hold built enemies
+    return game_data
 
 
 def save_game_data(game_data, file_name):
     # type: (Game, str) -> None
+    if isinstance(game_data, Game):
+        game_data.convert_battle_areas_to_descriptors()
     pickle.dump(game_data, open(file_name, "wb"))
 
 
+def simulate_arena_matches(matches, max_turns):
+    # type: (list, int) -> list
+    """
+    Runs headless battles for a list of (seed, team1, team2) arena matches. This function is module level so that it
+    can be sent to worker processes.
+    :return: a list of results, 1 if team1 won, -1 if team2 won and 0 for a draw
+    """
+
+    results: list = []  # initial value
+    for seed, team1, team2 in matches:
+        battle: Battle = Battle(team1, team2, random.Random(seed))
+        winner: Team or None = battle.run_headless(max_turns)
+        results.append(1 if winner is team1 else -1 if winner is team2 else 0)
+    return results
+
+
+def simulate_team_candidate(matches, max_turns):
+    # type: (list, int) -> int
+    """
+    Runs headless battles for a list of (seed, team1, team2) matches of one candidate team.
+    :return: the number of battles won by team1
+    """
+
+    return sum(1 for result in simulate_arena_matches(matches, max_turns) if result == 1)
+
+
+def simulate_level_runs(runs, max_turns):
+    # type: (list, int) -> int
+    """
+    Runs headless battles for a list of (seed, team, enemy teams) level runs, where a run is won only if the team wins
+    against every enemy team in order.
+    :return: the number of runs won
+    """
+
+    runs_won: int = 0  # initial value
+    for seed, team, enemy_teams in runs:
+        is_won: bool = True  # initial value
+        for stage_number, enemy_team in enumerate(enemy_teams):
+            if Battle(team, enemy_team, random.Random(seed + ":" + str(stage_number))).run_headless(max_turns) \
+                    is not team:
+                is_won = False
+                break
+
+        if is_won:
+            runs_won += 1
+    return runs_won
+
+
+def simulate_timed_matches(matches, max_turns):
+    # type: (list, int) -> list
+    """
+    Runs headless battles for a list of (seed, team1, team2) matches like simulate_arena_matches, also timing them.
+    :return: a list of (result, turns taken, seconds taken) tuples
+    """
+
+    results: list = []  # initial value
+    for seed, team1, team2 in matches:
+        start_time: float = time.perf_counter()
+        battle: Battle = Battle(team1, team2, random.Random(seed))
+        winner: Team or None = battle.run_headless(max_turns)
+        results.append((1 if winner is team1 else -1 if winner is team2 else 0, battle.turns_taken,
+                        time.perf_counter() - start_time))
+    return results
+
+
+def create_basic_skills(hero_id, multiplier_to_self_attack_power, is_aoe, max_cooltime):
+    # type: (str, mpf, bool, int) -> list
+    """
+    Creates an active skill costing 10 magic points and a special power, both dealing damage scaled by the user's
+    attack power.
+    :return: a list of the two skills
+    """
+
+    damage_multiplier: DamageMultiplier = DamageMultiplier(mpf("0"), mpf("0"), mpf(multiplier_to_self_attack_power),
+                                                           *[mpf("0")] * 17)
+    return [ActiveSkill("SKILL " + str(hero_id), "", mpf("10"), damage_multiplier, False, [], [], [], False,
+                        False, False, mpf("0"), mpf("0"), mpf("0"), mpf("0"), False, is_aoe),
+            SpecialPower("SPECIAL POWER " + str(hero_id), "", damage_multiplier, max_cooltime, False)]
+
+
+def generate_random_hero(hero_id, rng=random):
+    # type: (str, random.Random) -> Hero
+    """
+    Generates a hero with random stats, an active skill and a special power for simulations and load tests.
+    :return: the generated hero
+    """
+
+    multiplier_to_self_attack_power: str = rng.choice(["1", "1.5", "2"])
+    skills: list = create_basic_skills(hero_id, mpf(multiplier_to_self_attack_power), rng.random() < 0.5,
+                                       rng.randint(2, 4))
+    awaken_bonus: AwakenBonus = AwakenBonus(*[mpf("0")] * 9, new_skill_gained=None)
+    secondary_awaken_bonus: SecondaryAwakenBonus = SecondaryAwakenBonus(*[mpf("0")] * 4, new_upgraded_skills_list=[])
+    return Hero(str(hero_id), "HERO " + str(hero_id), rng.choice(Hero.POSSIBLE_ELEMENTS[:5]),
+                rng.choice(Hero.POSSIBLE_HERO_TYPES), rng.randint(Hero.MIN_RATING, Hero.MAX_RATING),
+                mpf(rng.randint(5000, 9000)), mpf(rng.randint(80, 120)), mpf(rng.randint(800, 1200)),
+                mpf(rng.randint(300, 600)), mpf(rng.randint(90, 130)), skills, mpf("1e6"), awaken_bonus,
+                secondary_awaken_bonus)
+
+
+def generate_random_trainer(name, rng=random):
+    # type: (str, random.Random) -> Trainer
+    trainer: Trainer = Trainer(name)
+    for i in range(Team.MAX_HEROES):
+        trainer.battle_team.add_hero(generate_random_hero(name + "-" + str(i), rng))
+    trainer.battle_team.set_leader(trainer.battle_team.get_heroes_list()[0])
+    return trainer
+
+
 def clear():
     # type: () -> None
     if sys.platform.startswith('win'):
@@ -72,8 +203,9 @@ class Action:
         # type: (str) -> None
         self.name: str = name if name in self.POSSIBLE_NAMES else self.POSSIBLE_NAMES[0]
 
-    def execute(self, user, target, skill_to_use=None):
-        # type: (Hero, Hero, Skill or None) -> bool
+    def execute(self, user, target, skill_to_use=None, rng=None):
+        # type: (Hero, Hero, Skill or None, random.Random or None) -> bool
+        roll: callable = random.random if rng is None else rng.random  # the global generator unless rng is given
         if self.name == "NORMAL ATTACK":
             if user == target:
                 return False
@@ -82,14 +214,17 @@ class Action:
             if user_actual_crit_rate > user.MAX_CRIT_RATE:
                 user_actual_crit_rate = user.MAX_CRIT_RATE
 
-            is_crit: bool = random.random() <= user_actual_crit_rate
+            is_crit: bool = roll() <= user_actual_crit_rate
             user_actual_attack_power: mpf = user.attack_power * (1 + user.battle_attack_power_percentage_up / 100 -
-                                                                 user.battle_attack_power_percentage_down / 100)
+                                                                 user.battle_attack_power_percentage_down / 100) + \
+                                                                 user.battle_attack_power_up
             target_actual_defense: mpf = target.defense * (1 + target.battle_defense_percentage_up / 100 -
-                                                           target.battle_defense_percentage_down / 100)
+                                                           target.battle_defense_percentage_down / 100) + \
+                                                           target.battle_defense_up
             raw_damage: mpf = user_actual_attack_power
             if is_crit:
                 raw_damage *= user.crit_damage
+                user.crits_dealt += 1
 
             raw_damage -= target_actual_defense
             damage: mpf = raw_damage if raw_damage > 0 else 0
@@ -105,9 +240,41 @@ class Action:
             return True
 
         elif self.name == "USE SKILL":
-            if isinstance(skill_to_use, Skill):
+            if isinstance(skill_to_use, SpecialPower):
+                # Special powers are skills too, so they are checked before the other skills.
+                target_team: Team or None = target.curr_team
+                if skill_to_use.cooltime != 0 or user == target or \
+                        (target_team is not None and user in target_team.get_heroes_list()):
+                    return False
+
+                user_actual_crit_rate: mpf = user.crit_rate + user.battle_crit_rate_up
+                if user_actual_crit_rate > user.MAX_CRIT_RATE:
+                    user_actual_crit_rate = user.MAX_CRIT_RATE
+
+                raw_damage: mpf = skill_to_use.damage_multiplier. \
+                    calculate_normal_raw_damage_without_enemy_defense(user, target)
+                is_crit: bool = roll() <= user_actual_crit_rate
+                if is_crit:
+                    raw_damage *= user.crit_damage
+                    user.crits_dealt += 1
+
+                if not skill_to_use.does_ignore_enemies_defense:
+                    raw_damage -= target.defense
+
+                damage: mpf = raw_damage if raw_damage > 0 else 0
+                target_is_invincible: bool = False
+                for buff in target.get_buffs():
+                    if buff.name == "INVINCIBLE":
+                        target_is_invincible = True
+
+                if target_is_invincible:
+                    damage = 0
+
+                target.curr_hp -= damage
+                return True
+            elif isinstance(skill_to_use, Skill):
                 # TODO: fix this elif branch by checking whether the skill attacks or heals and the team the user and the target are in
-                # Attack the enemy if the skill is an active skill or a special power
+                # Attack the enemy if the skill is an active skill
                 if isinstance(skill_to_use, ActiveSkill):
                     user_actual_crit_rate: mpf = user.crit_rate + user.battle_crit_rate_up
                     if user_actual_crit_rate > user.MAX_CRIT_RATE:
@@ -118,9 +285,10 @@ class Action:
                         if user not in target_team.get_heroes_list():
                             raw_damage: mpf = skill_to_use.damage_multiplier.\
                                 calculate_normal_raw_damage_without_enemy_defense(user, target)
-                            is_crit: bool = random.random() <= user_actual_crit_rate
+                            is_crit: bool = roll() <= user_actual_crit_rate
                             if is_crit:
                                 raw_damage *= user.crit_damage
+                                user.crits_dealt += 1
 
                             if not skill_to_use.does_ignore_enemies_defense:
                                 raw_damage -= target.defense
@@ -137,19 +305,20 @@ class Action:
                             target.curr_hp -= damage
                         else:
                             user.curr_hp += skill_to_use.heal_amount_to_self
-                            if user.curr_hp > user.max_hp:
-                                user.curr_hp = user.max_hp
+                            if user.curr_hp > user.get_final_stat("max_hp"):
+                                user.curr_hp = user.get_final_stat("max_hp")
 
                             target.curr_hp += skill_to_use.heal_amount_to_allies
-                            if target.curr_hp > target.max_hp:
-                                target.curr_hp = target.max_hp
+                            if target.curr_hp > target.get_final_stat("max_hp"):
+                                target.curr_hp = target.get_final_stat("max_hp")
                     else:
                         for enemy_target in target_team.get_heroes_list():
                             raw_damage: mpf = skill_to_use.damage_multiplier. \
                                 calculate_normal_raw_damage_without_enemy_defense(user, enemy_target)
-                            is_crit: bool = random.random() <= user_actual_crit_rate
+                            is_crit: bool = roll() <= user_actual_crit_rate
                             if is_crit:
                                 raw_damage *= user.crit_damage
+                                user.crits_dealt += 1
 
                             if not skill_to_use.does_ignore_enemies_defense:
                                 raw_damage -= enemy_target.defense
@@ -164,182 +333,1737 @@ class Action:
                                 damage = 0
 
                             enemy_target.curr_hp -= damage
+                    return True
 
-            elif isinstance(skill_to_use, SpecialPower):
-                if skill_to_use.cooltime == 0:
-                    user_actual_crit_rate: mpf = user.crit_rate + user.battle_crit_rate_up
-                    if user_actual_crit_rate > user.MAX_CRIT_RATE:
-                        user_actual_crit_rate = user.MAX_CRIT_RATE
+        return False
+
+    def clone(self):
+        # type: () -> Action
+        return copy.deepcopy(self)
+
+
+class Arena:
+    """
+    This class contains attributes of the battle arena where the player can face AI controlled trainers as opponents.
+    """
+
+    def __init__(self, available_opponent_trainers):
+        # type: (list) -> None
+        self.__matchmaking_index: ArenaMatchmakingIndex = ArenaMatchmakingIndex()
+        for opponent_trainer in available_opponent_trainers:
+            self.__matchmaking_index.add_trainer(opponent_trainer)
+
+    def add_opponent_trainer(self, opponent_trainer):
+        # type: (Trainer) -> None
+        self.__matchmaking_index.add_trainer(opponent_trainer)
+
+    def remove_opponent_trainer(self, opponent_trainer):
+        # type: (Trainer) -> bool
+        return self.__matchmaking_index.remove_trainer(opponent_trainer)
+
+    def update_opponent_trainer(self, opponent_trainer):
+        # type: (Trainer) -> bool
+        """
+        Moves the opponent trainer to its new position in the matchmaking index after its arena points changed.
+        :return: True if the trainer is in this arena, False otherwise
+        """
+
+        return self.__matchmaking_index.update_trainer(opponent_trainer)
+
+    def get_nearest_opponent_trainers(self, player, k, max_points_difference):
+        # type: (Player, int, int) -> list
+        """
+        Gets up to k opponent trainers closest to the player's arena points within max_points_difference.
+        :return: a list of trainers sorted by distance from the player's arena points
+        """
+
+        return self.__matchmaking_index.get_nearest_trainers(player.arena_points, k, max_points_difference,
+                                                             excluded=player)
+
+    def get_random_opponent_trainer_in_rank(self, rank_value, rng=None):
+        # type: (str, random.Random or None) -> Trainer or None
+        return self.__matchmaking_index.get_random_trainer_in_rank(rank_value, rng)
+
+    def get_matchmaking_index(self):
+        # type: () -> ArenaMatchmakingIndex
+        return self.__matchmaking_index
+
+    def get_available_opponent_trainers(self):
+        # type: () -> list
+        return self.__matchmaking_index.get_trainers()
+
+    def clone(self):
+        # type: () -> Arena
+        return copy.deepcopy(self)
+
+
+class ArenaMatchmakingIndex:
+    """
+    This class contains attributes of an index of trainers ordered by their arena points.
+
+    Trainers with the same arena points share a bucket and a Fenwick tree counts the trainers at each point value, so
+    adding, removing, updating, ranking and selecting trainers all take O(log P) time where P is the range of arena
+    points covered by the index. The tree grows with the points up to MAX_TREE_POINTS, and the rare trainers with
+    more points are kept in a sorted list instead, so huge arena points cannot make the tree huge.
+    """
+
+    INITIAL_POINTS_RANGE: int = 4096
+    MAX_TREE_POINTS: int = 65536
+
+    def __init__(self):
+        # type: () -> None
+        self.__counts: FenwickTree = FenwickTree(self.INITIAL_POINTS_RANGE)
+        self.__high_points: list = []  # sorted arena points of every trainer with at least MAX_TREE_POINTS of them
+        self.__buckets: dict = {}  # arena points -> list of trainers having those points
+        self.__indexed_points: dict = {}  # trainer -> arena points the trainer is indexed under
+        self.__position_in_bucket: dict = {}  # trainer -> index of the trainer inside its bucket
+
+    @staticmethod
+    def get_index_points(trainer):
+        # type: (Player) -> int
+        return max(int(trainer.arena_points), 0)
+
+    def __len__(self):
+        # type: () -> int
+        return len(self.__indexed_points)
+
+    def __contains__(self, trainer):
+        # type: (Player) -> bool
+        return trainer in self.__indexed_points
+
+    def __insert(self, trainer, points):
+        # type: (Player, int) -> None
+        if points >= self.MAX_TREE_POINTS:
+            bisect.insort(self.__high_points, points)
+        else:
+            while points >= self.__counts.size:
+                self.__counts.grow(min(self.__counts.size * 2, self.MAX_TREE_POINTS))
+            self.__counts.add(points, 1)
+
+        bucket: list = self.__buckets.setdefault(points, [])
+        self.__position_in_bucket[trainer] = len(bucket)
+        bucket.append(trainer)
+        self.__indexed_points[trainer] = points
+
+    def __delete(self, trainer):
+        # type: (Player) -> None
+        points: int = self.__indexed_points.pop(trainer)
+        bucket: list = self.__buckets[points]
+        position: int = self.__position_in_bucket.pop(trainer)
+        last_trainer: Player = bucket.pop()
+        if last_trainer is not trainer:
+            bucket[position] = last_trainer
+            self.__position_in_bucket[last_trainer] = position
+
+        if len(bucket) == 0:
+            del self.__buckets[points]
+
+        if points >= self.MAX_TREE_POINTS:
+            del self.__high_points[bisect.bisect_left(self.__high_points, points)]
+        else:
+            self.__counts.add(points, -1)
+
+    def add_trainer(self, trainer):
+        # type: (Player) -> bool
+        if trainer in self.__indexed_points:
+            return False
+
+        self.__insert(trainer, self.get_index_points(trainer))
+        return True
+
+    def remove_trainer(self, trainer):
+        # type: (Player) -> bool
+        if trainer in self.__indexed_points:
+            self.__delete(trainer)
+            return True
+        return False
+
+    def update_trainer(self, trainer):
+        # type: (Player) -> bool
+        if trainer in self.__indexed_points:
+            new_points: int = self.get_index_points(trainer)
+            if new_points != self.__indexed_points[trainer]:
+                self.__delete(trainer)
+                self.__insert(trainer, new_points)
+            return True
+        return False
+
+    def count_trainers_with_points_below(self, points):
+        # type: (int) -> int
+        if points <= 0:
+            return 0
+        if points > self.MAX_TREE_POINTS:
+            return self.__counts.prefix_sum(self.__counts.size - 1) + bisect.bisect_left(self.__high_points, points)
+        return self.__counts.prefix_sum(min(points, self.__counts.size) - 1)
+
+    def get_trainer_by_order(self, order):
+        # type: (int) -> Player
+        """
+        Gets the trainer at the given zero-based position when all trainers are sorted by arena points.
+        :return: the trainer at that position
+        """
+
+        trainers_in_tree: int = len(self) - len(self.__high_points)
+        points: int = self.__counts.find_by_order(order) if order < trainers_in_tree else \
+            self.__high_points[order - trainers_in_tree]
+        return self.__buckets[points][order - self.count_trainers_with_points_below(points)]
+
+    def get_trainers_count_in_range(self, min_points, max_points):
+        # type: (int, int) -> int
+        """
+        Counts the trainers having arena points in the range [min_points, max_points).
+        :return: the number of trainers in the range
+        """
+
+        if max_points <= min_points:
+            return 0
+        return self.count_trainers_with_points_below(max_points) - self.count_trainers_with_points_below(min_points)
+
+    def get_random_trainer_in_range(self, min_points, max_points, rng=None):
+        # type: (int, int, random.Random or None) -> Player or None
+        count: int = self.get_trainers_count_in_range(min_points, max_points)
+        if count == 0:
+            return None
+        random_index: int = random.randrange(count) if rng is None else rng.randrange(count)
+        return self.get_trainer_by_order(self.count_trainers_with_points_below(min_points) + random_index)
+
+    def get_random_trainer_in_rank(self, rank_value, rng=None):
+        # type: (str, random.Random or None) -> Player or None
+        min_points, max_points = Rank.get_arena_points_range(rank_value)
+        return self.get_random_trainer_in_range(min_points, max_points, rng)
+
+    def get_nearest_trainers(self, points, k, max_points_difference, excluded=None):
+        # type: (int, int, int, Player or None) -> list
+        """
+        Gets up to k trainers whose arena points are closest to the given points and at most max_points_difference
+        away from them, walking outwards from the given points in O(k log P) time.
+        :return: a list of trainers sorted by distance from the given points
+        """
+
+        result: list = []  # initial value
+        points = max(int(points), 0)
+        below: int = self.count_trainers_with_points_below(points + 1) - 1
+        above: int = below + 1
+        total: int = len(self)
+        while len(result) < k:
+            below_trainer: Player or None = self.get_trainer_by_order(below) if below >= 0 else None
+            above_trainer: Player or None = self.get_trainer_by_order(above) if above < total else None
+            below_distance: int = points - self.__indexed_points[below_trainer] if below_trainer is not None \
+                else max_points_difference + 1
+            above_distance: int = self.__indexed_points[above_trainer] - points if above_trainer is not None \
+                else max_points_difference + 1
+            if min(below_distance, above_distance) > max_points_difference:
+                break
+
+            if below_distance <= above_distance:
+                chosen: Player = below_trainer
+                below -= 1
+            else:
+                chosen = above_trainer
+                above += 1
+
+            if chosen is not excluded:
+                result.append(chosen)
+
+        return result
+
+    def get_trainers(self):
+        # type: () -> list
+        return list(self.__indexed_points)
+
+    def clone(self):
+        # type: () -> ArenaMatchmakingIndex
+        return copy.deepcopy(self)
+
+
+class FenwickTree:
+    """
+    This class contains attributes of a Fenwick tree (binary indexed tree) of integer counts.
+    """
 
-                    raw_damage: mpf = skill_to_use.damage_multiplier. \
-                        calculate_normal_raw_damage_without_enemy_defense(user, target)
-                    is_crit: bool = random.random() <= user_actual_crit_rate
-                    if is_crit:
-                        raw_damage *= user.crit_damage
+    def __init__(self, size):
+        # type: (int) -> None
+        self.size: int = size
+        self.__tree: list = [0] * (size + 1)
 
-                    if not skill_to_use.does_ignore_enemies_defense:
-                        raw_damage -= target.defense
+    def add(self, index, delta):
+        # type: (int, int) -> None
+        index += 1
+        while index <= self.size:
+            self.__tree[index] += delta
+            index += index & -index
+
+    def prefix_sum(self, index):
+        # type: (int) -> int
+        """
+        Gets the sum of the counts at positions 0 to index inclusive.
+        :return: the prefix sum
+        """
+
+        result: int = 0  # initial value
+        index += 1
+        while index > 0:
+            result += self.__tree[index]
+            index -= index & -index
+        return result
+
+    def find_by_order(self, order):
+        # type: (int) -> int
+        """
+        Gets the smallest position whose prefix sum exceeds order.
+        :return: the position found
+        """
+
+        position: int = 0  # initial value
+        step: int = 1 << self.size.bit_length()
+        while step > 0:
+            if position + step <= self.size and self.__tree[position + step] <= order:
+                position += step
+                order -= self.__tree[position]
+            step >>= 1
+        return position
+
+    def grow(self, new_size):
+        # type: (int) -> None
+        counts: list = [self.prefix_sum(i) - self.prefix_sum(i - 1) for i in range(self.size)]
+        self.size = new_size
+        self.__tree = [0] * (new_size + 1)
+        for i, count in enumerate(counts):
+            if count != 0:
+                self.add(i, count)
+
+    def clone(self):
+        # type: () -> FenwickTree
+        return copy.deepcopy(self)
+
+
+class Battle:
+    """
+    This class contains attributes of a battle in this game.
+    """
+
+    MAX_TURNS: int = 500
+    ATTACK_GAUGE_RATE: mpf = mpf("0.0007")  # attack gauge gained per point of attack speed in each tick
+    LOW_HP_PERCENTAGE: mpf = mpf("30")  # AI controlled heroes below this percentage of max HP heal themselves
+
+    def __init__(self, team1, team2, rng=None):
+        # type: (Team, Team, random.Random or None) -> None
+        self.team1: Team = team1
+        self.team2: Team = team2
+        self.rng: random.Random or None = rng  # None for the global random number generator
+        self.winner: Team or None = None
+        self.whose_turn: Hero or None = None
+        self.turns_taken: int = 0
+        self.effect_scheduler: EffectScheduler = EffectScheduler()
+        self.effect_pool: EffectPool = EffectPool()
+        self.event_bus: BattleEventBus = BattleEventBus()
+        for team in [self.team1, self.team2]:
+            for hero in team.get_heroes_list():
+                hero.curr_team = team
+
+    def get_heroes(self):
+        # type: () -> list
+        return self.team1.get_heroes_list() + self.team2.get_heroes_list()
+
+    def get_enemy_team(self, hero):
+        # type: (Hero) -> Team
+        return self.team2 if hero.curr_team is self.team1 else self.team1
+
+    def start(self):
+        # type: () -> None
+        for hero in self.get_heroes():
+            hero.prepare_for_battle()
+
+        self.team1.apply_team_effects()
+        self.team2.apply_team_effects()
+        self.effect_scheduler = EffectScheduler()
+        self.winner = None
+        self.whose_turn = None
+        self.turns_taken = 0
+
+    def apply_effect(self, hero, effect):
+        # type: (Hero, Buff or Debuff) -> bool
+        """
+        Gives a buff or a debuff to the hero and schedules its expiry. Debuffs are blocked by the IMMUNITY buff.
+        :return: True if the effect is applied, False otherwise
+        """
+
+        if isinstance(effect, Debuff):
+            if self.effect_scheduler.has_flag(hero, "prevents_debuffs") or not hero.add_debuff(effect):
+                return False
+            if self.event_bus.has_subscribers("DEBUFF APPLIED"):
+                self.event_bus.publish("DEBUFF APPLIED", hero, effect)
+        elif not hero.add_buff(effect):
+            return False
+        elif self.event_bus.has_subscribers("BUFF APPLIED"):
+            self.event_bus.publish("BUFF APPLIED", hero, effect)
+
+        self.effect_scheduler.schedule(hero, effect)
+        return True
+
+    def apply_pooled_effect(self, hero, effect):
+        # type: (Hero, Buff or Debuff) -> bool
+        if self.apply_effect(hero, effect):
+            return True
+
+        self.effect_pool.release(effect)
+        return False
+
+    def remove_effect(self, hero, effect):
+        # type: (Hero, Buff or Debuff) -> bool
+        """
+        Removes a buff or a debuff from the hero, giving it back to the effect pool.
+        :return: True if the effect is removed, False otherwise
+        """
+
+        self.effect_scheduler.cancel(effect)
+        is_removed: bool = hero.remove_debuff(effect) if isinstance(effect, Debuff) else hero.remove_buff(effect)
+        if is_removed:
+            self.effect_pool.release(effect)
+        return is_removed
+
+    def apply_skill_effects(self, hero, target, skill):
+        # type: (Hero, Hero, ActiveSkill) -> None
+        allies: list = [ally for ally in hero.curr_team.get_heroes_list() if ally.get_is_alive()]
+        enemies: list = [enemy for enemy in self.get_enemy_team(hero).get_heroes_list() if enemy.get_is_alive()]
+        affected_enemies: list = enemies if skill.is_aoe else [target] if target in enemies else []
+        for buff in skill.get_buffs_to_self():
+            self.apply_pooled_effect(hero, self.effect_pool.acquire_buff(buff.name, buff.number_of_turns))
+        for ally in allies:
+            if ally is not hero:
+                for buff in skill.get_buffs_to_allies():
+                    self.apply_pooled_effect(ally, self.effect_pool.acquire_buff(buff.name, buff.number_of_turns))
+            if skill.does_remove_allies_debuffs or (ally is hero and skill.does_remove_self_debuffs):
+                for debuff in list(ally.get_debuffs()):
+                    self.remove_effect(ally, debuff)
+        for enemy in affected_enemies:
+            if skill.does_remove_enemies_buffs:
+                for buff in list(enemy.get_buffs()):
+                    self.remove_effect(enemy, buff)
+            for debuff in skill.get_debuffs_to_enemies():
+                self.apply_pooled_effect(enemy, self.effect_pool.acquire_debuff(debuff.name,
+                                                                                 debuff.number_of_turns))
+
+    def begin_turn(self, hero):
+        # type: (Hero) -> bool
+        """
+        Applies heal over time and damage over time to the hero at the start of its turn.
+        :return: True if the hero is alive and not prevented from moving by a debuff, False otherwise
+        """
+
+        if self.event_bus.has_subscribers("TURN START"):
+            self.event_bus.publish("TURN START", hero)
+
+        curr_hp_before: mpf = hero.curr_hp
+        if hero.battle_recovery_percentage_per_turn > 0 and not self.effect_scheduler.has_flag(hero, "blocks_heal"):
+            hero.curr_hp = min(hero.curr_hp + hero.max_hp * hero.battle_recovery_percentage_per_turn / 100,
+                               hero.get_final_stat("max_hp"))
+        if hero.battle_damage_per_turn > 0:
+            hero.curr_hp -= hero.max_hp * hero.battle_damage_per_turn / 100
+        if hero.curr_hp != curr_hp_before and self.event_bus.has_hp_subscribers():
+            self.event_bus.publish_hp_changes([hero], [curr_hp_before])
+        return hero.get_is_alive() and not self.effect_scheduler.has_flag(hero, "prevents_turn")
+
+    def end_turn(self, hero):
+        # type: (Hero) -> None
+        """
+        Removes the hero's effects expiring on this turn, runs down its special power cooltimes unless a debuff stops
+        them, recovers its magic points and checks whether the battle is won.
+        :return: None
+        """
+
+        if not self.effect_scheduler.has_flag(hero, "prevents_cooltime_from_running"):
+            for skill in hero.get_skills():
+                if isinstance(skill, SpecialPower) and skill.cooltime > 0:
+                    skill.cooltime -= 1
+
+        for effect in self.effect_scheduler.end_turn(hero):
+            if isinstance(effect, Debuff):
+                hero.remove_debuff(effect)
+            else:
+                hero.remove_buff(effect)
+            self.effect_pool.release(effect)
+
+        hero.recover_magic_points()
+        self.turns_taken += 1
+        self.update_winner()
+
+    def get_someone_to_move(self):
+        # type: () -> Hero or None
+        """
+        Fills the attack gauges of all alive heroes until at least one of them is full and gets the hero to move.
+        :return: the hero with the fullest attack gauge, or None if no hero is alive
+        """
+
+        alive_heroes: list = [hero for hero in self.get_heroes() if hero.get_is_alive()]
+        if len(alive_heroes) == 0:
+            return None
+
+        gauge_rates: list = [max(hero.attack_speed * (1 + hero.battle_attack_speed_percentage_up / 100 -
+                                                      hero.battle_attack_speed_percentage_down / 100) +
+                                 hero.battle_attack_speed_up, 0) * self.ATTACK_GAUGE_RATE for hero in alive_heroes]
+        ticks_needed: list = [0 if hero.attack_gauge >= hero.FULL_ATTACK_GAUGE else
+                              (hero.FULL_ATTACK_GAUGE - hero.attack_gauge) / rate if rate > 0 else float('inf')
+                              for hero, rate in zip(alive_heroes, gauge_rates)]
+        ticks: mpf = min(ticks_needed)
+        if ticks == float('inf'):
+            ticks = 0
+        elif ticks > 0:
+            for hero, rate in zip(alive_heroes, gauge_rates):
+                hero.attack_gauge += rate * ticks
+
+        hero_to_move: Hero = max(alive_heroes, key=lambda hero: hero.attack_gauge)
+        hero_to_move.attack_gauge = hero_to_move.MIN_ATTACK_GAUGE
+        return hero_to_move
+
+    def choose_ai_action(self, hero):
+        # type: (Hero) -> tuple
+        """
+        Chooses the action of an AI controlled hero: a ready special power, an affordable active skill, a normal heal
+        when low on HP or a normal attack. The target is the alive enemy most likely to be killed by one normal attack,
+        then the one with the lowest HP.
+        :return: a tuple (action name, skill to use or None, target) or None if no enemy is alive
+        """
+
+        enemies: list = [enemy for enemy in self.get_enemy_team(hero).get_heroes_list() if enemy.get_is_alive()]
+        if len(enemies) == 0:
+            return None
+
+        target: Hero = min(enemies, key=lambda enemy: (
+            -DamageDistribution.of_normal_attack(hero, enemy).get_kill_probability(enemy.curr_hp), enemy.curr_hp))
+        for skill in hero.get_skills():
+            if isinstance(skill, SpecialPower) and skill.cooltime == 0:
+                return "USE SKILL", skill, target
+            elif isinstance(skill, ActiveSkill) and hero.curr_magic_points >= skill.magic_points_cost:
+                return "USE SKILL", skill, target
+
+        if hero.curr_hp * 100 < hero.max_hp * self.LOW_HP_PERCENTAGE:
+            return "NORMAL HEAL", None, hero
+        return "NORMAL ATTACK", None, target
+
+    def perform_action(self, hero, action_name, target, skill=None):
+        # type: (Hero, str, Hero, Skill or None) -> bool
+        """
+        Makes the hero carry out an action, giving out the buffs and debuffs of an active skill used.
+        :return: True if the action was carried out, False otherwise
+        """
+
+        if not self.event_bus.has_hp_subscribers() and not self.event_bus.has_subscribers("ACTION EXECUTED"):
+            return self.__perform_action(hero, action_name, target, skill)
+
+        heroes: list = self.get_heroes()
+        hp_before: list = [curr_hero.curr_hp for curr_hero in heroes]
+        crits_dealt_before: int = hero.crits_dealt
+        is_performed: bool = self.__perform_action(hero, action_name, target, skill)
+        if self.event_bus.has_subscribers("ACTION EXECUTED"):
+            damage_dealt: mpf = fsum(curr_hp_before - curr_hero.curr_hp for curr_hero, curr_hp_before in
+                                     zip(heroes, hp_before) if curr_hero.curr_team is not hero.curr_team and
+                                     curr_hero.curr_hp < curr_hp_before)
+            self.event_bus.publish("ACTION EXECUTED", hero, action_name, target, skill, is_performed, damage_dealt,
+                                   hero.crits_dealt - crits_dealt_before)
+        self.event_bus.publish_hp_changes(heroes, hp_before)
+        return is_performed
+
+    def __perform_action(self, hero, action_name, target, skill):
+        # type: (Hero, str, Hero, Skill or None) -> bool
+        if action_name == "USE SKILL":
+            is_performed: bool = hero.use_skill(target, skill, self.rng)
+            if is_performed and isinstance(skill, SpecialPower):
+                skill.cooltime = skill.max_cooltime
+            elif is_performed and isinstance(skill, ActiveSkill):
+                self.apply_skill_effects(hero, target, skill)
+        elif action_name == "NORMAL HEAL":
+            is_performed = hero == target
+            hero.normal_heal(target)
+        else:
+            is_performed = hero != target
+            hero.normal_attack(target, self.rng)
+
+        return is_performed
+
+    def take_ai_turn(self, hero):
+        # type: (Hero) -> None
+        ai_action: tuple or None = self.choose_ai_action(hero)
+        if ai_action is not None:
+            action_name, skill, target = ai_action
+            if not self.perform_action(hero, action_name, target, skill) and action_name == "USE SKILL":
+                self.perform_action(hero, "NORMAL ATTACK", target)
+
+    def update_winner(self):
+        # type: () -> Team or None
+        team1_alive: bool = any(hero.get_is_alive() for hero in self.team1.get_heroes_list())
+        team2_alive: bool = any(hero.get_is_alive() for hero in self.team2.get_heroes_list())
+        winner: Team or None = self.winner
+        if team1_alive and not team2_alive:
+            self.winner = self.team1
+        elif team2_alive and not team1_alive:
+            self.winner = self.team2
+        if winner is None and self.winner is not None and self.event_bus.has_subscribers("BATTLE END"):
+            self.event_bus.publish("BATTLE END", self.winner)
+        return self.winner
+
+    def get_is_over(self):
+        # type: () -> bool
+        return self.winner is not None or not any(hero.get_is_alive() for hero in self.get_heroes())
+
+    def run_headless(self, max_turns=MAX_TURNS):
+        # type: (int) -> Team or None
+        """
+        Runs the whole battle with both teams controlled by the AI without any input or output.
+        :return: the winning team, or None if the battle ends in a draw
+        """
+
+        self.start()
+        while self.turns_taken < max_turns and not self.get_is_over():
+            self.whose_turn = self.get_someone_to_move()
+            if self.begin_turn(self.whose_turn):
+                self.take_ai_turn(self.whose_turn)
+            self.end_turn(self.whose_turn)
+
+        if self.winner is None and self.event_bus.has_subscribers("BATTLE END"):
+            self.event_bus.publish("BATTLE END", None)
+        return self.winner
+
+    def clone(self):
+        # type: () -> Battle
+        return copy.deepcopy(self)
+
+
+class EffectScheduler:
+    """
+    This class contains attributes of a scheduler of buff and debuff expiry in a battle.
+
+    Every hero has a timing wheel of WHEEL_SIZE slots indexed by the hero's own turn number. An effect lasting n turns
+    goes into the slot of the turn it expires on, so ending a turn only looks at the effects in one slot instead of
+    every buff and debuff of every hero. Effects removed early are dropped lazily when their slot comes up.
+    """
+
+    WHEEL_SIZE: int = 16
+    POSSIBLE_FLAGS: list = ["prevents_turn", "prevents_cooltime_from_running", "blocks_heal", "prevents_debuffs"]
+
+    def __init__(self):
+        # type: () -> None
+        self.__wheels: dict = {}  # hero -> list of WHEEL_SIZE slots of (expiry turn, effect)
+        self.__turns_ended: dict = {}  # hero -> number of turns the hero has ended
+        self.__expiries: dict = {}  # effect -> (hero, expiry turn) of every scheduled effect
+        self.__flag_counts: dict = {}  # (hero, flag) -> number of scheduled effects of the hero having the flag
+        self.__expired_effects: list = []  # returned by end_turn and reused every turn
+
+    def get_turns_ended(self, hero):
+        # type: (Hero) -> int
+        return self.__turns_ended.get(hero, 0)
+
+    def __update_flag_counts(self, hero, effect, delta):
+        # type: (Hero, Buff or Debuff, int) -> None
+        for flag in self.POSSIBLE_FLAGS:
+            if getattr(effect, flag, False):
+                self.__flag_counts[(hero, flag)] = self.__flag_counts.get((hero, flag), 0) + delta
+
+    def has_flag(self, hero, flag):
+        # type: (Hero, str) -> bool
+        return self.__flag_counts.get((hero, flag), 0) > 0
+
+    def schedule(self, hero, effect):
+        # type: (Hero, Buff or Debuff) -> None
+        self.cancel(effect)
+        expiry_turn: int = self.get_turns_ended(hero) + max(effect.number_of_turns, 1)
+        wheel: list = self.__wheels.get(hero)
+        if wheel is None:
+            wheel = [[] for i in range(self.WHEEL_SIZE)]
+            self.__wheels[hero] = wheel
+        wheel[expiry_turn % self.WHEEL_SIZE].append((expiry_turn, effect))
+        self.__expiries[effect] = (hero, expiry_turn)
+        self.__update_flag_counts(hero, effect, 1)
+
+    def cancel(self, effect):
+        # type: (Buff or Debuff) -> bool
+        if effect in self.__expiries:
+            hero, expiry_turn = self.__expiries.pop(effect)
+            self.__update_flag_counts(hero, effect, -1)
+            return True
+        return False
+
+    def get_remaining_turns(self, effect):
+        # type: (Buff or Debuff) -> int
+        if effect not in self.__expiries:
+            return 0
+        hero, expiry_turn = self.__expiries[effect]
+        return expiry_turn - self.get_turns_ended(hero)
+
+    def end_turn(self, hero):
+        # type: (Hero) -> list
+        """
+        Ends a turn of the hero. The slot is filtered in place and the returned list is reused by the next call, so
+        no lists are created per turn.
+        :return: a list of the hero's effects expiring on this turn, valid until end_turn is called again
+        """
+
+        turn: int = self.get_turns_ended(hero) + 1
+        self.__turns_ended[hero] = turn
+        expired_effects: list = self.__expired_effects
+        expired_effects.clear()
+        wheel: list or None = self.__wheels.get(hero)
+        if wheel is None:
+            return expired_effects
+
+        slot: list = wheel[turn % self.WHEEL_SIZE]
+        number_of_remaining_entries: int = 0  # initial value
+        for entry in slot:
+            expiry_turn, effect = entry
+            scheduled: tuple or None = self.__expiries.get(effect)
+            if scheduled is None or scheduled[0] is not hero or scheduled[1] != expiry_turn:
+                continue  # cancelled or rescheduled
+            if expiry_turn == turn:
+                self.cancel(effect)
+                expired_effects.append(effect)
+            else:
+                slot[number_of_remaining_entries] = entry
+                number_of_remaining_entries += 1
+
+        del slot[number_of_remaining_entries:]
+        return expired_effects
+
+    def clone(self):
+        # type: () -> EffectScheduler
+        return copy.deepcopy(self)
+
+
+class EffectPool:
+    """
+    This class contains attributes of a per-battle pool of buffs and debuffs.
+
+    Effects given by skills are taken from the pool and go back to it once they expire or are removed, so a long
+    battle reuses the same few effect objects instead of creating new ones every turn.
+    """
+
+    def __init__(self):
+        # type: () -> None
+        self.__free_buffs: list = []  # initial value
+        self.__free_debuffs: list = []  # initial value
+
+    def acquire_buff(self, name, number_of_turns):
+        # type: (str, int) -> Buff
+        if len(self.__free_buffs) == 0:
+            return Buff(name, number_of_turns)
+
+        buff: Buff = self.__free_buffs.pop()
+        buff.reset(name, number_of_turns)
+        return buff
+
+    def acquire_debuff(self, name, number_of_turns):
+        # type: (str, int) -> Debuff
+        if len(self.__free_debuffs) == 0:
+            return Debuff(name, number_of_turns)
+
+        debuff: Debuff = self.__free_debuffs.pop()
+        debuff.reset(name, number_of_turns)
+        return debuff
+
+    def release(self, effect):
+        # type: (Buff or Debuff) -> None
+        if isinstance(effect, Debuff):
+            self.__free_debuffs.append(effect)
+        else:
+            self.__free_buffs.append(effect)
+
+    def get_number_of_free_effects(self):
+        # type: () -> int
+        return len(self.__free_buffs) + len(self.__free_debuffs)
+
+    def clone(self):
+        # type: () -> EffectPool
+        return copy.deepcopy(self)
+
+
+class BattleEventBus:
+    """
+    This class contains attributes of a bus publishing what happens in a battle to subscribed callbacks.
+
+    Battles ask has_subscribers before building the arguments of an event, so an event nobody subscribed to costs
+    one dictionary lookup. Callbacks are called with the arguments listed in EVENT_ARGUMENTS.
+    """
+
+    EVENT_ARGUMENTS: dict = {
+        "TURN START": ["hero"],
+        "ACTION EXECUTED": ["hero", "action_name", "target", "skill", "is_performed", "damage_dealt",
+                            "number_of_crits"],
+        "DAMAGE": ["hero", "amount"],
+        "HEAL": ["hero", "amount"],
+        "BUFF APPLIED": ["hero", "buff"],
+        "DEBUFF APPLIED": ["hero", "debuff"],
+        "DEATH": ["hero"],
+        "BATTLE END": ["winner"]
+    }  # event type -> arguments of the callbacks
+    HP_EVENT_TYPES: list = ["DAMAGE", "HEAL", "DEATH"]
+
+    def __init__(self):
+        # type: () -> None
+        self.__subscribers: dict = {}  # event type -> list of callbacks, only for event types with subscribers
+
+    def subscribe(self, event_type, callback):
+        # type: (str, callable) -> bool
+        if event_type not in self.EVENT_ARGUMENTS:
+            return False
+
+        self.__subscribers.setdefault(event_type, []).append(callback)
+        return True
+
+    def unsubscribe(self, event_type, callback):
+        # type: (str, callable) -> bool
+        callbacks: list or None = self.__subscribers.get(event_type)
+        if callbacks is None or callback not in callbacks:
+            return False
+
+        callbacks.remove(callback)
+        if len(callbacks) == 0:
+            del self.__subscribers[event_type]
+        return True
+
+    def has_subscribers(self, event_type):
+        # type: (str) -> bool
+        return event_type in self.__subscribers
+
+    def has_hp_subscribers(self):
+        # type: () -> bool
+        return "DAMAGE" in self.__subscribers or "HEAL" in self.__subscribers or "DEATH" in self.__subscribers
+
+    def publish(self, event_type, *arguments):
+        # type: (str, object) -> None
+        for callback in self.__subscribers.get(event_type, ()):
+            callback(*arguments)
+
+    def publish_hp_changes(self, heroes, hp_before):
+        # type: (list, list) -> None
+        """
+        Publishes damage, heal and death events of the heroes whose HP changed from the values in hp_before.
+        :return: None
+        """
+
+        for hero, curr_hp_before in zip(heroes, hp_before):
+            if hero.curr_hp < curr_hp_before:
+                self.publish("DAMAGE", hero, curr_hp_before - hero.curr_hp)
+                if curr_hp_before > 0 >= hero.curr_hp:
+                    self.publish("DEATH", hero)
+            elif hero.curr_hp > curr_hp_before:
+                self.publish("HEAL", hero, hero.curr_hp - curr_hp_before)
+
+    def clone(self):
+        # type: () -> BattleEventBus
+        return copy.deepcopy(self)
+
+
+class ArenaSeasonSimulator:
+    """
+    This class contains attributes of a simulator running a whole arena season between AI controlled trainers.
+    """
+
+    def __init__(self, trainers, number_of_rounds, k_factor=32, number_of_workers=1, seed=0,
+                 checkpoint_file_name=None, shard_size=256, max_turns=Battle.MAX_TURNS):
+        # type: (list, int, int, int, int, str or None, int, int) -> None
+        self.__trainers: list = trainers
+        self.number_of_rounds: int = number_of_rounds
+        self.k_factor: int = k_factor
+        self.number_of_workers: int = number_of_workers
+        self.seed: int = seed
+        self.checkpoint_file_name: str or None = checkpoint_file_name
+        self.shard_size: int = shard_size
+        self.max_turns: int = max_turns
+        self.curr_round: int = 0
+        self.last_shard_timings: list = []  # (turns taken, seconds taken) of every battle of the last shard run
+        self.__matchmaking_index: ArenaMatchmakingIndex = ArenaMatchmakingIndex()
+        for trainer in self.__trainers:
+            self.__matchmaking_index.add_trainer(trainer)
+
+    def get_trainers(self):
+        # type: () -> list
+        return self.__trainers
+
+    def get_pairings(self):
+        # type: () -> list
+        """
+        Pairs trainers next to each other in arena points. The pairing alternates between even and odd offsets every
+        round so that the same pairs do not keep meeting each other.
+        :return: a list of (trainer1, trainer2) tuples
+        """
+
+        pairings: list = []  # initial value
+        for order in range(self.curr_round % 2, len(self.__matchmaking_index) - 1, 2):
+            pairings.append((self.__matchmaking_index.get_trainer_by_order(order),
+                             self.__matchmaking_index.get_trainer_by_order(order + 1)))
+        return pairings
+
+    def get_standings(self, top_n=None):
+        # type: (int or None) -> list
+        """
+        Gets trainers from the highest to the lowest arena points.
+        :return: a list of at most top_n trainers, or all trainers if top_n is None
+        """
+
+        total: int = len(self.__matchmaking_index)
+        count: int = total if top_n is None else min(top_n, total)
+        return [self.__matchmaking_index.get_trainer_by_order(total - 1 - i) for i in range(count)]
+
+    def get_rank_distribution(self):
+        # type: () -> dict
+        distribution: dict = {}  # initial value
+        for rank_value in Rank.POSSIBLE_VALUES:
+            min_points, max_points = Rank.get_arena_points_range(rank_value)
+            distribution[rank_value] = self.__matchmaking_index.get_trainers_count_in_range(min_points, max_points)
+        return distribution
+
+    def get_match_seed(self, match_number):
+        # type: (int) -> str
+        return str(self.seed) + ":" + str(self.curr_round) + ":" + str(match_number)
+
+    def __apply_results(self, shard, timed_results):
+        # type: (list, list) -> list
+        updated_trainers: list = []  # initial value
+        self.last_shard_timings = [(turns_taken, seconds) for result, turns_taken, seconds in timed_results]
+        for (trainer1, trainer2), (result, turns_taken, seconds) in zip(shard, timed_results):
+            trainer1_arena_points: int = trainer1.arena_points
+            trainer1.record_arena_result(trainer2.arena_points, result, self.k_factor)
+            trainer2.record_arena_result(trainer1_arena_points, -result, self.k_factor)
+            self.__matchmaking_index.update_trainer(trainer1)
+            self.__matchmaking_index.update_trainer(trainer2)
+            updated_trainers += [trainer1, trainer2]
+        return updated_trainers
+
+    def run(self):
+        # type: () -> iter
+        """
+        Runs the remaining rounds of the season. Matches of a round are split into shards which run in a process pool
+        when number_of_workers is more than 1. The simulator is saved to checkpoint_file_name after every round.
+        :return: a generator yielding (round number, list of trainers whose standings changed) after every shard
+        """
+
+        executor: ProcessPoolExecutor or None = ProcessPoolExecutor(self.number_of_workers) \
+            if self.number_of_workers > 1 else None
+        try:
+            while self.curr_round < self.number_of_rounds:
+                pairings: list = self.get_pairings()
+                shards: list = [pairings[i:i + self.shard_size] for i in range(0, len(pairings), self.shard_size)]
+                payloads: list = [[(self.get_match_seed(shard_index * self.shard_size + i), trainer1.battle_team,
+                                    trainer2.battle_team) for i, (trainer1, trainer2) in enumerate(shard)]
+                                  for shard_index, shard in enumerate(shards)]
+                if executor is None:
+                    for shard, payload in zip(shards, payloads):
+                        yield self.curr_round, self.__apply_results(shard, simulate_timed_matches(payload,
+                                                                                                  self.max_turns))
+                else:
+                    futures: dict = {executor.submit(simulate_timed_matches, payload, self.max_turns): shard
+                                     for shard, payload in zip(shards, payloads)}
+                    for future in as_completed(futures):
+                        yield self.curr_round, self.__apply_results(futures[future], future.result())
+
+                self.curr_round += 1
+                if self.checkpoint_file_name is not None:
+                    self.save_checkpoint(self.checkpoint_file_name)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def save_checkpoint(self, file_name):
+        # type: (str) -> None
+        with open(file_name, "wb") as file:
+            pickle.dump(self, file)
+
+    @staticmethod
+    def load_checkpoint(file_name):
+        # type: (str) -> ArenaSeasonSimulator
+        with open(file_name, "rb") as file:
+            return pickle.load(file)
+
+    def clone(self):
+        # type: () -> ArenaSeasonSimulator
+        return copy.deepcopy(self)
+
+
+class BattleArea:
+    """
+    This class contains attributes of areas where battles take place.
+    """
+
+    def __init__(self, name, levels, clear_reward):
+        # type: (str, list, Reward) -> None
+        self.name: str = name
+        self.__levels: list = levels
+        self.clear_reward: Reward = clear_reward
+        self.is_cleared: bool = False
+
+    def get_levels(self):
+        # type: () -> list
+        return self.__levels
+
+    def clone(self):
+        # type: () -> BattleArea
+        return copy.deepcopy(self)
+
+
+class Dungeon(BattleArea):
+    """
+    This class contains attributes of dungeons in this game.
+    """
+
+    POSSIBLE_DUNGEON_TYPES: list = ["ITEM", "ELEMENTAL"]
+
+    def __init__(self, name, levels, clear_reward, dungeon_type):
+        # type: (str, list, Reward, str) -> None
+        BattleArea.__init__(self, name, levels, clear_reward)
+        self.dungeon_type: str = dungeon_type if dungeon_type in self.POSSIBLE_DUNGEON_TYPES else \
+            self.POSSIBLE_DUNGEON_TYPES[0]
+
+
+class MapArea(BattleArea):
+    """
+    This class contains attributes of map areas for battles.
+    """
+
+    def __init__(self, name, levels, clear_reward):
+        # type: (str, list, Reward) -> None
+        BattleArea.__init__(self, name, levels, clear_reward)
+
+
+class Level:
+    """
+    This class contains attributes of levels in battle areas.
+    """
+
+    def __init__(self, name, stages, clear_reward=None):
+        # type: (str, list, Reward or None) -> None
+        self.name: str = name
+        self.__stages: list = stages
+        for stage in self.__stages:
+            stage.curr_level = self
+
+        self.clear_reward: Reward or None = clear_reward  # None to use the reward of the battle area instead
+        self.is_cleared: bool = False
+        self.times_beaten: int = 0  # initial value
+
+    def get_beaten(self):
+        # type: () -> None
+        """
+        Make enemies stronger once this stage is beaten. Enemies of stages built from descriptors are only dropped,
+        since they are built again at the new times_beaten when needed.
+        :return: None
+        """
+
+        for stage in self.__stages:
+            if stage.get_is_lazy():
+                stage.release_enemies()
+                continue
+
+            for enemy in stage.get_enemies_list():
+                for i in range(2 ** self.times_beaten):
+                    enemy.exp = enemy.required_exp
+                    enemy.level_up()
+
+        self.times_beaten += 1
+
+    def release_enemies(self):
+        # type: () -> None
+        for stage in self.__stages:
+            stage.release_enemies()
+
+    def get_stages(self):
+        # type: () -> list
+        return self.__stages
+
+    def clone(self):
+        # type: () -> Level
+        return copy.deepcopy(self)
+
+
+class LevelStage:
+    """
+    This class contains attributes of a stage inside a level.
+
+    A stage is either given its enemies or built lazily from enemy descriptors, which are (hero_id, level) tuples
+    looked up in a shared dictionary of hero templates. Lazy stages only build their enemies when asked for them, at
+    the level's times_beaten, and never save them. Stages given their enemies are turned into lazy stages by
+    convert_to_descriptors when every enemy can be built again from a template.
+    """
+
+    COMPARED_ENEMY_ATTRIBUTES: list = ["rating", "level", "max_level", "limit_break_applied", "exp", "required_exp",
+                                       "max_hp", "max_magic_points", "attack_power", "defense", "attack_speed",
+                                       "crit_rate", "crit_damage", "resistance", "accuracy", "has_awakened",
+                                       "has_secondary_awakened", "gear_version"]
+    MAX_RELATIVE_DIFFERENCE: mpf = mpf("1e-12")  # projected stats are rounded differently from repeated level ups
+
+    def __init__(self, enemies_list=None, enemy_descriptors=None, hero_templates=None):
+        # type: (list or None, list or None, dict or None) -> None
+        self.__enemy_descriptors: list or None = enemy_descriptors
+        self.__hero_templates: dict or None = hero_templates  # hero_id -> template hero
+        self.__enemies_list: list or None = enemies_list if enemies_list is not None or \
+            enemy_descriptors is not None else []
+        self.__enemies_times_beaten: int = 0  # times_beaten the built enemies are at
+        self.curr_level: Level or None = None
+        self.is_cleared: bool = False
+
+    def __getstate__(self):
+        # type: () -> dict
+        state: dict = self.__dict__.copy()
+        if self.get_is_lazy():
+            state["_LevelStage__enemies_list"] = None
+        return state
+
+    def get_is_lazy(self):
+        # type: () -> bool
+        return self.__enemy_descriptors is not None
+
+    def get_enemy_descriptors(self):
+        # type: () -> list or None
+        return self.__enemy_descriptors
+
+    def get_enemies_list(self):
+        # type: () -> list
+        if self.get_is_lazy():
+            times_beaten: int = self.curr_level.times_beaten if self.curr_level is not None else 0
+            if self.__enemies_list is None or self.__enemies_times_beaten != times_beaten:
+                self.__enemies_list = [self.create_enemy(hero_id, level, times_beaten)
+                                       for hero_id, level in self.__enemy_descriptors]
+                self.__enemies_times_beaten = times_beaten
+        return self.__enemies_list
+
+    def get_enemy_teams(self):
+        # type: () -> list
+        """
+        Splits the enemies into waves of at most Team.MAX_HEROES enemies, which are fought one after another, since a
+        team with more heroes than that would be empty.
+        :return: a list of teams
+        """
+
+        enemies_list: list = self.get_enemies_list()
+        return [Team(list(enemies_list[i:i + Team.MAX_HEROES]))
+                for i in range(0, max(len(enemies_list), 1), Team.MAX_HEROES)]
+
+    def create_enemy(self, hero_id, level, times_beaten):
+        # type: (str, int, int) -> Hero
+        """
+        Builds an enemy from its hero template at the given level, then as strong as Level.get_beaten would have made
+        it after times_beaten beats (2 ** times_beaten - 1 more level ups).
+        :return: the enemy
+        """
+
+        template: Hero = self.__hero_templates[hero_id]
+        return DifficultyCalibrator.project_hero(template, level - template.level + 2 ** times_beaten - 1)
+
+    def release_enemies(self):
+        # type: () -> bool
+        """
+        Drops the built enemies of a lazy stage so that they are built again the next time they are needed.
+        :return: True if enemies are dropped, False otherwise
+        """
+
+        if self.get_is_lazy() and self.__enemies_list is not None:
+            self.__enemies_list = None
+            return True
+        return False
+
+    def convert_to_descriptors(self, hero_templates):
+        # type: (dict) -> bool
+        """
+        Turns a stage given its enemies into a lazy stage. An enemy levelled up n times from its template at the
+        level's times_beaten t is described by (hero_id, template level + n - (2 ** t - 1)), which create_enemy builds
+        back. Enemies at their max level may have had more level ups than levels gained, so one more level up is
+        tried for them too. The stage is only converted if every enemy built back has the same stats and progress as
+        the enemy it replaces, up to MAX_RELATIVE_DIFFERENCE, so enemies with gears, awakenings or other changes keep
+        the stage as it is.
+        :return: True if the stage is converted, False otherwise
+        """
+
+        if self.get_is_lazy() or len(self.__enemies_list) == 0:
+            return False
+
+        times_beaten: int = self.curr_level.times_beaten if self.curr_level is not None else 0
+        previous_hero_templates: dict or None = self.__hero_templates
+        self.__hero_templates = hero_templates
+        enemy_descriptors: list = []  # initial value
+        for enemy in self.__enemies_list:
+            if enemy.hero_id not in hero_templates:
+                self.__hero_templates = previous_hero_templates
+                return False
+
+            level: int = enemy.level - 2 ** times_beaten + 1
+            for extra_level_ups in range(2 if enemy.level == enemy.max_level else 1):
+                if self.__is_built_back(enemy, self.create_enemy(enemy.hero_id, level + extra_level_ups,
+                                                                 times_beaten)):
+                    enemy_descriptors.append((enemy.hero_id, level + extra_level_ups))
+                    break
+            else:
+                self.__hero_templates = previous_hero_templates
+                return False
+
+        self.__enemy_descriptors = enemy_descriptors
+        self.__enemies_list = None
+        return True
+
+    def __is_built_back(self, enemy, built_enemy):
+        # type: (Hero, Hero) -> bool
+        return len(built_enemy.get_skills()) == len(enemy.get_skills()) and \
+            all(almosteq(getattr(built_enemy, name), getattr(enemy, name), self.MAX_RELATIVE_DIFFERENCE)
+                if isinstance(getattr(enemy, name), mpf) else getattr(built_enemy, name) == getattr(enemy, name)
+                for name in self.COMPARED_ENEMY_ATTRIBUTES)
+
+    def clone(self):
+        # type: () -> LevelStage
+        return copy.deepcopy(self)
+
+
+class AutoFarmRunner:
+    """
+    This class contains attributes of a runner replaying a level of a dungeon or a map area headlessly with the
+    player's battle team.
+
+    Only running totals are kept between runs and the combined reward is given to the player in one bulk update.
+    """
+
+    def __init__(self, player, battle_area, level, max_turns_per_stage=Battle.MAX_TURNS,
+                 does_level_get_beaten=False, rng=None):
+        # type: (Player, BattleArea, Level, int, bool, random.Random or None) -> None
+        self.player: Player = player
+        self.battle_area: BattleArea = battle_area
+        self.level: Level = level
+        self.max_turns_per_stage: int = max_turns_per_stage
+        self.does_level_get_beaten: bool = does_level_get_beaten  # False by default since every Level.get_beaten
+        # call doubles the number of level ups of the next one.
+        self.runs: int = 0
+        self.runs_won: int = 0
+        self.total_turns: int = 0
+        self.reward_accumulator: RewardAccumulator = RewardAccumulator()  # rewards of won runs not given yet
+        self.rng: random.Random or None = rng  # None for the global random number generator
+
+    def run_once(self):
+        # type: () -> tuple
+        """
+        Runs every wave of every stage of the level in order until the player's team loses a wave.
+        :return: a tuple (whether the run is won, turns taken)
+        """
+
+        turns_taken: int = 0  # initial value
+        for stage in self.level.get_stages():
+            for enemy_team in stage.get_enemy_teams():
+                battle: Battle = Battle(self.player.battle_team, enemy_team, self.rng)
+                winner: Team or None = battle.run_headless(self.max_turns_per_stage)
+                turns_taken += battle.turns_taken
+                if winner is not self.player.battle_team:
+                    return False, turns_taken
+            stage.is_cleared = True
+
+        return True, turns_taken
+
+    def run(self, number_of_runs, stop_on_defeat=True, max_seconds=None):
+        # type: (int, bool, float or None) -> iter
+        """
+        Replays the level up to number_of_runs times, stopping early on defeat if stop_on_defeat is True or once
+        max_seconds have passed. Enemies of lazy stages are reused between runs and dropped once the runs end.
+        :return: a generator yielding (run number, whether the run is won, turns taken) after every run
+        """
+
+        start_time: float = time.perf_counter()
+        try:
+            for run_number in range(number_of_runs):
+                if max_seconds is not None and time.perf_counter() - start_time >= max_seconds:
+                    return
+
+                is_won, turns_taken = self.run_once()
+                self.runs += 1
+                self.total_turns += turns_taken
+                if is_won:
+                    self.runs_won += 1
+                    self.reward_accumulator.add_reward(self.get_run_reward())
+                    self.level.is_cleared = True
+                    if self.does_level_get_beaten:
+                        self.level.get_beaten()
+
+                yield run_number, is_won, turns_taken
+                if not is_won and stop_on_defeat:
+                    return
+        finally:
+            self.level.release_enemies()
+
+    def get_run_reward(self):
+        # type: () -> Reward
+        return self.level.clear_reward if self.level.clear_reward is not None else self.battle_area.clear_reward
+
+    def apply_rewards(self):
+        # type: () -> bool
+        """
+        Gives the player the reward of every won run not rewarded yet in one bulk update.
+        :return: True if any reward is given, False otherwise
+        """
 
-                    damage: mpf = raw_damage if raw_damage > 0 else 0
-                    target_is_invincible: bool = False
-                    for buff in target.get_buffs():
-                        if buff.name == "INVINCIBLE":
-                            target_is_invincible = True
+        return self.reward_accumulator.apply_to(self.player)
 
-                    if target_is_invincible:
-                        damage = 0
+    def run_and_apply_rewards(self, number_of_runs, stop_on_defeat=True, max_seconds=None):
+        # type: (int, bool, float or None) -> dict
+        for run_result in self.run(number_of_runs, stop_on_defeat, max_seconds):
+            pass
 
-                    target.curr_hp -= damage
+        self.apply_rewards()
+        return {"runs": self.runs, "runs_won": self.runs_won, "total_turns": self.total_turns}
 
     def clone(self):
-        # type: () -> Action
+        # type: () -> AutoFarmRunner
         return copy.deepcopy(self)
 
 
-class Arena:
+class TeamOptimizer:
     """
-    This class contains attributes of the battle arena where the player can face AI controlled trainers as opponents.
+    This class contains attributes of a search for the best battle team out of a list of heroes against given enemy
+    teams, e.g. the stages of a level or an opponent trainer's battle team.
+
+    Candidate teams are ranked with a cheap surrogate score built from expected damage, effective HP and attack
+    speed. Heroes dominated in all three by at least a team's worth of other heroes are pruned first, and only the
+    top candidates (each with its best leader) are confirmed with simulated battles.
     """
 
-    def __init__(self, available_opponent_trainers):
-        # type: (list) -> None
-        self.__available_opponent_trainers: list = available_opponent_trainers
+    MAX_EXHAUSTIVE_COMBINATIONS: int = 20000
+
+    def __init__(self, heroes, enemy_teams, number_of_candidates=8, number_of_simulations=16, number_of_workers=1,
+                 seed=0, beam_width=64, max_turns=Battle.MAX_TURNS):
+        # type: (list, list, int, int, int, int, int, int) -> None
+        self.__heroes: list = heroes
+        self.__enemy_teams: list = []  # initial value
+        for enemy_team in enemy_teams:
+            enemy_team = enemy_team.clone()
+            enemy_team.apply_team_effects()
+            self.__enemy_teams.append(enemy_team)
+
+        self.__enemies_hp: mpf = fsum(enemy.get_final_stat("max_hp") for enemy in self.get_enemies())
+        self.number_of_candidates: int = number_of_candidates
+        self.number_of_simulations: int = number_of_simulations
+        self.number_of_workers: int = number_of_workers
+        self.seed: int = seed
+        self.beam_width: int = beam_width
+        self.max_turns: int = max_turns
+
+    @staticmethod
+    def get_level_enemy_teams(level):
+        # type: (Level) -> list
+        return [enemy_team for stage in level.get_stages() for enemy_team in stage.get_enemy_teams()]
+
+    def get_enemies(self):
+        # type: () -> list
+        return [enemy for enemy_team in self.__enemy_teams for enemy in enemy_team.get_heroes_list()]
 
-    def add_opponent_trainer(self, opponent_trainer):
-        # type: (Trainer) -> None
-        self.__available_opponent_trainers.append(opponent_trainer)
+    @staticmethod
+    def has_team_effects(hero):
+        # type: (Hero) -> bool
+        return any(isinstance(skill, (LeaderSkill, PassiveSkill)) for skill in hero.get_skills())
 
-    def remove_opponent_trainer(self, opponent_trainer):
-        # type: (Trainer) -> bool
-        if opponent_trainer in self.__available_opponent_trainers:
-            self.__available_opponent_trainers.remove(opponent_trainer)
-            return True
-        return False
+    @staticmethod
+    def create_candidate_heroes(heroes):
+        # type: (list) -> list
+        """
+        Copies heroes so that scoring and simulating them never touches the originals, leaving out the team effects
+        of the teams they are currently in.
+        :return: a list of copies in the same order
+        """
 
-    def get_available_opponent_trainers(self):
-        # type: () -> list
-        return self.__available_opponent_trainers
+        candidate_heroes: list = copy.deepcopy(heroes)
+        for hero in candidate_heroes:
+            hero.stat_modifiers.remove_layer(Team.TEAM_EFFECTS_LAYER)
+            hero.curr_team = None
+        return candidate_heroes
 
-    def clone(self):
-        # type: () -> Arena
-        return copy.deepcopy(self)
+    def get_hero_score_terms(self, hero):
+        # type: (Hero) -> tuple
+        """
+        Gets the terms of a hero in the surrogate score against all enemies.
+        :return: a tuple (effective HP, expected damage dealt per attack gauge tick, expected damage received per
+        tick from all enemies)
+        """
 
+        enemies: list = self.get_enemies()
+        attack_speed: mpf = hero.get_final_stat("attack_speed")
+        offense: mpf = attack_speed * fsum(DamageDistribution.of_normal_attack(hero, enemy).get_expected_value()
+                                           for enemy in enemies) / max(len(enemies), 1)
+        incoming: mpf = fsum(enemy.get_final_stat("attack_speed") *
+                             DamageDistribution.of_normal_attack(enemy, hero).get_expected_value()
+                             for enemy in enemies)
+        return hero.get_final_stat("max_hp"), offense, incoming
+
+    def get_score(self, effective_hp, offense, incoming, number_of_heroes):
+        # type: (mpf, mpf, mpf, int) -> mpf
+        """
+        Gets the surrogate score of a team from the sums of its heroes' score terms: the time the enemies need to
+        defeat the team divided by the time the team needs to defeat the enemies.
+        :return: the surrogate score, higher is better
+        """
 
-class Battle:
-    """
-    This class contains attributes of a battle in this game.
-    """
+        if number_of_heroes == 0 or offense <= 0:
+            return mpf("0")
+        if incoming <= 0:
+            return mpf("inf")
 
-    def __init__(self, team1, team2):
-        # type: (Team, Team) -> None
-        self.team1: Team = team1
-        self.team2: Team = team2
-        self.winner: Team or None = None
-        self.whose_turn: Hero or None = None
+        return effective_hp * offense * number_of_heroes / (incoming * self.__enemies_hp)
 
-    def clone(self):
-        # type: () -> Battle
-        return copy.deepcopy(self)
+    def get_team_score(self, heroes):
+        # type: (list) -> mpf
+        terms: list = [self.get_hero_score_terms(hero) for hero in heroes]
+        return self.get_score(fsum(term[0] for term in terms), fsum(term[1] for term in terms),
+                              fsum(term[2] for term in terms), len(heroes))
 
+    def prune_dominated_heroes(self, heroes, terms):
+        # type: (list, list) -> list
+        """
+        Leaves out heroes with at most as much effective HP and offense and at least as much incoming damage as
+        Team.MAX_HEROES other heroes, since swapping them for any of those never lowers the surrogate score. Heroes
+        with leader or passive skills are always kept because their team effects are not in their own terms.
+        :return: a list of the indices of the heroes kept
+        """
 
-class BattleArea:
-    """
-    This class contains attributes of areas where battles take place.
-    """
+        kept_indices: list = []  # initial value
+        for i, (effective_hp, offense, incoming) in enumerate(terms):
+            if self.has_team_effects(heroes[i]):
+                kept_indices.append(i)
+                continue
 
-    def __init__(self, name, levels, clear_reward):
-        # type: (str, list, Reward) -> None
-        self.name: str = name
-        self.__levels: list = levels
-        self.clear_reward: Reward = clear_reward
-        self.is_cleared: bool = False
+            number_of_dominating_heroes: int = 0  # initial value
+            for j, (other_effective_hp, other_offense, other_incoming) in enumerate(terms):
+                # Heroes with equal terms only dominate the ones after them so that one of them is kept.
+                if i != j and other_effective_hp >= effective_hp and other_offense >= offense and \
+                        other_incoming <= incoming and (terms[j] != terms[i] or j < i):
+                    number_of_dominating_heroes += 1
+                    if number_of_dominating_heroes >= Team.MAX_HEROES:
+                        break
 
-    def get_levels(self):
-        # type: () -> list
-        return self.__levels
+            if number_of_dominating_heroes < Team.MAX_HEROES:
+                kept_indices.append(i)
 
-    def clone(self):
-        # type: () -> BattleArea
-        return copy.deepcopy(self)
+        return kept_indices
 
+    def search_candidates(self, terms, indices):
+        # type: (list, list) -> list
+        """
+        Finds the teams with the highest surrogate scores, trying every combination of heroes when there are few
+        enough of them and otherwise running a beam search adding one hero at a time.
+        :return: a list of (score, tuple of hero indices) from the highest score
+        """
 
-class Dungeon(BattleArea):
-    """
-    This class contains attributes of dungeons in this game.
-    """
+        team_size: int = min(Team.MAX_HEROES, len(indices))
 
-    POSSIBLE_DUNGEON_TYPES: list = ["ITEM", "ELEMENTAL"]
+        def score_of(combination):
+            # type: (tuple) -> mpf
+            return self.get_score(fsum(terms[i][0] for i in combination), fsum(terms[i][1] for i in combination),
+                                  fsum(terms[i][2] for i in combination), len(combination))
 
-    def __init__(self, name, levels, clear_reward, dungeon_type):
-        # type: (str, list, Reward, str) -> None
-        BattleArea.__init__(self, name, levels, clear_reward)
-        self.dungeon_type: str = dungeon_type if dungeon_type in self.POSSIBLE_DUNGEON_TYPES else \
-            self.POSSIBLE_DUNGEON_TYPES[0]
+        number_of_combinations: int = 1  # initial value
+        for i in range(team_size):
+            number_of_combinations = number_of_combinations * (len(indices) - i) // (i + 1)
 
+        if number_of_combinations <= self.MAX_EXHAUSTIVE_COMBINATIONS:
+            scored: list = [(score_of(combination), combination)
+                            for combination in itertools.combinations(indices, team_size)]
+        else:
+            beam: list = [()]
+            for size in range(team_size):
+                extended: dict = {}  # initial value
+                for combination in beam:
+                    for i in indices:
+                        if i not in combination:
+                            new_combination: tuple = tuple(sorted(combination + (i,)))
+                            if new_combination not in extended:
+                                extended[new_combination] = score_of(new_combination)
+                beam = sorted(extended, key=lambda combination: extended[combination], reverse=True)[
+                       :self.beam_width]
+            scored = [(score_of(combination), combination) for combination in beam]
+
+        scored.sort(key=lambda score_and_combination: score_and_combination[0], reverse=True)
+        return scored[:self.number_of_candidates]
+
+    def choose_leader(self, candidate_heroes):
+        # type: (list) -> tuple
+        """
+        Tries every hero with a leader skill as the leader of a team of the candidate heroes, scoring the team with
+        its team effects applied.
+        :return: a tuple (index of the best leader, surrogate score with team effects)
+        """
 
-class MapArea(BattleArea):
-    """
-    This class contains attributes of map areas for battles.
-    """
+        leader_indices: list = [i for i, hero in enumerate(candidate_heroes)
+                                if any(isinstance(skill, LeaderSkill) for skill in hero.get_skills())]
+        if len(leader_indices) == 0:
+            leader_indices = [0]
+
+        team: Team = Team(list(candidate_heroes))
+        best_leader_index: int = leader_indices[0]
+        best_score: mpf = mpf("-inf")
+        for i in leader_indices:
+            team.set_leader(candidate_heroes[i])
+            team.apply_team_effects()
+            score: mpf = self.get_team_score(candidate_heroes)
+            team.remove_team_effects()
+            if score > best_score:
+                best_leader_index, best_score = i, score
+        return best_leader_index, best_score
+
+    def get_candidate_matches(self, candidate_heroes, leader_index, candidate_number):
+        # type: (list, int, int) -> list
+        team: Team = Team(list(candidate_heroes))
+        team.set_leader(candidate_heroes[leader_index])
+        return [(str(self.seed) + ":" + str(candidate_number) + ":" + str(simulation_number) + ":" + str(stage_number),
+                 team, enemy_team.clone()) for simulation_number in range(self.number_of_simulations)
+                for stage_number, enemy_team in enumerate(self.__enemy_teams)]
+
+    def run(self):
+        # type: () -> list
+        """
+        Searches for the best teams and confirms them with simulated battles, which run in a process pool when
+        number_of_workers is more than 1.
+        :return: a list of dictionaries with "heroes", "leader", "score" and "win_rate" from the best team
+        """
 
-    def __init__(self, name, levels, clear_reward):
-        # type: (str, list, Reward) -> None
-        BattleArea.__init__(self, name, levels, clear_reward)
+        terms: list = [self.get_hero_score_terms(hero) for hero in self.create_candidate_heroes(self.__heroes)]
+        candidates: list = self.search_candidates(terms, self.prune_dominated_heroes(self.__heroes, terms))
+
+        results: list = []  # initial value
+        payloads: list = []  # initial value
+        for candidate_number, (score, combination) in enumerate(candidates):
+            candidate_heroes: list = self.create_candidate_heroes([self.__heroes[i] for i in combination])
+            leader_index, score = self.choose_leader(candidate_heroes)
+            results.append({"heroes": [self.__heroes[i] for i in combination],
+                            "leader": self.__heroes[combination[leader_index]], "score": score, "win_rate": 0.0})
+            payloads.append(self.get_candidate_matches(candidate_heroes, leader_index, candidate_number))
+
+        number_of_battles: int = self.number_of_simulations * len(self.__enemy_teams)
+        if number_of_battles > 0:
+            if self.number_of_workers > 1:
+                with ProcessPoolExecutor(self.number_of_workers) as executor:
+                    wins: list = list(executor.map(simulate_team_candidate, payloads,
+                                                   [self.max_turns] * len(payloads)))
+            else:
+                wins = [simulate_team_candidate(payload, self.max_turns) for payload in payloads]
+
+            for result, number_of_wins in zip(results, wins):
+                result["win_rate"] = number_of_wins / number_of_battles
+
+        results.sort(key=lambda result: (result["win_rate"], result["score"]), reverse=True)
+        return results
+
+    def get_best_team(self):
+        # type: () -> Team or None
+        results: list = self.run()
+        if len(results) == 0:
+            return None
 
+        best_team: Team = Team(list(results[0]["heroes"]))
+        best_team.set_leader(results[0]["leader"])
+        return best_team
 
-class Level:
+    def clone(self):
+        # type: () -> TeamOptimizer
+        return copy.deepcopy(self)
+
+
+class DifficultyCalibrator:
     """
-    This class contains attributes of levels in battle areas.
+    This class contains attributes of a sweep measuring how the win rates of reference teams against the levels of
+    dungeons and map areas fall as the levels get beaten.
+
+    Enemies at a given times_beaten are projected in closed form instead of replaying Level.get_beaten, which would
+    take 2 ** times_beaten level ups per enemy.
     """
 
-    def __init__(self, name, stages):
-        # type: (str, list) -> None
-        self.name: str = name
-        self.__stages: list = stages
-        self.is_cleared: bool = False
-        self.times_beaten: int = 0  # initial value
+    def __init__(self, battle_areas, reference_teams, max_times_beaten, win_rate_thresholds=None,
+                 number_of_simulations=16, number_of_workers=1, seed=0, max_turns=Battle.MAX_TURNS):
+        # type: (list, list, int, list or None, int, int, int, int) -> None
+        self.__battle_areas: list = battle_areas
+        self.__reference_teams: list = [reference_team.clone() for reference_team in reference_teams]
+        self.max_times_beaten: int = max_times_beaten
+        self.win_rate_thresholds: list = win_rate_thresholds if win_rate_thresholds is not None else [0.5]
+        self.number_of_simulations: int = number_of_simulations
+        self.number_of_workers: int = number_of_workers
+        self.seed: int = seed
+        self.max_turns: int = max_turns
+
+    @staticmethod
+    def project_hero(hero, number_of_level_ups):
+        # type: (Hero, int) -> Hero
+        """
+        Gets a copy of the hero as it would be after number_of_level_ups rounds of setting exp to required_exp and
+        calling Hero.level_up, like Level.get_beaten does. Every round gains one level since required_exp grows by a
+        factor of 10 ** level, so n rounds from level L multiply stats by the product of triangular(l) for l in
+        L + 1..L + n, i.e. rf(L + 1, n) * rf(L, n) / 2 ** n.
+        :return: the projected copy of the hero
+        """
 
-    def get_beaten(self):
-        # type: () -> None
+        projected_hero: Hero = hero.clone()
+        projected_hero.curr_team = None
+        if number_of_level_ups <= 0:
+            return projected_hero
+
+        levels_left: int or float = hero.max_level - hero.level
+        number_of_levels: int = number_of_level_ups if hero.required_exp > 0 or levels_left == float('inf') else \
+            levels_left  # a non-positive required_exp never grows, so the first round reaches the max level
+        number_of_levels = int(max(min(number_of_levels, levels_left), 0))
+        if number_of_levels > 0:
+            multiplier: mpf = rf(hero.level + 1, number_of_levels) * rf(hero.level, number_of_levels) / \
+                mpf("2") ** number_of_levels
+            exp_exponent: int = number_of_levels * hero.level + triangular(number_of_levels + 1)
+            projected_hero.level = hero.level + number_of_levels
+            projected_hero.required_exp = hero.required_exp * mpf("10") ** exp_exponent
+            projected_hero.attack_power = hero.attack_power * multiplier
+            projected_hero.max_hp = hero.max_hp * multiplier
+            projected_hero.max_magic_points = hero.max_magic_points * multiplier
+            projected_hero.defense = hero.defense * multiplier
+
+        # exp is set to required_exp at the start of the last round, before its level up if there is one.
+        projected_hero.exp = projected_hero.required_exp if number_of_levels < number_of_level_ups else \
+            hero.required_exp * mpf("10") ** (exp_exponent - projected_hero.level)
+        projected_hero.restore()
+        return projected_hero
+
+    @staticmethod
+    def project_level(level, times_beaten):
+        # type: (Level, int) -> list
         """
-        Make enemies stronger once this stage is beaten.
-        :return: None
+        Projects the enemies of every stage of the level to times_beaten, which is at least level.times_beaten.
+        :return: a list of enemy teams, one per stage
         """
 
-        for stage in self.__stages:
-            for enemy in stage.get_enemies_list():
-                for i in range(2 ** self.times_beaten):
-                    enemy.exp = enemy.required_exp
-                    enemy.level_up()
+        number_of_level_ups: int = 2 ** times_beaten - 2 ** level.times_beaten
+        return [Team([DifficultyCalibrator.project_hero(enemy, number_of_level_ups)
+                      for enemy in stage.get_enemies_list()]) for stage in level.get_stages()]
 
-        self.times_beaten += 1
+    def get_run_seed(self, battle_area_number, level_number, times_beaten, reference_team_number, run_number):
+        # type: (int, int, int, int, int) -> str
+        return ":".join(str(number) for number in [self.seed, battle_area_number, level_number, times_beaten,
+                                                    reference_team_number, run_number])
 
-    def get_stages(self):
+    def run(self):
         # type: () -> list
-        return self.__stages
+        """
+        Simulates every reference team against every level at every times_beaten from the level's current one up to
+        max_times_beaten. Simulations run in a process pool when number_of_workers is more than 1.
+        :return: a list of dictionaries with "battle_area", "level", "reference_team", "win_rates" (times_beaten ->
+        win rate) and "breakpoints" (threshold -> first times_beaten with a lower win rate, or None)
+        """
+
+        tasks: list = []  # (report entry, times_beaten, runs)
+        report: list = []  # initial value
+        for battle_area_number, battle_area in enumerate(self.__battle_areas):
+            for level_number, level in enumerate(battle_area.get_levels()):
+                entries: list = [{"battle_area": battle_area.name, "level": level.name,
+                                  "reference_team": reference_team_number, "win_rates": {}, "breakpoints": {}}
+                                 for reference_team_number in range(len(self.__reference_teams))]
+                report += entries
+                for times_beaten in range(level.times_beaten, self.max_times_beaten + 1):
+                    enemy_teams: list = self.project_level(level, times_beaten)
+                    for reference_team_number, reference_team in enumerate(self.__reference_teams):
+                        tasks.append((entries[reference_team_number], times_beaten,
+                                      [(self.get_run_seed(battle_area_number, level_number, times_beaten,
+                                                          reference_team_number, run_number), reference_team,
+                                        enemy_teams) for run_number in range(self.number_of_simulations)]))
+
+        if self.number_of_workers > 1:
+            with ProcessPoolExecutor(self.number_of_workers) as executor:
+                runs_won: list = list(executor.map(simulate_level_runs, [runs for entry, times_beaten, runs in tasks],
+                                                   [self.max_turns] * len(tasks)))
+        else:
+            runs_won = [simulate_level_runs(runs, self.max_turns) for entry, times_beaten, runs in tasks]
+
+        for (entry, times_beaten, runs), number_of_runs_won in zip(tasks, runs_won):
+            entry["win_rates"][times_beaten] = number_of_runs_won / len(runs) if len(runs) > 0 else 0.0
+
+        for entry in report:
+            for threshold in self.win_rate_thresholds:
+                entry["breakpoints"][threshold] = next((times_beaten for times_beaten, win_rate in
+                                                        sorted(entry["win_rates"].items()) if win_rate < threshold),
+                                                       None)
+        return report
 
     def clone(self):
-        # type: () -> Level
+        # type: () -> DifficultyCalibrator
         return copy.deepcopy(self)
 
 
-class LevelStage:
+class HeroTemplate:
     """
-    This class contains attributes of a stage inside a level.
+    This class contains attributes of the immutable part of a hero: what every hero with the same hero_id has in
+    common. Heroes keep a reference to their template instead of copies of it, so copying a hero never copies its
+    template. Templates are registered by hero_id while any hero uses them, so heroes created again with the same
+    values share the registered template.
     """
 
-    def __init__(self, enemies_list):
-        # type: (list) -> None
-        self.__enemies_list: list = enemies_list
-        self.is_cleared: bool = False
+    __templates: weakref.WeakValueDictionary = weakref.WeakValueDictionary()  # hero ID -> template
 
-    def get_enemies_list(self):
+    def __init__(self, hero_id, name, element, type_, max_hp, max_magic_points, attack_power, defense, attack_speed,
+                 skills, secondary_awaken_exp_required, awaken_bonus, secondary_awaken_bonus, immunities=None):
+        # type: (str, str, str, str, mpf, mpf, mpf, mpf, mpf, list, mpf, AwakenBonus, SecondaryAwakenBonus, list) -> None
+        self.hero_id: str = hero_id
+        self.name: str = name
+        self.element: str = element if element in Hero.POSSIBLE_ELEMENTS else Hero.POSSIBLE_ELEMENTS[0]
+        self.type: str = type_ if type_ in Hero.POSSIBLE_HERO_TYPES else Hero.POSSIBLE_HERO_TYPES[0]
+        self.max_hp: mpf = max_hp
+        self.max_magic_points: mpf = max_magic_points
+        self.attack_power: mpf = attack_power
+        self.defense: mpf = defense
+        self.attack_speed: mpf = attack_speed
+        self.__skills: tuple = tuple(skills)
+        self.secondary_awaken_exp_required: mpf = secondary_awaken_exp_required
+        self.awaken_bonus: AwakenBonus = awaken_bonus
+        self.secondary_awaken_bonus: SecondaryAwakenBonus = secondary_awaken_bonus
+        self.__immunities: list = immunities if immunities is not None else []
+
+    def __copy__(self):
+        # type: () -> HeroTemplate
+        return self
+
+    def __deepcopy__(self, memo):
+        # type: (dict) -> HeroTemplate
+        return self
+
+    @staticmethod
+    def __is_same_value(value, other):
+        # type: (object, object) -> bool
+        if value is other:
+            return True
+        if type(value) is not type(other):
+            return False
+        if isinstance(value, (list, tuple)):
+            return len(value) == len(other) and all(HeroTemplate.__is_same_value(element, other_element)
+                                                    for element, other_element in zip(value, other))
+        if isinstance(value, dict):
+            return value.keys() == other.keys() and all(HeroTemplate.__is_same_value(element, other[key])
+                                                        for key, element in value.items())
+        if type(value).__eq__ is object.__eq__ and hasattr(value, "__dict__"):  # e.g. skills, compared by attributes
+            return HeroTemplate.__is_same_value(vars(value), vars(other))
+        return value == other
+
+    @staticmethod
+    def get_shared(hero_id, name, element, type_, max_hp, max_magic_points, attack_power, defense, attack_speed,
+                   skills, secondary_awaken_exp_required, awaken_bonus, secondary_awaken_bonus, immunities=None):
+        # type: (str, str, str, str, mpf, mpf, mpf, mpf, mpf, list, mpf, AwakenBonus, SecondaryAwakenBonus, list) -> HeroTemplate
+        """
+        Gets the registered template with hero_id if it has the same values, or creates and registers a new one.
+        Heroes created with the same hero_id but different values, e.g. random heroes, keep templates of their own.
+        :return: the template
+        """
+
+        template: HeroTemplate = HeroTemplate(hero_id, name, element, type_, max_hp, max_magic_points, attack_power,
+                                              defense, attack_speed, skills, secondary_awaken_exp_required,
+                                              awaken_bonus, secondary_awaken_bonus, immunities)
+        registered_template: HeroTemplate or None = HeroTemplate.__templates.get(hero_id)
+        if registered_template is not None and HeroTemplate.__is_same_value(registered_template, template):
+            return registered_template
+        HeroTemplate.__templates[hero_id] = template
+        return template
+
+    def get_skills(self):
+        # type: () -> tuple
+        return self.__skills
+
+    def get_immunities(self):
         # type: () -> list
-        return self.__enemies_list
+        return self.__immunities
+
+    def create_hero(self, rating):
+        # type: (int) -> Hero
+        return Hero.from_template(self, rating)
 
     def clone(self):
-        # type: () -> LevelStage
-        return copy.deepcopy(self)
+        # type: () -> HeroTemplate
+        return self
 
 
 class Hero:
@@ -376,31 +2100,58 @@ class Hero:
     MAX_BUFFS: int = 10
     MIN_DEBUFFS: int = 0
     MAX_DEBUFFS: int = 10
+    ZERO: mpf = mpf("0")  # shared by every zero stat since mpf values are immutable
+    __slots__: tuple = ("__template", "rating", "level", "max_level", "limit_break_applied", "exp", "required_exp",
+                         "curr_hp", "max_hp", "curr_magic_points", "max_magic_points", "attack_power", "defense",
+                         "attack_speed", "crit_rate", "crit_damage", "resistance", "accuracy",
+                         "reflected_damage_percentage", "crit_resist", "glancing_hit_chance", "life_drain_percentage",
+                         "extra_turn_chance", "counterattack_chance", "stun_rate", "__buffs", "__debuffs", "__skills",
+                         "attack_gauge_up_per_hp_percentage_down", "attack_gauge", "starting_turns_with_immunity",
+                         "secondary_awaken_exp", "can_reduce_enemies_max_hp", "turns_gained", "crits_dealt",
+                         "has_awakened", "is_locked", "has_secondary_awakened", "curr_team",
+                         "battle_attack_power_percentage_up", "battle_defense_percentage_up",
+                         "battle_attack_speed_percentage_up", "battle_max_hp_percentage_up", "battle_crit_rate_up",
+                         "battle_crit_damage_up", "battle_accuracy_up", "battle_resistance_up",
+                         "battle_max_magic_points_percentage_up", "battle_additional_damage_percentage_received",
+                         "battle_damage_percentage_reduced", "battle_damage_per_turn", "battle_max_hp_percentage_down",
+                         "battle_attack_power_percentage_down", "battle_defense_percentage_down",
+                         "battle_attack_speed_percentage_down", "battle_counterattack_chance_up",
+                         "battle_reflected_damage_percentage_up", "battle_shield_amount_percentage",
+                         "battle_recovery_percentage_per_turn", "battle_dodge_attack_chance", "battle_max_hp_up",
+                         "battle_max_magic_points_up", "battle_attack_power_up", "battle_defense_up",
+                         "battle_attack_speed_up", "__battle_immunities", "__gears", "gear_version", "stat_modifiers")
 
     def __init__(self, hero_id, name, element, type_, rating,
                  max_hp, max_magic_points, attack_power, defense, attack_speed, skills, secondary_awaken_exp_required,
                  awaken_bonus, secondary_awaken_bonus, immunities=None):
         # type: (str, str, str, str, int, mpf, mpf, mpf, mpf, mpf, list, mpf, AwakenBonus, SecondaryAwakenBonus, list) -> None
-        if immunities is None:
-            immunities = []
-        self.__immunities: list = immunities
-        self.hero_id: str = hero_id
-        self.name: str = name
-        self.element: str = element if element in self.POSSIBLE_ELEMENTS else self.POSSIBLE_ELEMENTS[0]
-        self.type: str = type_ if type_ in self.POSSIBLE_HERO_TYPES else self.POSSIBLE_HERO_TYPES[0]
+        self.__set_up(HeroTemplate.get_shared(hero_id, name, element, type_, max_hp, max_magic_points, attack_power,
+                                              defense, attack_speed, skills, secondary_awaken_exp_required,
+                                              awaken_bonus, secondary_awaken_bonus, immunities), rating)
+
+    @staticmethod
+    def from_template(template, rating):
+        # type: (HeroTemplate, int) -> Hero
+        hero: Hero = Hero.__new__(Hero)
+        hero.__set_up(template, rating)
+        return hero
+
+    def __set_up(self, template, rating):
+        # type: (HeroTemplate, int) -> None
+        self.__template: HeroTemplate = template
         self.rating: int = rating if self.MIN_RATING <= rating <= self.MAX_RATING else self.MIN_RATING
         self.level: int = self.MIN_LEVEL
         self.max_level: int = triangular(self.rating) * 10
         self.limit_break_applied: bool = False
-        self.exp: mpf = mpf("0")
+        self.exp: mpf = self.ZERO
         self.required_exp: mpf = mpf("1e6")
-        self.curr_hp: mpf = max_hp
-        self.max_hp: mpf = max_hp
-        self.curr_magic_points: mpf = max_magic_points
-        self.max_magic_points: mpf = max_magic_points
-        self.attack_power: mpf = attack_power
-        self.defense: mpf = defense
-        self.attack_speed: mpf = attack_speed
+        self.curr_hp: mpf = template.max_hp
+        self.max_hp: mpf = template.max_hp
+        self.curr_magic_points: mpf = template.max_magic_points
+        self.max_magic_points: mpf = template.max_magic_points
+        self.attack_power: mpf = template.attack_power
+        self.defense: mpf = template.defense
+        self.attack_speed: mpf = template.attack_speed
         self.crit_rate: mpf = self.MIN_CRIT_RATE
         self.crit_damage: mpf = self.MIN_CRIT_DAMAGE
         self.resistance: mpf = self.MIN_RESISTANCE
@@ -414,17 +2165,15 @@ class Hero:
         self.stun_rate: mpf = self.MIN_STUN_RATE
         self.__buffs: list = []
         self.__debuffs: list = []
-        self.__skills: list = skills  # initial value
-        self.attack_gauge_up_per_hp_percentage_down: mpf = mpf("0")
+        self.__skills: list = [self.__create_own_skill(skill) for skill in template.get_skills()]
+        self.attack_gauge_up_per_hp_percentage_down: mpf = self.ZERO
         self.attack_gauge: mpf = self.MIN_ATTACK_GAUGE
         self.starting_turns_with_immunity: int = 0
-        self.secondary_awaken_exp: mpf = mpf("0")
-        self.secondary_awaken_exp_required: mpf = secondary_awaken_exp_required
+        self.secondary_awaken_exp: mpf = self.ZERO
         self.can_reduce_enemies_max_hp: bool = False  # initial value as no destroy runes are equipped
         self.turns_gained: int = 0  # Initial number of turns gained before battles start. This will reset after
         # finishing a battle.
-        self.awaken_bonus: AwakenBonus = awaken_bonus
-        self.secondary_awaken_bonus: SecondaryAwakenBonus = secondary_awaken_bonus
+        self.crits_dealt: int = 0  # number of critical hits dealt in the current battle
         self.has_awakened: bool = False
         self.is_locked: bool = False  # initial value. This variable determines whether this hero is locked from
         # being used as power up material or not
@@ -433,29 +2182,124 @@ class Hero:
 
         # Initialising variables for stat bonus and penalties for battles from both self and ally runes which increase
         # allies' stats, passive skills, leader skills, buffs, and debuffs.
-        self.battle_attack_power_percentage_up: mpf = mpf("0")
-        self.battle_defense_percentage_up: mpf = mpf("0")
-        self.battle_attack_speed_percentage_up: mpf = mpf("0")
-        self.battle_max_hp_percentage_up: mpf = mpf("0")
-        self.battle_crit_rate_up: mpf = mpf("0")
-        self.battle_crit_damage_up: mpf = mpf("0")
-        self.battle_accuracy_up: mpf = mpf("0")
-        self.battle_resistance_up: mpf = mpf("0")
-        self.battle_max_magic_points_percentage_up: mpf = mpf("0")
-        self.battle_additional_damage_percentage_received: mpf = mpf("0")  # percentage of additional damage received. This
+        self.battle_attack_power_percentage_up: mpf = self.ZERO
+        self.battle_defense_percentage_up: mpf = self.ZERO
+        self.battle_attack_speed_percentage_up: mpf = self.ZERO
+        self.battle_max_hp_percentage_up: mpf = self.ZERO
+        self.battle_crit_rate_up: mpf = self.ZERO
+        self.battle_crit_damage_up: mpf = self.ZERO
+        self.battle_accuracy_up: mpf = self.ZERO
+        self.battle_resistance_up: mpf = self.ZERO
+        self.battle_max_magic_points_percentage_up: mpf = self.ZERO
+        self.battle_additional_damage_percentage_received: mpf = self.ZERO  # percentage of additional damage received. This
         # has something to do with branding effects.
-        self.battle_damage_percentage_reduced: mpf = mpf("0")
-        self.battle_damage_per_turn: mpf = mpf("0")
-        self.battle_max_hp_percentage_down: mpf = mpf("0")
-        self.battle_attack_power_percentage_down: mpf = mpf("0")
-        self.battle_defense_percentage_down: mpf = mpf("0")
-        self.battle_attack_speed_percentage_down: mpf = mpf("0")
-        self.battle_counterattack_chance_up: mpf = mpf("0")
-        self.battle_reflected_damage_percentage_up: mpf = mpf("0")
-        self.battle_shield_amount_percentage: mpf = mpf("0")
-        self.battle_recovery_percentage_per_turn: mpf = mpf("0")
-        self.battle_dodge_attack_chance: mpf = mpf("0")
+        self.battle_damage_percentage_reduced: mpf = self.ZERO
+        self.battle_damage_per_turn: mpf = self.ZERO
+        self.battle_max_hp_percentage_down: mpf = self.ZERO
+        self.battle_attack_power_percentage_down: mpf = self.ZERO
+        self.battle_defense_percentage_down: mpf = self.ZERO
+        self.battle_attack_speed_percentage_down: mpf = self.ZERO
+        self.battle_counterattack_chance_up: mpf = self.ZERO
+        self.battle_reflected_damage_percentage_up: mpf = self.ZERO
+        self.battle_shield_amount_percentage: mpf = self.ZERO
+        self.battle_recovery_percentage_per_turn: mpf = self.ZERO
+        self.battle_dodge_attack_chance: mpf = self.ZERO
+        self.battle_max_hp_up: mpf = self.ZERO  # flat bonuses are added after percentage bonuses are applied
+        self.battle_max_magic_points_up: mpf = self.ZERO
+        self.battle_attack_power_up: mpf = self.ZERO
+        self.battle_defense_up: mpf = self.ZERO
+        self.battle_attack_speed_up: mpf = self.ZERO
         self.__battle_immunities: list = []  # initial value
+        self.__gears: dict = {}  # slot number -> gear equipped in that slot
+        self.gear_version: int = 0  # increases whenever gears are equipped or unequipped
+        self.stat_modifiers: StatModifierStack = StatModifierStack(self)
+        for skill in self.__skills:
+            self.__add_passive_skill_modifiers(skill)
+
+    def __deepcopy__(self, memo):
+        # type: (dict) -> Hero
+        # Skills of the template are shared by every hero with the same template and numbers are immutable, so neither
+        # are copied.
+        for skill in self.__template.get_skills():
+            memo.setdefault(id(skill), skill)
+
+        hero: Hero = Hero.__new__(Hero)
+        memo[id(self)] = hero
+        for slot in self.__slots__:
+            attribute_name: str = "_Hero" + slot if slot.startswith("__") else slot
+            value: object = getattr(self, attribute_name)
+            setattr(hero, attribute_name, value if isinstance(value, NUMBER_TYPES) else copy.deepcopy(value, memo))
+        return hero
+
+    def __setstate__(self, state):
+        # type: (tuple or dict) -> None
+        """
+        Sets the state of an unpickled hero. Heroes pickled before they had templates hold all of their attributes in
+        a dictionary, so their template attributes are turned into a template shared through the registry and the
+        attributes their save does not have get their initial values.
+        :return: None
+        """
+
+        dict_state, slot_state = state if isinstance(state, tuple) else (state, None)
+        attributes: dict = dict(dict_state or {}, **(slot_state or {}))
+        if "_Hero__template" not in attributes:
+            self.__set_up(HeroTemplate.get_shared(
+                attributes["hero_id"], attributes["name"], attributes["element"], attributes["type"],
+                attributes["max_hp"], attributes["max_magic_points"], attributes["attack_power"],
+                attributes["defense"], attributes["attack_speed"], attributes["_Hero__skills"],
+                attributes["secondary_awaken_exp_required"], attributes["awaken_bonus"],
+                attributes["secondary_awaken_bonus"], attributes.get("_Hero__immunities")),
+                attributes.get("rating", self.MIN_RATING))
+
+        for slot in self.__slots__:
+            attribute_name: str = "_Hero" + slot if slot.startswith("__") else slot
+            if attribute_name in attributes:
+                setattr(self, attribute_name, attributes[attribute_name])
+
+    @staticmethod
+    def __create_own_skill(skill):
+        # type: (Skill) -> Skill
+        # Special powers keep their cooltimes, so every hero needs its own copy of them.
+        return copy.copy(skill) if isinstance(skill, SpecialPower) else skill
+
+    def get_template(self):
+        # type: () -> HeroTemplate
+        return self.__template
+
+    @property
+    def hero_id(self):
+        # type: () -> str
+        return self.__template.hero_id
+
+    @property
+    def name(self):
+        # type: () -> str
+        return self.__template.name
+
+    @property
+    def element(self):
+        # type: () -> str
+        return self.__template.element
+
+    @property
+    def type(self):
+        # type: () -> str
+        return self.__template.type
+
+    @property
+    def secondary_awaken_exp_required(self):
+        # type: () -> mpf
+        return self.__template.secondary_awaken_exp_required
+
+    @property
+    def awaken_bonus(self):
+        # type: () -> AwakenBonus
+        return self.__template.awaken_bonus
+
+    @property
+    def secondary_awaken_bonus(self):
+        # type: () -> SecondaryAwakenBonus
+        return self.__template.secondary_awaken_bonus
 
     def get_battle_immunities(self):
         # type: () -> list
@@ -463,7 +2307,7 @@ class Hero:
 
     def get_immunities(self):
         # type: () -> list
-        return self.__immunities
+        return self.__template.get_immunities()
 
     def get_skills(self):
         # type: () -> list
@@ -472,14 +2316,102 @@ class Hero:
     def add_skill(self, skill):
         # type: (Skill) -> None
         self.__skills.append(skill)
+        self.__add_passive_skill_modifiers(skill)
 
     def remove_skill(self, skill):
         # type: (Skill) -> bool
         if skill in self.__skills:
             self.__skills.remove(skill)
+            self.stat_modifiers.remove_layer(("PASSIVE", skill))
             return True
         return False
 
+    def __add_passive_skill_modifiers(self, skill):
+        # type: (Skill) -> None
+        if isinstance(skill, PassiveSkill):
+            self.stat_modifiers.add_layer(("PASSIVE", skill),
+                                          StatModifierStack.get_passive_effect_self_modifiers(skill.passive_effect))
+
+    def get_final_stat(self, stat):
+        # type: (str) -> mpf
+        return self.stat_modifiers.get_final_stat(stat)
+
+    def get_gears(self):
+        # type: () -> dict
+        return self.__gears
+
+    def equip_gear(self, gear):
+        # type: (Gear) -> Gear or None
+        """
+        Equips the gear in its slot, updating only the stat modifiers of that slot and of the gear sets involved.
+        :return: the gear previously equipped in the slot, or None
+        """
+
+        old_gear: Gear or None = self.unequip_gear(gear.slot_number)
+        self.__gears[gear.slot_number] = gear
+        self.stat_modifiers.add_layer(("GEAR", gear.slot_number),
+                                      StatModifierStack.get_stat_increase_modifiers(gear.stat_increase))
+        self.__update_set_modifiers(gear.set_name)
+        self.__on_gears_changed()
+        return old_gear
+
+    def unequip_gear(self, slot_number):
+        # type: (int) -> Gear or None
+        gear: Gear or None = self.__gears.pop(slot_number, None)
+        if gear is not None:
+            gear.set_effect_is_active = False
+            self.stat_modifiers.remove_layer(("GEAR", slot_number))
+            self.__update_set_modifiers(gear.set_name)
+            self.__on_gears_changed()
+        return gear
+
+    def __on_gears_changed(self):
+        # type: () -> None
+        self.gear_version += 1
+        if self.curr_team is not None:
+            self.curr_team.refresh_team_effects()
+
+    def __update_set_modifiers(self, set_name):
+        # type: (str) -> None
+        gears_in_set: list = [gear for gear in self.__gears.values() if gear.set_name == set_name]
+        number_of_sets: int = len(gears_in_set) // gears_in_set[0].set_size if len(gears_in_set) > 0 else 0
+        for gear in gears_in_set:
+            gear.set_effect_is_active = number_of_sets > 0
+
+        if number_of_sets > 0:
+            self.stat_modifiers.add_layer(("SET", set_name), StatModifierStack.get_set_effect_self_modifiers(
+                gears_in_set[0].set_effect, number_of_sets))
+        else:
+            self.stat_modifiers.remove_layer(("SET", set_name))
+
+    def awaken(self):
+        # type: () -> bool
+        if self.has_awakened or self.awaken_bonus is None:
+            return False
+
+        self.has_awakened = True
+        self.stat_modifiers.add_layer("AWAKEN", StatModifierStack.get_awaken_bonus_modifiers(self.awaken_bonus))
+        if self.awaken_bonus.new_skill_gained is not None:
+            self.add_skill(self.__create_own_skill(self.awaken_bonus.new_skill_gained))
+        return True
+
+    def secondary_awaken(self):
+        # type: () -> bool
+        if not self.has_awakened or self.has_secondary_awakened or self.secondary_awaken_bonus is None or \
+                self.secondary_awaken_exp < self.secondary_awaken_exp_required:
+            return False
+
+        self.has_secondary_awakened = True
+        self.stat_modifiers.add_layer("SECONDARY AWAKEN", StatModifierStack.get_secondary_awaken_bonus_modifiers(
+            self.secondary_awaken_bonus))
+        upgraded_skills: list = self.secondary_awaken_bonus.get_new_upgraded_skills_list()
+        if len(upgraded_skills) > 0:
+            for skill in list(self.__skills):
+                self.remove_skill(skill)
+            for skill in upgraded_skills:
+                self.add_skill(self.__create_own_skill(skill))
+        return True
+
     def apply_limit_break(self):
         # type: () -> bool
         if not self.limit_break_applied and self.level == self.max_level and self.rating == self.MAX_RATING:
@@ -496,9 +2428,23 @@ class Hero:
 
     def restore(self):
         # type: () -> None
-        self.curr_hp = self.max_hp
+        self.curr_hp = self.get_final_stat("max_hp")  # max HP with the battle_max_hp_* totals of every layer
         self.curr_magic_points = self.max_magic_points
 
+    def prepare_for_battle(self):
+        # type: () -> None
+        for buff in list(self.__buffs):
+            self.remove_buff(buff)
+        for debuff in list(self.__debuffs):
+            self.remove_debuff(debuff)
+        self.restore()  # after buffs and debuffs of the last battle stop changing the max HP
+        self.attack_gauge = self.MIN_ATTACK_GAUGE
+        self.turns_gained = 0
+        self.crits_dealt = 0
+        for skill in self.__skills:
+            if isinstance(skill, SpecialPower):
+                skill.cooltime = skill.max_cooltime
+
     def level_up(self):
         # type: () -> None
         while self.exp >= self.required_exp:
@@ -513,18 +2459,18 @@ class Hero:
             self.defense *= triangular(self.level)
             self.restore()
 
-    def normal_attack(self, other):
-        # type: (Hero) -> None
+    def normal_attack(self, other, rng=None):
+        # type: (Hero, random.Random or None) -> None
         action: Action = Action("NORMAL ATTACK")
-        action.execute(self, other)
+        action.execute(self, other, rng=rng)
 
     def normal_heal(self, other):
         # type: (Hero) -> None
         action: Action = Action("NORMAL HEAL")
         action.execute(self, other)
 
-    def use_skill(self, other, skill):
-        # type: (Hero, Skill) -> bool
+    def use_skill(self, other, skill, rng=None):
+        # type: (Hero, Skill, random.Random or None) -> bool
         if skill not in self.__skills:
             return False
 
@@ -532,7 +2478,9 @@ class Hero:
             return False
 
         action: Action = Action("USE SKILL")
-        action.execute(self, other, skill)
+        if not action.execute(self, other, skill, rng):
+            return False
+
         self.curr_magic_points -= skill.magic_points_cost
         return True
 
@@ -548,6 +2496,7 @@ class Hero:
         # type: (Buff) -> bool
         if len(self.__buffs) < self.MAX_BUFFS:
             self.__buffs.append(buff)
+            self.stat_modifiers.add_layer(buff, StatModifierStack.get_buff_modifiers(buff))
             return True
         return False
 
@@ -555,6 +2504,7 @@ class Hero:
         # type: (Buff) -> bool
         if buff in self.__buffs:
             self.__buffs.remove(buff)
+            self.stat_modifiers.remove_layer(buff)
             return True
         return False
 
@@ -566,6 +2516,7 @@ class Hero:
         # type: (Debuff) -> bool
         if len(self.__debuffs) < self.MAX_DEBUFFS:
             self.__debuffs.append(debuff)
+            self.stat_modifiers.add_layer(debuff, StatModifierStack.get_debuff_modifiers(debuff))
             return True
         return False
 
@@ -573,6 +2524,7 @@ class Hero:
         # type: (Debuff) -> bool
         if debuff in self.__debuffs:
             self.__debuffs.remove(debuff)
+            self.stat_modifiers.remove_layer(debuff)
             return True
         return False
 
@@ -581,6 +2533,286 @@ class Hero:
         return copy.deepcopy(self)
 
 
+class StatModifierStack:
+    """
+    This class contains attributes of the layers of stat modifiers of a hero, e.g. awaken bonuses, gears, gear sets,
+    passive skills, leader skills, buffs and debuffs.
+
+    Each layer maps (stat, kind) to a value. The stack keeps a running total of every (stat, kind) and copies the
+    totals into the hero's battle_* fields, so adding or removing a layer only touches the stats in that layer.
+    Scaled stats end up as base * (1 + PERCENTAGE UP / 100 - PERCENTAGE DOWN / 100) + FLAT and other stats as
+    base + UP.
+    """
+
+    SCALED_STATS: list = ["max_hp", "max_magic_points", "attack_power", "defense", "attack_speed"]
+    POSSIBLE_KINDS: list = ["FLAT", "PERCENTAGE UP", "PERCENTAGE DOWN", "UP"]
+    BATTLE_FIELDS: dict = {
+        ("max_hp", "FLAT"): "battle_max_hp_up",
+        ("max_hp", "PERCENTAGE UP"): "battle_max_hp_percentage_up",
+        ("max_hp", "PERCENTAGE DOWN"): "battle_max_hp_percentage_down",
+        ("max_magic_points", "FLAT"): "battle_max_magic_points_up",
+        ("max_magic_points", "PERCENTAGE UP"): "battle_max_magic_points_percentage_up",
+        ("attack_power", "FLAT"): "battle_attack_power_up",
+        ("attack_power", "PERCENTAGE UP"): "battle_attack_power_percentage_up",
+        ("attack_power", "PERCENTAGE DOWN"): "battle_attack_power_percentage_down",
+        ("defense", "FLAT"): "battle_defense_up",
+        ("defense", "PERCENTAGE UP"): "battle_defense_percentage_up",
+        ("defense", "PERCENTAGE DOWN"): "battle_defense_percentage_down",
+        ("attack_speed", "FLAT"): "battle_attack_speed_up",
+        ("attack_speed", "PERCENTAGE UP"): "battle_attack_speed_percentage_up",
+        ("attack_speed", "PERCENTAGE DOWN"): "battle_attack_speed_percentage_down",
+        ("crit_rate", "UP"): "battle_crit_rate_up",
+        ("crit_damage", "UP"): "battle_crit_damage_up",
+        ("resistance", "UP"): "battle_resistance_up",
+        ("accuracy", "UP"): "battle_accuracy_up",
+        ("damage_percentage_reduced", "UP"): "battle_damage_percentage_reduced",
+        ("counterattack_chance", "UP"): "battle_counterattack_chance_up",
+        ("reflected_damage_percentage", "UP"): "battle_reflected_damage_percentage_up",
+        ("shield_amount_percentage", "UP"): "battle_shield_amount_percentage",
+        ("recovery_percentage_per_turn", "UP"): "battle_recovery_percentage_per_turn",
+        ("additional_damage_percentage_received", "UP"): "battle_additional_damage_percentage_received",
+        ("damage_per_turn", "UP"): "battle_damage_per_turn",
+        ("dodge_attack_chance", "UP"): "battle_dodge_attack_chance"
+    }  # (stat, kind) -> name of the battle field of the hero holding the total
+    ZERO: mpf = mpf("0")
+    __buff_modifiers: dict = {}  # buff name -> layer shared by every buff with that name
+    __debuff_modifiers: dict = {}  # debuff name -> layer shared by every debuff with that name
+
+    def __init__(self, hero):
+        # type: (Hero) -> None
+        self.hero: Hero = hero
+        self.__layers: dict = {}  # layer key -> dict of (stat, kind) -> value
+        self.__totals: dict = {}  # (stat, kind) -> total value of all layers
+
+    def get_layers(self):
+        # type: () -> dict
+        return self.__layers
+
+    def get_total(self, stat, kind):
+        # type: (str, str) -> mpf
+        return self.__totals.get((stat, kind), self.ZERO)
+
+    def __apply(self, modifiers, sign):
+        # type: (dict, int) -> None
+        for stat_and_kind, value in modifiers.items():
+            total: mpf = self.__totals.get(stat_and_kind, self.ZERO) + sign * value
+            self.__totals[stat_and_kind] = total
+            if stat_and_kind in self.BATTLE_FIELDS:
+                setattr(self.hero, self.BATTLE_FIELDS[stat_and_kind], total)
+
+    def add_layer(self, key, modifiers):
+        # type: (object, dict) -> None
+        """
+        Adds a layer of modifiers, replacing the layer with the same key if there is one.
+        :return: None
+        """
+
+        self.remove_layer(key)
+        self.__layers[key] = modifiers
+        self.__apply(modifiers, 1)
+
+    def remove_layer(self, key):
+        # type: (object) -> bool
+        if key in self.__layers:
+            self.__apply(self.__layers.pop(key), -1)
+            return True
+        return False
+
+    def get_final_stat(self, stat):
+        # type: (str) -> mpf
+        base: mpf = getattr(self.hero, stat, mpf("0"))
+        if stat in self.SCALED_STATS:
+            return base * (1 + self.get_total(stat, "PERCENTAGE UP") / 100 -
+                           self.get_total(stat, "PERCENTAGE DOWN") / 100) + self.get_total(stat, "FLAT")
+        return base + self.get_total(stat, "UP")
+
+    @staticmethod
+    def create_modifiers(values):
+        # type: (list) -> dict
+        """
+        Creates a layer of modifiers from (stat, kind, value) entries, leaving out entries with zero values.
+        :return: a dictionary of (stat, kind) -> value
+        """
+
+        modifiers: dict = {}  # initial value
+        for stat, kind, value in values:
+            if value:
+                modifiers[(stat, kind)] = modifiers.get((stat, kind), mpf("0")) + value
+        return modifiers
+
+    @staticmethod
+    def get_awaken_bonus_modifiers(awaken_bonus):
+        # type: (AwakenBonus) -> dict
+        return StatModifierStack.create_modifiers([
+            ("max_hp", "PERCENTAGE UP", awaken_bonus.max_hp_percentage_up),
+            ("max_magic_points", "PERCENTAGE UP", awaken_bonus.max_magic_points_percentage_up),
+            ("attack_power", "PERCENTAGE UP", awaken_bonus.attack_power_percentage_up),
+            ("defense", "PERCENTAGE UP", awaken_bonus.defense_percentage_up),
+            ("attack_speed", "FLAT", awaken_bonus.attack_speed_up),
+            ("crit_rate", "UP", awaken_bonus.crit_rate_up),
+            ("crit_damage", "UP", awaken_bonus.crit_damage_up),
+            ("resistance", "UP", awaken_bonus.resistance_up),
+            ("accuracy", "UP", awaken_bonus.accuracy_up)
+        ])
+
+    @staticmethod
+    def get_secondary_awaken_bonus_modifiers(secondary_awaken_bonus):
+        # type: (SecondaryAwakenBonus) -> dict
+        return StatModifierStack.create_modifiers([
+            ("max_hp", "PERCENTAGE UP", secondary_awaken_bonus.max_hp_percentage_up),
+            ("max_magic_points", "PERCENTAGE UP", secondary_awaken_bonus.max_magic_points_percentage_up),
+            ("attack_power", "PERCENTAGE UP", secondary_awaken_bonus.attack_power_percentage_up),
+            ("defense", "PERCENTAGE UP", secondary_awaken_bonus.defense_percentage_up)
+        ])
+
+    @staticmethod
+    def get_stat_increase_modifiers(stat_increase):
+        # type: (StatIncrease) -> dict
+        return StatModifierStack.create_modifiers([
+            ("max_hp", "FLAT", stat_increase.max_hp_up),
+            ("max_hp", "PERCENTAGE UP", stat_increase.max_hp_percentage_up),
+            ("max_magic_points", "FLAT", stat_increase.max_magic_points_up),
+            ("max_magic_points", "PERCENTAGE UP", stat_increase.max_magic_points_percentage_up),
+            ("attack_power", "FLAT", stat_increase.attack_up),
+            ("attack_power", "PERCENTAGE UP", stat_increase.attack_percentage_up),
+            ("defense", "FLAT", stat_increase.defense_up),
+            ("defense", "PERCENTAGE UP", stat_increase.defense_percentage_up),
+            ("attack_speed", "FLAT", stat_increase.attack_speed_up),
+            ("crit_rate", "UP", stat_increase.crit_rate_up),
+            ("crit_damage", "UP", stat_increase.crit_damage_up),
+            ("resistance", "UP", stat_increase.resistance_up),
+            ("accuracy", "UP", stat_increase.accuracy_up)
+        ])
+
+    @staticmethod
+    def get_set_effect_self_modifiers(set_effect, number_of_sets=1):
+        # type: (SetEffect, int) -> dict
+        return StatModifierStack.create_modifiers([
+            ("max_hp", "PERCENTAGE UP", set_effect.max_hp_percentage_up * number_of_sets),
+            ("max_magic_points", "PERCENTAGE UP", set_effect.max_magic_points_percentage_up * number_of_sets),
+            ("attack_power", "PERCENTAGE UP", set_effect.attack_power_percentage_up * number_of_sets),
+            ("defense", "PERCENTAGE UP", set_effect.defense_percentage_up * number_of_sets),
+            ("attack_speed", "PERCENTAGE UP", set_effect.attack_speed_percentage_up * number_of_sets),
+            ("crit_rate", "UP", set_effect.crit_rate_up * number_of_sets),
+            ("crit_damage", "UP", set_effect.crit_damage_up * number_of_sets),
+            ("resistance", "UP", set_effect.resistance_up * number_of_sets),
+            ("accuracy", "UP", set_effect.accuracy_up * number_of_sets),
+            ("counterattack_chance", "UP", set_effect.counterattack_chance_up * number_of_sets),
+            ("reflected_damage_percentage", "UP", set_effect.reflected_damage_percentage_up * number_of_sets)
+        ])
+
+    @staticmethod
+    def get_set_effect_allies_modifiers(set_effect, number_of_sets=1):
+        # type: (SetEffect, int) -> dict
+        return StatModifierStack.create_modifiers([
+            ("max_hp", "PERCENTAGE UP", set_effect.allies_max_hp_percentage_up * number_of_sets),
+            ("max_magic_points", "PERCENTAGE UP", set_effect.allies_max_magic_points_percentage_up * number_of_sets),
+            ("attack_power", "PERCENTAGE UP", set_effect.allies_attack_power_percentage_up * number_of_sets),
+            ("defense", "PERCENTAGE UP", set_effect.allies_defense_percentage_up * number_of_sets),
+            ("resistance", "UP", set_effect.allies_resistance_up * number_of_sets),
+            ("accuracy", "UP", set_effect.allies_accuracy_up * number_of_sets),
+            ("shield_amount_percentage", "UP", set_effect.ally_shield_amount_percentage_up * number_of_sets)
+        ])
+
+    @staticmethod
+    def get_passive_effect_self_modifiers(passive_effect):
+        # type: (PassiveEffect) -> dict
+        return StatModifierStack.create_modifiers([
+            ("max_hp", "PERCENTAGE UP", passive_effect.self_max_hp_percentage_up),
+            ("max_magic_points", "PERCENTAGE UP", passive_effect.self_max_magic_points_percentage_up),
+            ("attack_power", "PERCENTAGE UP", passive_effect.self_attack_power_percentage_up),
+            ("defense", "PERCENTAGE UP", passive_effect.self_defense_percentage_up),
+            ("attack_speed", "PERCENTAGE UP", passive_effect.self_attack_speed_percentage_up),
+            ("crit_rate", "UP", passive_effect.self_crit_rate_up),
+            ("crit_damage", "UP", passive_effect.self_crit_damage_up),
+            ("resistance", "UP", passive_effect.self_resistance_up),
+            ("accuracy", "UP", passive_effect.self_accuracy_up),
+            ("damage_percentage_reduced", "UP", passive_effect.self_damage_percentage_reduced),
+            ("dodge_attack_chance", "UP", passive_effect.dodge_attack_chance)
+        ])
+
+    @staticmethod
+    def get_passive_effect_allies_modifiers(passive_effect):
+        # type: (PassiveEffect) -> dict
+        return StatModifierStack.create_modifiers([
+            ("max_hp", "PERCENTAGE UP", passive_effect.allies_max_hp_percentage_up),
+            ("max_magic_points", "PERCENTAGE UP", passive_effect.allies_max_magic_points_percentage_up),
+            ("attack_power", "PERCENTAGE UP", passive_effect.allies_attack_power_percentage_up),
+            ("defense", "PERCENTAGE UP", passive_effect.allies_defense_percentage_up),
+            ("attack_speed", "PERCENTAGE UP", passive_effect.allies_attack_speed_percentage_up),
+            ("crit_rate", "UP", passive_effect.allies_crit_rate_up),
+            ("crit_damage", "UP", passive_effect.allies_crit_damage_up),
+            ("resistance", "UP", passive_effect.allies_resistance_up),
+            ("accuracy", "UP", passive_effect.allies_accuracy_up),
+            ("damage_percentage_reduced", "UP", passive_effect.allies_damage_percentage_reduced)
+        ])
+
+    @staticmethod
+    def get_leader_effect_modifiers(leader_effect):
+        # type: (LeaderEffect) -> dict
+        return StatModifierStack.create_modifiers([
+            ("max_hp", "PERCENTAGE UP", leader_effect.allies_max_hp_percentage_up),
+            ("max_magic_points", "PERCENTAGE UP", leader_effect.allies_max_magic_points_percentage_up),
+            ("attack_power", "PERCENTAGE UP", leader_effect.allies_attack_power_percentage_up),
+            ("defense", "PERCENTAGE UP", leader_effect.allies_defense_percentage_up),
+            ("attack_speed", "PERCENTAGE UP", leader_effect.allies_attack_speed_percentage_up),
+            ("crit_rate", "UP", leader_effect.allies_crit_rate_up),
+            ("crit_damage", "UP", leader_effect.allies_crit_damage_up),
+            ("resistance", "UP", leader_effect.allies_resistance_up),
+            ("accuracy", "UP", leader_effect.allies_accuracy_up)
+        ])
+
+    @staticmethod
+    def get_buff_modifiers(buff):
+        # type: (Buff) -> dict
+        # The modifiers of a buff only depend on its name, so every buff with the same name shares one layer.
+        modifiers: dict or None = StatModifierStack.__buff_modifiers.get(buff.name)
+        if modifiers is None:
+            modifiers = StatModifierStack.__create_buff_modifiers(buff)
+            StatModifierStack.__buff_modifiers[buff.name] = modifiers
+        return modifiers
+
+    @staticmethod
+    def __create_buff_modifiers(buff):
+        # type: (Buff) -> dict
+        return StatModifierStack.create_modifiers([
+            ("attack_power", "PERCENTAGE UP", buff.attack_percentage_up),
+            ("defense", "PERCENTAGE UP", buff.defense_percentage_up),
+            ("attack_speed", "PERCENTAGE UP", buff.attack_speed_percentage_up),
+            ("crit_rate", "UP", buff.crit_rate_up),
+            ("crit_resist", "UP", buff.crit_resist_up),
+            ("counterattack_chance", "UP", buff.counterattack_chance_up),
+            ("reflected_damage_percentage", "UP", buff.reflected_damage_percentage_up),
+            ("shield_amount_percentage", "UP", buff.shield_amount_percentage_up),
+            ("recovery_percentage_per_turn", "UP", buff.recovery_percentage_per_turn_up)
+        ])
+
+    @staticmethod
+    def get_debuff_modifiers(debuff):
+        # type: (Debuff) -> dict
+        modifiers: dict or None = StatModifierStack.__debuff_modifiers.get(debuff.name)
+        if modifiers is None:
+            modifiers = StatModifierStack.__create_debuff_modifiers(debuff)
+            StatModifierStack.__debuff_modifiers[debuff.name] = modifiers
+        return modifiers
+
+    @staticmethod
+    def __create_debuff_modifiers(debuff):
+        # type: (Debuff) -> dict
+        return StatModifierStack.create_modifiers([
+            ("attack_power", "PERCENTAGE DOWN", debuff.attack_power_percentage_down),
+            ("defense", "PERCENTAGE DOWN", debuff.defense_percentage_down),
+            ("attack_speed", "PERCENTAGE DOWN", debuff.attack_speed_percentage_down),
+            ("glancing_hit_chance", "UP", debuff.glancing_hit_chance_up),
+            ("additional_damage_percentage_received", "UP", debuff.additional_damage_percentage_received_up),
+            ("damage_per_turn", "UP", debuff.damage_over_time_percentage)
+        ])
+
+    def clone(self):
+        # type: () -> StatModifierStack
+        return copy.deepcopy(self)
+
+
 class AwakenBonus:
     """
     This class contains attributes of the awaken bonus gained for awakening a hero.
@@ -795,10 +3027,16 @@ class SpecialPower(Skill):
 class Team:
     """
     This class contains attributes of a team brought to battles.
+
+    Team effects (the leader's leader skill, allies' passive effects and ally gear sets) are computed once per team
+    composition and cached under a composition key, so applying them again to the same team only re-adds one cached
+    stat modifier layer per hero.
     """
 
     MIN_HEROES: int = 0
     MAX_HEROES: int = 5
+    MAX_CACHED_COMPOSITIONS: int = 16
+    TEAM_EFFECTS_LAYER: str = "TEAM EFFECTS"
 
     def __init__(self, heroes_list=None):
         # type: (list) -> None
@@ -806,27 +3044,37 @@ class Team:
             heroes_list = []
 
         self.__heroes_list: list = heroes_list if self.MIN_HEROES <= len(heroes_list) <= self.MAX_HEROES else []
-        self.leader: Hero or None = self.__heroes_list[0]
+        self.leader: Hero or None = self.__heroes_list[0] if len(self.__heroes_list) > 0 else None
         self.team_effects_applied: bool = False  # initial value
+        self.__team_effects_cache: dict = {}  # composition key -> list of team effect modifiers of each hero
 
     def set_leader(self, hero):
         # type: (Hero) -> bool
         if hero in self.__heroes_list:
+            is_reapplied: bool = self.remove_team_effects()
             self.leader = hero
+            if is_reapplied:
+                self.apply_team_effects()
             return True
         return False
 
     def add_hero(self, hero):
         # type: (Hero) -> bool
         if len(self.__heroes_list) < self.MAX_HEROES:
+            is_reapplied: bool = self.remove_team_effects()
             self.__heroes_list.append(hero)
             hero.curr_team = self
+            if self.leader is None:
+                self.leader = hero
+            if is_reapplied:
+                self.apply_team_effects()
             return True
         return False
 
     def remove_hero(self, hero):
         # type: (Hero) -> bool
         if hero in self.__heroes_list:
+            is_reapplied: bool = self.remove_team_effects()
             self.__heroes_list.remove(hero)
             if hero == self.leader:
                 if len(self.__heroes_list) > 0:
@@ -835,14 +3083,70 @@ class Team:
                     self.leader = None
 
             hero.curr_team = None
+            if is_reapplied:
+                self.apply_team_effects()
 
             return True
         return False
 
+    def get_composition_key(self):
+        # type: () -> tuple
+        return tuple(self.__heroes_list), self.leader, tuple(hero.gear_version for hero in self.__heroes_list)
+
+    def __compute_team_effects(self):
+        # type: () -> list
+        team_effects: list = [{} for hero in self.__heroes_list]
+
+        def add_modifiers(modifiers, excluded_hero=None):
+            # type: (dict, Hero or None) -> None
+            for hero, hero_team_effects in zip(self.__heroes_list, team_effects):
+                if hero is not excluded_hero:
+                    for stat_and_kind, value in modifiers.items():
+                        hero_team_effects[stat_and_kind] = hero_team_effects.get(stat_and_kind, mpf("0")) + value
+
+        if self.leader is not None:
+            for skill in self.leader.get_skills():
+                if isinstance(skill, LeaderSkill):
+                    add_modifiers(StatModifierStack.get_leader_effect_modifiers(skill.leader_effect))
+
+        for hero in self.__heroes_list:
+            for skill in hero.get_skills():
+                if isinstance(skill, PassiveSkill):
+                    add_modifiers(StatModifierStack.get_passive_effect_allies_modifiers(skill.passive_effect), hero)
+
+            gears_by_set_name: dict = {}  # initial value
+            for gear in hero.get_gears().values():
+                gears_by_set_name.setdefault(gear.set_name, []).append(gear)
+            for gears_in_set in gears_by_set_name.values():
+                number_of_sets: int = len(gears_in_set) // gears_in_set[0].set_size
+                if number_of_sets > 0:
+                    add_modifiers(StatModifierStack.get_set_effect_allies_modifiers(gears_in_set[0].set_effect,
+                                                                                   number_of_sets))
+
+        return team_effects
+
+    def get_team_effects(self):
+        # type: () -> list
+        """
+        Gets the team effect modifiers of every hero in this team, computing them only if this team composition is
+        not cached yet.
+        :return: a list of dictionaries of (stat, kind) -> value in the same order as the heroes
+        """
+
+        composition_key: tuple = self.get_composition_key()
+        team_effects: list or None = self.__team_effects_cache.get(composition_key)
+        if team_effects is None:
+            team_effects = self.__compute_team_effects()
+            if len(self.__team_effects_cache) >= self.MAX_CACHED_COMPOSITIONS:
+                del self.__team_effects_cache[next(iter(self.__team_effects_cache))]
+            self.__team_effects_cache[composition_key] = team_effects
+        return team_effects
+
     def apply_team_effects(self):
         # type: () -> bool
         if not self.team_effects_applied:
-            # TODO: apply stat increase effects to team members
+            for hero, hero_team_effects in zip(self.__heroes_list, self.get_team_effects()):
+                hero.stat_modifiers.add_layer(self.TEAM_EFFECTS_LAYER, hero_team_effects)
             self.team_effects_applied = True
             return True
         return False
@@ -851,17 +3155,17 @@ class Team:
         # type: () -> bool
         if self.team_effects_applied:
             for hero in self.__heroes_list:
-                hero.battle_attack_power_percentage_up = mpf("0")
-                hero.battle_max_hp_percentage_up = mpf("0")
-                hero.battle_defense_percentage_up = mpf("0")
-                hero.battle_max_magic_points_percentage_up = mpf("0")
-                hero.battle_accuracy_up = mpf("0")
-                hero.battle_resistance_up = mpf("0")
+                hero.stat_modifiers.remove_layer(self.TEAM_EFFECTS_LAYER)
 
             self.team_effects_applied = False
             return True
         return False
 
+    def refresh_team_effects(self):
+        # type: () -> None
+        if self.remove_team_effects():
+            self.apply_team_effects()
+
     def get_heroes_list(self):
         # type: () -> list
         return self.__heroes_list
@@ -904,8 +3208,9 @@ class Gear(Item):
                                          "DEFENSE", "DEFENSE PERCENTAGE", "MAX MAGIC POINTS",
                                          "MAX MAGIC POINTS PERCENTAGE"]
 
-    def __init__(self, name, description, coin_cost, rating, slot_number, set_name, primary_attribute):
-        # type: (str, str, mpf, int, int, str, str) -> None
+    def __init__(self, name, description, coin_cost, rating, slot_number, set_name, primary_attribute,
+                 stat_increase=None):
+        # type: (str, str, mpf, int, int, str, str, StatIncrease or None) -> None
         Item.__init__(self, name, description, coin_cost)
         self.rating: int = rating if self.MIN_RATING <= rating <= self.MAX_RATING else self.MIN_RATING
         self.slot_number: int = slot_number if self.MIN_SLOT_NUMBER <= slot_number <= self.MAX_SLOT_NUMBER \
@@ -914,7 +3219,9 @@ class Gear(Item):
         self.gear_type: str = str(self.POSSIBLE_GEAR_TYPES[self.slot_number - 1])
         self.level: int = 0
         self.primary_attribute: str = primary_attribute
-        self.set_effect: SetEffect = SetEffect(0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, False, 0, 0, 0, 0, 0, 0)
+        self.stat_increase: StatIncrease = stat_increase if stat_increase is not None else \
+            StatIncrease(*[mpf("0")] * 13)
+        self.set_effect: SetEffect = SetEffect(0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, False, 0, 0, 0, 0, 0, 0, 0)
         self.update_set_effect()
         self.set_effect_is_active: bool = False  # initial value
         self.level_up_coin_cost: mpf = coin_cost
@@ -924,6 +3231,28 @@ class Gear(Item):
                                                     "DETERMINATION", "ENHANCE", "ACCURACY", "TOLERANCE", "SKILL",
                                                     "REFLECT"] else 4
 
+    def get_level_up_success_rate(self, power_up_stones=None):
+        # type: (list or None) -> mpf
+        rate: mpf = self.level_up_success_rate
+        for power_up_stone in power_up_stones if power_up_stones is not None else []:
+            rate += power_up_stone.level_up_success_rate_up
+        return min(rate, mpf("1"))
+
+    def level_up(self, power_up_stones=None, rng=None):
+        # type: (list or None, random.Random or None) -> bool
+        """
+        Tries to level up this gear once, with the success rate raised by the power-up stones used up in the try.
+        The level stays the same if the try fails. Coins are paid by the caller. The try is rolled with rng, or the
+        global generator if rng is None.
+        :return: whether the gear is levelled up
+        """
+
+        roll: float = random.random() if rng is None else rng.random()
+        if roll < self.get_level_up_success_rate(power_up_stones):
+            self.level += 1
+            return True
+        return False
+
     def update_set_effect(self):
         # type: () -> None
         if self.set_name == "LIFE":
@@ -1151,6 +3480,7 @@ class Player:
         self.update_rank()
         self.battle_team: Team = Team()
         self.item_inventory: Inventory = Inventory()
+        self.hero_storage: HeroStorage = HeroStorage()
 
     def update_rank(self):
         # type: () -> None
@@ -1159,18 +3489,33 @@ class Player:
         :return: None
         """
 
-        if self.arena_points < 1100:
-            self.rank = Rank("BEGINNER")
-        elif 1100 <= self.arena_points < 1200:
-            self.rank = Rank("CHALLENGER")
-        elif 1200 <= self.arena_points < 1400:
-            self.rank = Rank("FIGHTER")
-        elif 1400 <= self.arena_points < 1700:
-            self.rank = Rank("CONQUEROR")
-        elif 1700 <= self.arena_points < 2100:
-            self.rank = Rank("GUARDIAN")
+        self.rank = Rank(Rank.get_value_for_arena_points(self.arena_points))
+
+    def level_up(self):
+        # type: () -> None
+        while self.exp >= self.required_exp:
+            self.level += 1
+            self.required_exp *= mpf("10") ** self.level
+
+    def record_arena_result(self, opponent_arena_points, result, k_factor=32):
+        # type: (int, int, int) -> None
+        """
+        Records an arena battle result (1 for a win, 0 for a draw and -1 for a loss) and updates the arena points
+        with the Elo rating rule.
+        :return: None
+        """
+
+        if result > 0:
+            self.arena_wins += 1
+        elif result < 0:
+            self.arena_losses += 1
         else:
-            self.rank = Rank("LEGEND")
+            self.arena_draws += 1
+
+        expected_score: float = 1 / (1 + 10 ** ((opponent_arena_points - self.arena_points) / 400))
+        actual_score: float = (result + 1) / 2
+        self.arena_points = max(int(round(self.arena_points + k_factor * (actual_score - expected_score))), 0)
+        self.update_rank()
 
     def clone(self):
         # type: () -> Player
@@ -1183,11 +3528,31 @@ class Rank:
     """
 
     POSSIBLE_VALUES: list = ["BEGINNER", "CHALLENGER", "FIGHTER", "CONQUEROR", "GUARDIAN", "LEGEND"]
+    MIN_ARENA_POINTS: list = [0, 1100, 1200, 1400, 1700, 2100]  # minimum arena points of each value above
 
     def __init__(self, value):
         # type: (str) -> None
         self.value: str = value if value in self.POSSIBLE_VALUES else self.POSSIBLE_VALUES[0]
 
+    @staticmethod
+    def get_value_for_arena_points(arena_points):
+        # type: (int) -> str
+        return Rank.POSSIBLE_VALUES[max(bisect.bisect_right(Rank.MIN_ARENA_POINTS, arena_points) - 1, 0)]
+
+    @staticmethod
+    def get_arena_points_range(value):
+        # type: (str) -> tuple
+        """
+        Gets the range [min_points, max_points) of arena points having the given rank value.
+        :return: a tuple (min_points, max_points)
+        """
+
+        index: int = Rank.POSSIBLE_VALUES.index(value) if value in Rank.POSSIBLE_VALUES else 0
+        min_points: int = Rank.MIN_ARENA_POINTS[index] if index > 0 else 0
+        max_points: int = Rank.MIN_ARENA_POINTS[index + 1] if index + 1 < len(Rank.MIN_ARENA_POINTS) else \
+            sys.maxsize
+        return min_points, max_points
+
     def clone(self):
         # type: () -> Rank
         return copy.deepcopy(self)
@@ -1201,6 +3566,7 @@ class PlayerBase:
     def __init__(self):
         # type: () -> None
         self.__islands: list = []  # initial value
+        self.__buildings_by_type: dict = {}  # building class -> building -> number of tiles it is placed on
 
     def get_islands(self):
         # type: () -> list
@@ -1209,6 +3575,48 @@ class PlayerBase:
     def add_island(self, island):
         # type: (Island) -> None
         self.__islands.append(island)
+        island.curr_player_base = self
+        for building in island.get_buildings():
+            self.index_building(building)
+
+    def index_building(self, building):
+        # type: (Building) -> None
+        buildings: dict = self.__buildings_by_type.setdefault(type(building), {})
+        buildings[building] = buildings.get(building, 0) + 1
+
+    def unindex_building(self, building):
+        # type: (Building) -> None
+        # The same building may be placed on several tiles, so it stays indexed until its last tile is cleared.
+        buildings: dict = self.__buildings_by_type.get(type(building), {})
+        if buildings.get(building, 0) > 1:
+            buildings[building] -= 1
+            return
+
+        buildings.pop(building, None)
+        if len(buildings) == 0:
+            self.__buildings_by_type.pop(type(building), None)
+
+    def get_buildings_of_type(self, building_type):
+        # type: (type) -> list
+        """
+        Gets the buildings of the given class or its subclasses on all islands without walking any tiles.
+        :return: a list of buildings
+        """
+
+        result: list = []  # initial value
+        for curr_type, buildings in self.__buildings_by_type.items():
+            if issubclass(curr_type, building_type):
+                result += list(buildings)
+        return result
+
+    def get_coin_per_second(self):
+        # type: () -> mpf
+        return mpf_sum_of_list([bank.coin_per_second for bank in self.get_buildings_of_type(Bank)])
+
+    def get_hero_exp_per_second(self):
+        # type: () -> mpf
+        return mpf_sum_of_list([training_center.hero_exp_per_second for training_center in
+                                self.get_buildings_of_type(TrainingCenter)])
 
     def clone(self):
         # type: () -> PlayerBase
@@ -1218,6 +3626,10 @@ class PlayerBase:
 class Island:
     """
     This class contains attributes of an island in the player's base.
+
+    Tiles are stored as a compact array of building IDs (0 for an empty tile) indexing a table of the buildings on
+    this island. Tile objects are only created as views when requested, and setting the building of such a view
+    places it on this island.
     """
 
     ISLAND_HEIGHT: int = 8
@@ -1225,30 +3637,74 @@ class Island:
 
     def __init__(self):
         # type: () -> None
-        self.__tiles: list = []  # initial value
-        for row in range(self.ISLAND_HEIGHT):
-            new: list = []  # initial value
-            for col in range(self.ISLAND_WIDTH):
-                new.append(Tile())
-
-            self.__tiles.append(new)
+        self.__building_ids: array = array("B", bytes(self.ISLAND_HEIGHT * self.ISLAND_WIDTH))
+        self.__buildings: list = [None]  # building ID -> building, ID 0 means an empty tile
+        self.__free_building_ids: list = []  # initial value
+        self.curr_player_base: PlayerBase or None = None  # initial value
 
     def get_tiles(self):
         # type: () -> list
-        return self.__tiles
+        return [[Tile(island=self, x=x, y=y) for x in range(self.ISLAND_WIDTH)] for y in range(self.ISLAND_HEIGHT)]
+
+    def get_building_at(self, x, y):
+        # type: (int, int) -> Building or None
+        if x < 0 or x >= self.ISLAND_WIDTH or y < 0 or y >= self.ISLAND_HEIGHT:
+            return None
+        return self.__buildings[self.__building_ids[y * self.ISLAND_WIDTH + x]]
+
+    def set_building_at(self, x, y, building):
+        # type: (int, int, Building or None) -> bool
+        if x < 0 or x >= self.ISLAND_WIDTH or y < 0 or y >= self.ISLAND_HEIGHT:
+            return False
+
+        position: int = y * self.ISLAND_WIDTH + x
+        old_building_id: int = self.__building_ids[position]
+        if old_building_id != 0:
+            old_building: Building = self.__buildings[old_building_id]
+            self.__buildings[old_building_id] = None
+            self.__free_building_ids.append(old_building_id)
+            if self.curr_player_base is not None:
+                self.curr_player_base.unindex_building(old_building)
+
+        new_building_id: int = 0  # initial value
+        if building is not None:
+            if len(self.__free_building_ids) > 0:
+                new_building_id = self.__free_building_ids.pop()
+                self.__buildings[new_building_id] = building
+            else:
+                new_building_id = len(self.__buildings)
+                self.__buildings.append(building)
+
+            if self.curr_player_base is not None:
+                self.curr_player_base.index_building(building)
+
+        self.__building_ids[position] = new_building_id
+        return True
+
+    def get_buildings(self):
+        # type: () -> list
+        return [building for building in self.__buildings if building is not None]
+
+    def get_building_positions(self):
+        # type: () -> list
+        """
+        Gets the positions of the buildings on this island, skipping empty tiles.
+        :return: a list of (x, y, building) tuples
+        """
+
+        return [(position % self.ISLAND_WIDTH, position // self.ISLAND_WIDTH, self.__buildings[building_id])
+                for position, building_id in enumerate(self.__building_ids) if building_id != 0]
 
     def get_tile_at(self, x, y):
         # type: (int, int) -> Tile or None
         if x < 0 or x >= self.ISLAND_WIDTH or y < 0 or y >= self.ISLAND_HEIGHT:
             return None
-        return self.__tiles[y][x]
+        return Tile(island=self, x=x, y=y)
 
     def set_tile(self, x, y, tile):
         # type: (int, int, Tile) -> bool
-        if isinstance(self.get_tile_at(x, y), Tile):
-            curr_tile: Tile = self.get_tile_at(x, y)
-            curr_tile = tile
-            return True
+        if isinstance(tile, Tile):
+            return self.set_building_at(x, y, tile.building)
         return False
 
     def clone(self):
@@ -1261,13 +3717,31 @@ class Tile:
     This class contains attributes of a tile on a player island.
     """
 
-    def __init__(self, building=None):
+    def __init__(self, building=None, island=None, x=0, y=0):
+        # type: (Building or None, Island or None, int, int) -> None
+        self.__building: Building or None = building
+        self.__island: Island or None = island  # the island this tile is a view of, if any
+        self.__x: int = x
+        self.__y: int = y
+
+    @property
+    def building(self):
+        # type: () -> Building or None
+        if self.__island is not None:
+            return self.__island.get_building_at(self.__x, self.__y)
+        return self.__building
+
+    @building.setter
+    def building(self, building):
         # type: (Building or None) -> None
-        self.building: Building or None = building
+        if self.__island is not None:
+            self.__island.set_building_at(self.__x, self.__y, building)
+        else:
+            self.__building = building
 
     def clone(self):
         # type: () -> Tile
-        return copy.deepcopy(self)
+        return Tile(copy.deepcopy(self.building))
 
 
 class Building:
@@ -1395,6 +3869,10 @@ class HeroStorage:
         # type: (Hero) -> None
         self.__heroes.append(hero)
 
+    def add_heroes(self, heroes):
+        # type: (list) -> None
+        self.__heroes.extend(heroes)
+
     def remove_hero(self, hero):
         # type: (Hero) -> bool
         if hero in self.__heroes:
@@ -1424,6 +3902,10 @@ class Inventory:
         # type: (Item) -> None
         self.__items.append(item)
 
+    def add_items(self, items):
+        # type: (list) -> None
+        self.__items.extend(items)
+
     def remove_item(self, item):
         # type: (Item) -> bool
         if item in self.__items:
@@ -1445,7 +3927,35 @@ class Buff:
                             "INCREASE ATTACK SPEED", "HEAL OVER TIME", "COUNTER", "IMMUNITY", "INVINCIBLE",
                             "REFLECT DAMAGE", "SHIELD", "ENDURE"]
 
+    __prototypes: dict = {}  # name -> buff whose attributes every buff with that name shares
+
     def __init__(self, name, number_of_turns):
+        # type: (str, int) -> None
+        self.reset(name, number_of_turns)
+
+    def reset(self, name, number_of_turns):
+        # type: (str, int) -> None
+        """
+        Turns this buff into a buff with the given name and number of turns. Attributes depending only on the name are
+        copied from a shared prototype, so no new values are created and pooled buffs can be reused.
+        :return: None
+        """
+
+        self.__dict__.update(Buff.get_prototype(name).__dict__)
+        self.number_of_turns: int = number_of_turns
+
+    @staticmethod
+    def get_prototype(name):
+        # type: (str) -> Buff
+        prototype: Buff or None = Buff.__prototypes.get(name)
+        if prototype is None:
+            prototype = Buff.__new__(Buff)
+            prototype.__set_up(name, 0)
+            if prototype.name == name:
+                Buff.__prototypes[name] = prototype
+        return prototype
+
+    def __set_up(self, name, number_of_turns):
         # type: (str, int) -> None
         self.name: str = name if name in self.POSSIBLE_NAMES else self.POSSIBLE_NAMES[0]
         self.number_of_turns: int = number_of_turns
@@ -1476,7 +3986,35 @@ class Debuff:
                             "BENEFICIAL EFFECTS BLOCKED", "SLEEP", "DAMAGE OVER TIME", "FREEZE", "STUN",
                             "UNRECOVERABLE", "SILENCE", "BRAND", "OBLIVION"]
 
+    __prototypes: dict = {}  # name -> debuff whose attributes every debuff with that name shares
+
     def __init__(self, name, number_of_turns):
+        # type: (str, int) -> None
+        self.reset(name, number_of_turns)
+
+    def reset(self, name, number_of_turns):
+        # type: (str, int) -> None
+        """
+        Turns this debuff into a debuff with the given name and number of turns. Attributes depending only on the name
+        are copied from a shared prototype, so no new values are created and pooled debuffs can be reused.
+        :return: None
+        """
+
+        self.__dict__.update(Debuff.get_prototype(name).__dict__)
+        self.number_of_turns: int = number_of_turns
+
+    @staticmethod
+    def get_prototype(name):
+        # type: (str) -> Debuff
+        prototype: Debuff or None = Debuff.__prototypes.get(name)
+        if prototype is None:
+            prototype = Debuff.__new__(Debuff)
+            prototype.__set_up(name, 0)
+            if prototype.name == name:
+                Debuff.__prototypes[name] = prototype
+        return prototype
+
+    def __set_up(self, name, number_of_turns):
         # type: (str, int) -> None
         self.name: str = name if name in self.POSSIBLE_NAMES else self.POSSIBLE_NAMES[0]
         self.number_of_turns: int = number_of_turns
@@ -1525,6 +4063,104 @@ class Reward:
         return copy.deepcopy(self)
 
 
+class RewardAccumulator:
+    """
+    This class contains attributes of an accumulator merging many rewards into numeric totals and item and hero
+    counts which are given to the player in one batched step.
+    """
+
+    def __init__(self):
+        # type: () -> None
+        self.player_coin_gain: mpf = mpf("0")
+        self.player_exp_gain: mpf = mpf("0")
+        self.hero_exp_gain: mpf = mpf("0")
+        self.__item_counts: dict = {}  # item -> number of copies of the item gained
+        self.__hero_counts: dict = {}  # hero -> number of copies of the hero gained
+        self.rewards_added: int = 0
+
+    def add_reward(self, reward, times=1):
+        # type: (Reward, int) -> None
+        self.player_coin_gain += reward.player_coin_gain * times
+        self.player_exp_gain += reward.player_exp_gain * times
+        self.hero_exp_gain += reward.hero_exp_gain * times
+        for item in reward.get_player_items_gain():
+            self.__item_counts[item] = self.__item_counts.get(item, 0) + times
+        for hero in reward.get_player_heroes_gain():
+            self.__hero_counts[hero] = self.__hero_counts.get(hero, 0) + times
+        self.rewards_added += times
+
+    def merge(self, other):
+        # type: (RewardAccumulator) -> None
+        self.player_coin_gain += other.player_coin_gain
+        self.player_exp_gain += other.player_exp_gain
+        self.hero_exp_gain += other.hero_exp_gain
+        for item, count in other.get_item_counts().items():
+            self.__item_counts[item] = self.__item_counts.get(item, 0) + count
+        for hero, count in other.get_hero_counts().items():
+            self.__hero_counts[hero] = self.__hero_counts.get(hero, 0) + count
+        self.rewards_added += other.rewards_added
+
+    def get_item_counts(self):
+        # type: () -> dict
+        return self.__item_counts
+
+    def get_hero_counts(self):
+        # type: () -> dict
+        return self.__hero_counts
+
+    def get_is_empty(self):
+        # type: () -> bool
+        return self.rewards_added == 0
+
+    def reset(self):
+        # type: () -> None
+        self.player_coin_gain = mpf("0")
+        self.player_exp_gain = mpf("0")
+        self.hero_exp_gain = mpf("0")
+        self.__item_counts = {}
+        self.__hero_counts = {}
+        self.rewards_added = 0
+
+    def to_reward(self):
+        # type: () -> Reward
+        return Reward(self.player_coin_gain, self.player_exp_gain, self.hero_exp_gain,
+                      [item.clone() for item, count in self.__item_counts.items() for i in range(count)],
+                      [hero.clone() for hero, count in self.__hero_counts.items() for i in range(count)])
+
+    def apply_to(self, player, heroes=None):
+        # type: (Player, list or None) -> bool
+        """
+        Gives the accumulated coins and EXP to the player, the accumulated hero EXP to the given heroes (the player's
+        battle team by default) and copies of the accumulated items and heroes to the player's inventory and hero
+        storage, then empties this accumulator.
+        :return: True if anything is given, False if this accumulator is empty
+        """
+
+        if self.get_is_empty():
+            return False
+
+        if heroes is None:
+            heroes = player.battle_team.get_heroes_list()
+
+        player.coins += self.player_coin_gain
+        player.exp += self.player_exp_gain
+        player.level_up()
+        for hero in heroes:
+            hero.exp += self.hero_exp_gain
+            hero.level_up()
+
+        player.item_inventory.add_items([item.clone() for item, count in self.__item_counts.items()
+                                         for i in range(count)])
+        player.hero_storage.add_heroes([hero.clone() for hero, count in self.__hero_counts.items()
+                                        for i in range(count)])
+        self.reset()
+        return True
+
+    def clone(self):
+        # type: () -> RewardAccumulator
+        return copy.deepcopy(self)
+
+
 class DamageMultiplier:
     """
     This class contains attributes of damage multiplier.
@@ -1567,21 +4203,28 @@ class DamageMultiplier:
             user_team: Team = user.curr_team
             target_team: Team = target.curr_team
             actual_user_max_hp: mpf = user.max_hp * (1 + user.battle_max_hp_percentage_up / 100 -
-                                                     user.battle_max_hp_percentage_down / 100)
+                                                     user.battle_max_hp_percentage_down / 100) + user.battle_max_hp_up
             actual_user_attack_power: mpf = user.attack_power * (1 + user.battle_attack_power_percentage_up / 100 -
-                                                                 user.battle_attack_power_percentage_down / 100)
+                                                                 user.battle_attack_power_percentage_down / 100) + \
+                                                                 user.battle_attack_power_up
             actual_user_defense: mpf = user.defense * (1 + user.battle_defense_percentage_up / 100 -
-                                                       user.battle_defense_percentage_down / 100)
+                                                       user.battle_defense_percentage_down / 100) + \
+                                                       user.battle_defense_up
             actual_user_attack_speed: mpf = user.attack_speed * (1 + user.battle_attack_speed_percentage_up / 100 -
-                                                                 user.battle_attack_speed_percentage_down / 100)
+                                                                 user.battle_attack_speed_percentage_down / 100) + \
+                                                                 user.battle_attack_speed_up
             actual_target_max_hp: mpf = target.max_hp * (1 + target.battle_max_hp_percentage_up / 100 -
-                                                     target.battle_max_hp_percentage_down / 100)
+                                                     target.battle_max_hp_percentage_down / 100) + \
+                                                     target.battle_max_hp_up
             actual_target_attack_power: mpf = target.attack_power * (1 + target.battle_attack_power_percentage_up / 100 -
-                                                                 target.battle_attack_power_percentage_down / 100)
+                                                                 target.battle_attack_power_percentage_down / 100) + \
+                                                                 target.battle_attack_power_up
             actual_target_defense: mpf = target.defense * (1 + target.battle_defense_percentage_up / 100 -
-                                                       target.battle_defense_percentage_down / 100)
+                                                       target.battle_defense_percentage_down / 100) + \
+                                                       target.battle_defense_up
             actual_target_attack_speed: mpf = target.attack_speed * (1 + target.battle_attack_speed_percentage_up / 100 -
-                                                                 target.battle_attack_speed_percentage_down / 100)
+                                                                 target.battle_attack_speed_percentage_down / 100) + \
+                                                                 target.battle_attack_speed_up
             current_user_hp_percentage: mpf = (user.curr_hp / user.max_hp) * 100
             current_target_hp_percentage: mpf = (target.curr_hp / target.max_hp) * 100
             user_hp_percentage_loss: mpf = 100 - current_user_hp_percentage
@@ -1619,7 +4262,8 @@ class DamageMultiplier:
     def calculate_normal_raw_damage(self, user, target):
         # type: (Hero, Hero) -> mpf
         actual_target_defense: mpf = target.defense * (1 + target.battle_defense_percentage_up / 100 -
-                                                       target.battle_defense_percentage_down / 100)
+                                                       target.battle_defense_percentage_down / 100) + \
+                                                       target.battle_defense_up
         return self.calculate_normal_raw_damage_without_enemy_defense(user, target) - actual_target_defense
 
     def calculate_critical_raw_damage_without_enemy_defense(self, user, target):
@@ -1629,7 +4273,8 @@ class DamageMultiplier:
     def calculate_critical_raw_damage(self, user, target):
         # type: (Hero, Hero) -> mpf
         actual_target_defense: mpf = target.defense * (1 + target.battle_defense_percentage_up / 100 -
-                                                       target.battle_defense_percentage_down / 100)
+                                                       target.battle_defense_percentage_down / 100) + \
+                                                       target.battle_defense_up
         return self.calculate_critical_raw_damage_without_enemy_defense(user, target) - actual_target_defense
 
     def clone(self):
@@ -1637,6 +4282,828 @@ class DamageMultiplier:
         return copy.deepcopy(self)
 
 
+class DamageDistribution:
+    """
+    This class contains attributes of the exact probability distribution of the damage dealt by one or more hits.
+
+    Outcomes are kept as damage -> probability with equal damage values merged, so adding the distributions of many
+    hits (a convolution) stays small when the hits are alike.
+    """
+
+    GLANCING_HIT_DAMAGE_MULTIPLIER: mpf = mpf("0.7")
+
+    def __init__(self, outcomes=None):
+        # type: (dict or None) -> None
+        self.__outcomes: dict = outcomes if outcomes is not None else {mpf("0"): mpf("1")}  # damage -> probability
+
+    def get_outcomes(self):
+        # type: () -> dict
+        return self.__outcomes
+
+    @staticmethod
+    def get_actual_crit_rate(user):
+        # type: (Hero) -> mpf
+        return min(user.crit_rate + user.battle_crit_rate_up, user.MAX_CRIT_RATE)
+
+    @staticmethod
+    def of_hit(normal_damage, critical_damage, crit_rate, glancing_hit_chance=mpf("0"), dodge_chance=mpf("0")):
+        # type: (mpf, mpf, mpf, mpf, mpf) -> DamageDistribution
+        """
+        Creates the distribution of one hit which is dodged (no damage), else a glancing hit (reduced normal damage),
+        else a critical hit with probability crit_rate, else a normal hit.
+        :return: the distribution of the hit
+        """
+
+        hit_chance: mpf = 1 - dodge_chance
+        non_glancing_chance: mpf = hit_chance * (1 - glancing_hit_chance)
+        outcomes: dict = {}  # initial value
+        for damage, probability in [(mpf("0"), dodge_chance),
+                                    (normal_damage * DamageDistribution.GLANCING_HIT_DAMAGE_MULTIPLIER,
+                                     hit_chance * glancing_hit_chance),
+                                    (critical_damage, non_glancing_chance * crit_rate),
+                                    (normal_damage, non_glancing_chance * (1 - crit_rate))]:
+            if probability > 0:
+                damage = max(damage, mpf("0"))
+                outcomes[damage] = outcomes.get(damage, mpf("0")) + probability
+        return DamageDistribution(outcomes)
+
+    @staticmethod
+    def of_normal_attack(user, target, glancing_hit_chance=mpf("0"), dodge_chance=mpf("0")):
+        # type: (Hero, Hero, mpf, mpf) -> DamageDistribution
+        """
+        Creates the distribution of the damage of a normal attack, following Action.execute.
+        :return: the distribution of the normal attack
+        """
+
+        if user == target:
+            return DamageDistribution()
+
+        actual_attack_power: mpf = user.attack_power * (1 + user.battle_attack_power_percentage_up / 100 -
+                                                        user.battle_attack_power_percentage_down / 100) + \
+            user.battle_attack_power_up
+        actual_defense: mpf = target.defense * (1 + target.battle_defense_percentage_up / 100 -
+                                                target.battle_defense_percentage_down / 100) + target.battle_defense_up
+        return DamageDistribution.of_hit(actual_attack_power - actual_defense,
+                                         actual_attack_power * user.crit_damage - actual_defense,
+                                         DamageDistribution.get_actual_crit_rate(user), glancing_hit_chance,
+                                         dodge_chance)
+
+    @staticmethod
+    def of_skill(user, target, skill, glancing_hit_chance=mpf("0"), dodge_chance=mpf("0")):
+        # type: (Hero, Hero, ActiveSkill or SpecialPower, mpf, mpf) -> DamageDistribution
+        """
+        Creates the distribution of the damage an active skill or a special power deals to one target, following
+        Action.execute.
+        :return: the distribution of the skill's damage to the target
+        """
+
+        if any(buff.name == "INVINCIBLE" for buff in target.get_buffs()):
+            return DamageDistribution()
+
+        raw_damage: mpf = skill.damage_multiplier.calculate_normal_raw_damage_without_enemy_defense(user, target)
+        defense: mpf = mpf("0") if skill.does_ignore_enemies_defense else target.defense
+        return DamageDistribution.of_hit(raw_damage - defense, raw_damage * user.crit_damage - defense,
+                                         DamageDistribution.get_actual_crit_rate(user), glancing_hit_chance,
+                                         dodge_chance)
+
+    def get_expected_value(self):
+        # type: () -> mpf
+        return fsum(damage * probability for damage, probability in self.__outcomes.items())
+
+    def get_variance(self):
+        # type: () -> mpf
+        expected_value: mpf = self.get_expected_value()
+        return fsum((damage - expected_value) ** 2 * probability for damage, probability in self.__outcomes.items())
+
+    def add(self, other):
+        # type: (DamageDistribution) -> DamageDistribution
+        """
+        Convolves this distribution with another one, i.e. gets the distribution of the sum of two independent
+        damage values.
+        :return: the distribution of the total damage
+        """
+
+        outcomes: dict = {}  # initial value
+        for damage1, probability1 in self.__outcomes.items():
+            for damage2, probability2 in other.get_outcomes().items():
+                total_damage: mpf = damage1 + damage2
+                outcomes[total_damage] = outcomes.get(total_damage, mpf("0")) + probability1 * probability2
+        return DamageDistribution(outcomes)
+
+    def repeat(self, number_of_hits):
+        # type: (int) -> DamageDistribution
+        """
+        Gets the distribution of the total damage of number_of_hits independent hits like this one, using
+        O(log number_of_hits) convolutions.
+        :return: the distribution of the total damage
+        """
+
+        result: DamageDistribution = DamageDistribution()
+        power: DamageDistribution = self
+        while number_of_hits > 0:
+            if number_of_hits & 1:
+                result = result.add(power)
+            number_of_hits >>= 1
+            if number_of_hits > 0:
+                power = power.add(power)
+        return result
+
+    @staticmethod
+    def combine(distributions):
+        # type: (list) -> DamageDistribution
+        result: DamageDistribution = DamageDistribution()
+        for distribution in distributions:
+            result = result.add(distribution)
+        return result
+
+    def get_probability_at_least(self, damage):
+        # type: (mpf) -> mpf
+        return fsum(probability for curr_damage, probability in self.__outcomes.items() if curr_damage >= damage)
+
+    def get_kill_probability(self, target_hp, number_of_hits=1):
+        # type: (mpf, int) -> mpf
+        """
+        Gets the probability that number_of_hits hits like this one deal at least target_hp damage. Damage is never
+        negative, so this is also the probability of killing the target within that many hits.
+        :return: the kill probability
+        """
+
+        return self.repeat(number_of_hits).get_probability_at_least(target_hp)
+
+    def clone(self):
+        # type: () -> DamageDistribution
+        return copy.deepcopy(self)
+
+
+class GearEnhancementPlanner:
+    """
+    This class contains attributes of an exact planner of the cost of levelling up a gear with power-up stones.
+
+    Levelling up is a Markov chain over gear levels: every try at a level costs coins and the stones used, succeeds
+    with the level's success rate raised by the stones, and on failure drops a level with level_down_rate_on_failure
+    (0 as in Gear.level_up) and stays otherwise. The cost of getting from a level to the next one does not depend on
+    how the level is reached, so these step costs are found level by level from level 0 and the cost from a to b is
+    the sum of the independent step costs from a to b - 1, with its variance the sum of their variances.
+    """
+
+    def __init__(self, level_up_coin_costs, level_up_success_rates, power_up_stone=None, stone_price=None,
+                 max_stones_per_try=1, level_down_rate_on_failure=mpf("0")):
+        # type: (mpf or list, mpf or list, PowerUpStone or None, mpf or None, int, mpf) -> None
+        self.level_up_coin_costs: mpf or list = level_up_coin_costs  # one value for every level or a value per level
+        self.level_up_success_rates: mpf or list = level_up_success_rates
+        self.power_up_stone: PowerUpStone or None = power_up_stone
+        self.stone_price: mpf = stone_price if stone_price is not None else power_up_stone.coin_cost \
+            if power_up_stone is not None else mpf("0")
+        self.max_stones_per_try: int = max_stones_per_try if power_up_stone is not None else 0
+        self.level_down_rate_on_failure: mpf = level_down_rate_on_failure
+
+    @staticmethod
+    def from_gear(gear, power_up_stone=None, stone_price=None, max_stones_per_try=1):
+        # type: (Gear, PowerUpStone or None, mpf or None, int) -> GearEnhancementPlanner
+        return GearEnhancementPlanner(gear.level_up_coin_cost, gear.level_up_success_rate, power_up_stone,
+                                      stone_price, max_stones_per_try)
+
+    @staticmethod
+    def get_level_value(values, level):
+        # type: (mpf or list, int) -> mpf
+        if isinstance(values, list):
+            return values[min(level, len(values) - 1)]
+        return values
+
+    def get_success_rate(self, level, number_of_stones):
+        # type: (int, int) -> mpf
+        bonus: mpf = self.power_up_stone.level_up_success_rate_up * number_of_stones if number_of_stones > 0 \
+            else mpf("0")
+        return min(self.get_level_value(self.level_up_success_rates, level) + bonus, mpf("1"))
+
+    def __get_step_moments(self, level, number_of_stones, try_cost, previous_moments):
+        # type: (int, int, mpf, tuple) -> tuple
+        """
+        Gets the mean and second moment of a cost of getting from level to level + 1, where every try costs try_cost
+        and previous_moments are those of the same cost one level lower.
+        :return: a tuple (mean, second moment)
+        """
+
+        success_rate: mpf = self.get_success_rate(level, number_of_stones)
+        if success_rate <= 0:
+            return mpf("inf"), mpf("inf")
+
+        drop_rate: mpf = (1 - success_rate) * self.level_down_rate_on_failure if level > 0 else mpf("0")
+        previous_mean, previous_second_moment = previous_moments
+        mean: mpf = (try_cost + drop_rate * previous_mean) / success_rate if drop_rate > 0 else \
+            try_cost / success_rate
+        remaining_mean: mpf = (1 - success_rate) * mean + (drop_rate * previous_mean if drop_rate > 0 else 0)
+        second_moment: mpf = try_cost ** 2 + 2 * try_cost * remaining_mean
+        if drop_rate > 0:
+            second_moment += drop_rate * (previous_second_moment + 2 * previous_mean * mean)
+        return mean, second_moment / success_rate
+
+    def get_optimal_policy(self, target_level):
+        # type: (int) -> list
+        """
+        Chooses the number of stones to use in every try at every level below target_level minimising the expected
+        coins plus stone_price per stone. A lower step cost at a level only lowers the step costs above it, so
+        choosing the cheapest step at every level from level 0 up is optimal.
+        :return: a list of the number of stones to use at every level
+        """
+
+        policy: list = []  # initial value
+        previous_moments: tuple = (mpf("0"), mpf("0"))
+        for level in range(target_level):
+            best_moments: tuple = ()  # initial value
+            best_number_of_stones: int = 0  # initial value
+            for number_of_stones in range(self.max_stones_per_try + 1):
+                moments: tuple = self.__get_step_moments(
+                    level, number_of_stones, self.get_level_value(self.level_up_coin_costs, level) +
+                    self.stone_price * number_of_stones, previous_moments)
+                if len(best_moments) == 0 or moments[0] < best_moments[0]:
+                    best_moments = moments
+                    best_number_of_stones = number_of_stones
+            policy.append(best_number_of_stones)
+            previous_moments = best_moments
+        return policy
+
+    def evaluate_policy(self, start_level, target_level, policy):
+        # type: (int, int, int or list) -> dict
+        """
+        Gets the exact expected cost of getting a gear from start_level to target_level when policy stones (or
+        policy[level] stones at every level) are used in every try.
+        :return: a dictionary with "policy", "expected_coins", "coins_variance", "expected_stones",
+        "stones_variance", "expected_total_cost" and "total_cost_variance" where the total cost counts every stone
+        as stone_price coins
+        """
+
+        policy = policy if isinstance(policy, list) else [policy] * target_level
+        totals: dict = {"expected_coins": mpf("0"), "coins_variance": mpf("0"), "expected_stones": mpf("0"),
+                        "stones_variance": mpf("0"), "expected_total_cost": mpf("0"),
+                        "total_cost_variance": mpf("0")}
+        previous_moments: dict = {"coins": (mpf("0"), mpf("0")), "stones": (mpf("0"), mpf("0")),
+                                  "total_cost": (mpf("0"), mpf("0"))}
+        for level in range(target_level):
+            number_of_stones: int = min(policy[level], self.max_stones_per_try)
+            coin_cost: mpf = self.get_level_value(self.level_up_coin_costs, level)
+            for cost_name, try_cost in [("coins", coin_cost), ("stones", mpf(number_of_stones)),
+                                        ("total_cost", coin_cost + self.stone_price * number_of_stones)]:
+                mean, second_moment = self.__get_step_moments(level, number_of_stones, try_cost,
+                                                              previous_moments[cost_name])
+                previous_moments[cost_name] = (mean, second_moment)
+                if level >= start_level:
+                    totals["expected_" + cost_name] += mean
+                    totals[cost_name + "_variance"] += second_moment - mean ** 2
+
+        totals["policy"] = policy[start_level:target_level]
+        return totals
+
+    def plan(self, start_level, target_level):
+        # type: (int, int) -> dict
+        return self.evaluate_policy(start_level, target_level, self.get_optimal_policy(target_level))
+
+    def clone(self):
+        # type: () -> GearEnhancementPlanner
+        return copy.deepcopy(self)
+
+
+class ProgressionGoal:
+    """
+    This class contains attributes of a progression goal for some heroes, e.g. awakened, at max level and limit
+    broken.
+    """
+
+    def __init__(self, hero_ids, target_level=None, is_awakened=True, is_limit_broken=False,
+                 is_secondary_awakened=False):
+        # type: (list, int or None, bool, bool, bool) -> None
+        self.hero_ids: list = hero_ids
+        self.target_level: int or None = target_level  # None for the max level of every hero which has one
+        self.is_awakened: bool = is_awakened
+        self.is_limit_broken: bool = is_limit_broken
+        self.is_secondary_awakened: bool = is_secondary_awakened
+
+    def get_target_level(self, hero):
+        # type: (Hero) -> int
+        if self.target_level is None:
+            # Limit broken heroes have no max level, so they have no level to reach unless target_level is given.
+            return hero.level if hero.max_level == float('inf') else hero.max_level
+        return self.target_level
+
+    def clone(self):
+        # type: () -> ProgressionGoal
+        return copy.deepcopy(self)
+
+
+class ProgressionPlanner:
+    """
+    This class contains attributes of a planner of the items to use for a progression goal at a low coin cost.
+
+    Items are grouped once when the planner is created, so that plans only look at a few groups however many items
+    there are. Summoning a missing hero uses a SummoningPiece for it, awakening uses an AwakenShard for it and a limit
+    break uses a LimitBreakShard. A LevelUpShard sets exp to required_exp and levels up once, like Level.get_beaten,
+    and EXP shards add their exp_gain. Since exp is never used up and required_exp grows by a factor of 10 ** level,
+    level up shards are best used on the highest levels, and the EXP needed is then the required_exp of the highest
+    level left to EXP shards. The number of level up shards of every hero is chosen by a DP over heroes whose states
+    are the level up shards used and the EXP shards left, so no two heroes count on the same shards. The EXP shards of
+    a hero are the cheapest ones left covering its EXP needed, found by a bounded knapsack DP over EXP buckets. Every
+    plan found is feasible, but its cost is not guaranteed to be the least: covers are chosen one hero at a time, EXP
+    is rounded to buckets and only the MAX_PLAN_STATES cheapest states are kept after every hero.
+    """
+
+    MAX_PLAN_STATES: int = 256
+
+    def __init__(self, inventory, hero_storage, potential_heroes=None, number_of_exp_buckets=256):
+        # type: (Inventory, HeroStorage, list or None, int) -> None
+        self.hero_storage: HeroStorage = hero_storage
+        self.potential_heroes: list = potential_heroes if potential_heroes is not None else []
+        self.number_of_exp_buckets: int = number_of_exp_buckets
+        self.__exp_shard_groups: dict = {}  # (exp gain, coin cost) -> list of EXP shards
+        self.__level_up_shards: list = []  # initial value
+        self.__limit_break_shards: list = []  # initial value
+        self.__awaken_shards: dict = {}  # hero ID -> list of awaken shards
+        self.__summoning_pieces: dict = {}  # hero ID -> list of summoning pieces
+        for item in inventory.get_items():
+            if isinstance(item, EXPShard):
+                self.__exp_shard_groups.setdefault((item.exp_gain, item.coin_cost), []).append(item)
+            elif isinstance(item, LevelUpShard):
+                self.__level_up_shards.append(item)
+            elif isinstance(item, LimitBreakShard):
+                self.__limit_break_shards.append(item)
+            elif isinstance(item, AwakenShard):
+                self.__awaken_shards.setdefault(item.id_of_hero_to_awaken, []).append(item)
+            elif isinstance(item, SummoningPiece):
+                self.__summoning_pieces.setdefault(item.id_of_hero_to_summon, []).append(item)
+
+        for items in [self.__level_up_shards, self.__limit_break_shards] + list(self.__awaken_shards.values()) + \
+                list(self.__summoning_pieces.values()):
+            items.sort(key=lambda item: item.coin_cost)
+        self.__level_up_shard_costs: list = [mpf("0")]  # cost of the cheapest n level up shards
+        for level_up_shard in self.__level_up_shards:
+            self.__level_up_shard_costs.append(self.__level_up_shard_costs[-1] + level_up_shard.coin_cost)
+
+    @staticmethod
+    def get_exp_needed(hero, target_level, number_of_level_up_shards):
+        # type: (Hero, int, int) -> mpf
+        """
+        Gets the EXP to add to the hero so that EXP shards get it to target_level - number_of_level_up_shards. The
+        required_exp at level m is required_exp * 10 ** (triangular(m + 1) - triangular(level + 1)).
+        :return: the EXP needed
+        """
+
+        last_exp_level: int = target_level - number_of_level_up_shards - 1  # highest level left by gaining EXP
+        if last_exp_level < hero.level:
+            return mpf("0")
+        if last_exp_level == float('inf'):
+            return mpf("inf")
+        required_exp: mpf = hero.required_exp * mpf("10") ** (triangular(last_exp_level + 1) -
+                                                             triangular(hero.level + 1))
+        return max(required_exp - hero.exp, mpf("0"))
+
+    def get_exp_cover(self, exp_needed, exp_shard_counts):
+        # type: (mpf, dict) -> tuple or None
+        """
+        Chooses EXP shards from exp_shard_counts ((exp gain, coin cost) -> number available) adding at least
+        exp_needed EXP at the least coin cost. EXP is counted in number_of_exp_buckets buckets of exp_needed and
+        every group is split into bundles of 1, 2, 4, ... shards, so the DP stays small however large the numbers
+        are. Gains are rounded down to whole buckets, so the shards chosen always add enough EXP.
+        :return: a tuple (coin cost, dictionary of (exp gain, coin cost) -> number of shards), or None if there is
+        not enough EXP
+        """
+
+        if exp_needed <= 0:
+            return mpf("0"), {}
+        if fsum(exp_gain * count for (exp_gain, coin_cost), count in exp_shard_counts.items()) < exp_needed:
+            return None
+
+        number_of_buckets: int = self.number_of_exp_buckets
+        bucket_size: mpf = exp_needed / number_of_buckets
+        max_coin_cost: mpf = max(max(coin_cost for exp_gain, coin_cost in exp_shard_counts), mpf("1"))
+        bundles: list = []  # (group, number of shards, buckets, relative coin cost)
+        for (exp_gain, coin_cost), count in exp_shard_counts.items():
+            bundle_size: int = 1  # initial value
+            while count > 0:
+                number_of_shards: int = min(bundle_size, count)
+                buckets: int = int(min(floor(exp_gain * number_of_shards / bucket_size), number_of_buckets))
+                if buckets > 0:
+                    bundles.append(((exp_gain, coin_cost), number_of_shards, buckets,
+                                    float(coin_cost / max_coin_cost) * number_of_shards))
+                count -= number_of_shards
+                bundle_size *= 2
+
+        best_costs: list = [0.0] + [float('inf')] * number_of_buckets  # least cost of at least b buckets
+        taken: list = []  # initial value
+        for group, number_of_shards, buckets, relative_cost in bundles:
+            taken_at: bytearray = bytearray(number_of_buckets + 1)
+            for b in range(number_of_buckets, 0, -1):
+                cost: float = best_costs[max(b - buckets, 0)] + relative_cost
+                if cost < best_costs[b]:
+                    best_costs[b] = cost
+                    taken_at[b] = 1
+            taken.append(taken_at)
+
+        counts: dict = {}  # initial value
+        if best_costs[number_of_buckets] == float('inf'):
+            # Shards smaller than a bucket are left out of the DP, so the cheapest EXP per coin is taken instead.
+            exp_gained: mpf = mpf("0")  # initial value
+            for (exp_gain, coin_cost), count in sorted(exp_shard_counts.items(),
+                                                       key=lambda group_and_count: group_and_count[0][1] /
+                                                       max(group_and_count[0][0], mpf("1e-30"))):
+                number_of_shards = int(min(count, ceil((exp_needed - exp_gained) / exp_gain)))
+                counts[(exp_gain, coin_cost)] = number_of_shards
+                exp_gained += exp_gain * number_of_shards
+                if exp_gained >= exp_needed:
+                    break
+        else:
+            b: int = number_of_buckets
+            for (group, number_of_shards, buckets, relative_cost), taken_at in zip(reversed(bundles),
+                                                                                   reversed(taken)):
+                if taken_at[b]:
+                    counts[group] = counts.get(group, 0) + number_of_shards
+                    b = max(b - buckets, 0)
+
+        return fsum(coin_cost * count for (exp_gain, coin_cost), count in counts.items()), counts
+
+    def __find_hero(self, hero_id):
+        # type: (str) -> Hero or None
+        owned_heroes: list = [hero for hero in self.hero_storage.get_heroes() if hero.hero_id == hero_id]
+        if len(owned_heroes) > 0:
+            return max(owned_heroes, key=lambda hero: hero.level)
+        return None
+
+    def __get_level_options(self, hero, target_level, exp_shard_counts, level_up_shards_left):
+        # type: (Hero, int, dict, int) -> list
+        """
+        Gets the feasible ways of levelling up the hero with the given EXP shards and level up shards, from the fewest
+        level up shards for which the EXP shards suffice up to using level up shards for every level.
+        :return: a list of (number of level up shards, EXP coin cost, EXP shard counts)
+        """
+
+        levels: int = max(target_level - hero.level, 0)
+        options: list = []  # initial value
+        total_exp: mpf = fsum(exp_gain * count for (exp_gain, coin_cost), count in exp_shard_counts.items())
+        for number_of_level_up_shards in range(min(levels, level_up_shards_left), -1, -1):
+            exp_needed: mpf = self.get_exp_needed(hero, target_level, number_of_level_up_shards)
+            if exp_needed > total_exp:
+                break
+            cover: tuple or None = self.get_exp_cover(exp_needed, exp_shard_counts)
+            if cover is not None:
+                options.append((number_of_level_up_shards, cover[0], cover[1]))
+        return options
+
+    def plan(self, goal):
+        # type: (ProgressionGoal) -> dict
+        """
+        Plans the items to use for the goal.
+        :return: a dictionary with "is_feasible", "coin_cost", "steps" (a list of (hero ID, step name, items) in the
+        order to apply them) and "missing" (a list of what stops the goal from being reached)
+        """
+
+        steps: list = []  # initial value
+        missing: list = []  # initial value
+        limit_break_shards: list = list(self.__limit_break_shards)
+        heroes: list = []  # (hero, target level) of heroes to level up
+        for hero_id in goal.hero_ids:
+            hero: Hero or None = self.__find_hero(hero_id)
+            if hero is None:
+                potential_heroes: list = [potential_hero for potential_hero in self.potential_heroes
+                                          if potential_hero.hero_id == hero_id]
+                if len(potential_heroes) == 0 or len(self.__summoning_pieces.get(hero_id, [])) == 0:
+                    missing.append("SUMMONING PIECE for " + str(hero_id))
+                    continue
+                hero = potential_heroes[0].clone()
+                steps.append((hero_id, "SUMMON", self.__summoning_pieces[hero_id][:1]))
+
+            target_level: int = goal.get_target_level(hero)
+            if target_level > hero.max_level and not goal.is_limit_broken:
+                missing.append("LIMIT BREAK to go above level " + str(hero.max_level) + " for " + str(hero_id))
+                target_level = hero.max_level
+            heroes.append((hero, target_level))
+
+            if goal.is_awakened and not hero.has_awakened:
+                if len(self.__awaken_shards.get(hero_id, [])) == 0:
+                    missing.append("AWAKEN SHARD for " + str(hero_id))
+                else:
+                    steps.append((hero_id, "AWAKEN", self.__awaken_shards[hero_id][:1]))
+            if goal.is_secondary_awakened and not hero.has_secondary_awakened and \
+                    hero.secondary_awaken_exp < hero.secondary_awaken_exp_required:
+                missing.append("SECONDARY AWAKEN EXP for " + str(hero_id))
+            if goal.is_limit_broken and not hero.limit_break_applied:
+                if hero.rating != Hero.MAX_RATING:
+                    missing.append("RATING " + str(Hero.MAX_RATING) + " for " + str(hero_id))
+                elif len(limit_break_shards) == 0:
+                    missing.append("LIMIT BREAK SHARD for " + str(hero_id))
+                else:
+                    steps.append((hero_id, "LIMIT BREAK", [limit_break_shards.pop(0)]))
+
+        # Heroes needing the most EXP go first. Every state knows the shards left, so every hero's options are only
+        # made of shards no hero before it has taken.
+        groups: list = list(self.__exp_shard_groups)
+        heroes.sort(key=lambda hero_and_target_level: -self.get_exp_needed(hero_and_target_level[0],
+                                                                           hero_and_target_level[1], 0))
+        best_plans: dict = {(0, tuple(len(self.__exp_shard_groups[group]) for group in groups)): (mpf("0"), [])}
+        # (level up shards used, EXP shards left of every group) -> (EXP coin cost, chosen options)
+        for hero, target_level in heroes:
+            next_best_plans: dict = {}  # initial value
+            for (used, shards_left), (exp_cost, chosen_options) in best_plans.items():
+                for option in self.__get_level_options(hero, target_level, dict(zip(groups, shards_left)),
+                                                       len(self.__level_up_shards) - used):
+                    number_of_level_up_shards, option_cost, counts = option
+                    state: tuple = (used + number_of_level_up_shards,
+                                    tuple(count_left - counts.get(group, 0) for group, count_left in
+                                          zip(groups, shards_left)))
+                    best_plan: tuple or None = next_best_plans.get(state)
+                    if best_plan is None or exp_cost + option_cost < best_plan[0]:
+                        next_best_plans[state] = (exp_cost + option_cost, chosen_options + [option])
+            if len(next_best_plans) == 0:
+                missing.append("EXP or LEVEL UP SHARDS to reach level " + str(target_level) + " for " +
+                               str(hero.hero_id))
+                next_best_plans = {state: (exp_cost, chosen_options + [(0, mpf("0"), {})])
+                                   for state, (exp_cost, chosen_options) in best_plans.items()}
+            if len(next_best_plans) > self.MAX_PLAN_STATES:
+                next_best_plans = dict(sorted(next_best_plans.items(), key=lambda state_and_plan: state_and_plan[1][0]
+                                              + self.__level_up_shard_costs[state_and_plan[0][0]])
+                                       [:self.MAX_PLAN_STATES])
+            best_plans = next_best_plans
+
+        best_state: tuple = min(best_plans, key=lambda state: best_plans[state][0] +
+                                self.__level_up_shard_costs[state[0]])
+        level_up_shards: list = list(self.__level_up_shards)
+        exp_shards: dict = {group: list(exp_shards) for group, exp_shards in self.__exp_shard_groups.items()}
+        for (hero, target_level), option in zip(heroes, best_plans[best_state][1]):
+            number_of_level_up_shards, exp_cost, counts = option
+            chosen_exp_shards: list = []  # initial value
+            for group, count in counts.items():
+                chosen_exp_shards += exp_shards[group][:count]
+                del exp_shards[group][:count]
+            if len(chosen_exp_shards) > 0:
+                steps.append((hero.hero_id, "EXP SHARDS", chosen_exp_shards))
+            if number_of_level_up_shards > 0:
+                steps.append((hero.hero_id, "LEVEL UP SHARDS", level_up_shards[:number_of_level_up_shards]))
+                del level_up_shards[:number_of_level_up_shards]
+
+        order: list = ["SUMMON", "AWAKEN", "EXP SHARDS", "LEVEL UP SHARDS", "LIMIT BREAK"]
+        steps.sort(key=lambda step: (goal.hero_ids.index(step[0]), order.index(step[1])))
+        return {
+            "is_feasible": len(missing) == 0,
+            "coin_cost": fsum(item.coin_cost for hero_id, step_name, items in steps for item in items),
+            "steps": steps,
+            "missing": missing
+        }
+
+    def apply_plan(self, plan, inventory):
+        # type: (dict, Inventory) -> None
+        """
+        Uses the items of the plan on the heroes in hero_storage, adding summoned heroes to it, and removes the items
+        from the inventory. Level up shards left after reaching the max level wait for the limit break.
+        :return: None
+        """
+
+        steps_by_hero: dict = {}  # initial value
+        for hero_id, step_name, items in plan["steps"]:
+            steps_by_hero.setdefault(hero_id, {})[step_name] = items
+
+        used_item_ids: set = set()
+        for hero_id, hero_steps in steps_by_hero.items():
+            for items in hero_steps.values():
+                used_item_ids.update(id(item) for item in items)
+            if "SUMMON" in hero_steps:
+                self.hero_storage.add_hero([potential_hero for potential_hero in self.potential_heroes
+                                            if potential_hero.hero_id == hero_id][0].clone())
+            hero: Hero = self.__find_hero(hero_id)
+            if "AWAKEN" in hero_steps:
+                hero.awaken()
+            for exp_shard in hero_steps.get("EXP SHARDS", []):
+                hero.exp += exp_shard.exp_gain
+            hero.level_up()
+            is_limit_break_left: bool = "LIMIT BREAK" in hero_steps
+            for level_up_shard in hero_steps.get("LEVEL UP SHARDS", []):
+                if hero.level == hero.max_level and is_limit_break_left:
+                    is_limit_break_left = not hero.apply_limit_break()
+                    hero.level_up()
+                hero.exp = max(hero.exp, hero.required_exp)
+                hero.level_up()
+            if is_limit_break_left:
+                hero.apply_limit_break()
+                hero.level_up()
+
+        items: list = inventory.get_items()
+        items[:] = [item for item in items if id(item) not in used_item_ids]
+
+
+class PurchaseOptimizer:
+    """
+    This class contains attributes of an optimizer choosing the items to buy from an item shop for the most value
+    within a coin budget.
+
+    Listings which are the same item for the same coin cost are grouped, every group is split into bundles of 1, 2,
+    4, ... copies and a bounded knapsack DP runs over at most number_of_coin_buckets buckets of coins, so huge mpf
+    coin values do not make it slower. Costs are binary fractions, so when buckets of 1 / d coins, where d is the
+    least power of 2 making every cost whole, fit the coins within number_of_coin_buckets buckets, they are used and
+    the DP is exact. Otherwise the purchase is an approximation: budgets fall into bands a factor of 1 + BUDGET_BAND_WIDTH apart, the buckets
+    of a band are sized for its highest budget and costs are rounded up to whole buckets, so every purchase is
+    affordable. Items cheaper than a bucket fill the rest of the buckets by value per coin, and the coins left are
+    filled the same way from every group. Purchases are cached per shop inventory, value function, bucket size and
+    number of buckets, while the coins left are always filled against the real coins.
+    """
+
+    BUDGET_BAND_WIDTH: mpf = mpf("1") / 64
+    MAX_CACHED_PURCHASES: int = 256
+
+    def __init__(self, number_of_coin_buckets=1024, max_copies_per_listing=1):
+        # type: (int, int) -> None
+        self.number_of_coin_buckets: int = number_of_coin_buckets
+        self.max_copies_per_listing: int = max_copies_per_listing  # copies of every listed item the shop sells
+        self.__purchases_cache: dict = {}  # (inventory key, value function, bucket size, buckets) -> (copies, order)
+
+    @staticmethod
+    def get_exp_value(item):
+        # type: (Item) -> mpf
+        return item.exp_gain if isinstance(item, EXPShard) else mpf("0")
+
+    @staticmethod
+    def get_level_up_success_rate_value(item):
+        # type: (Item) -> mpf
+        return item.level_up_success_rate_up if isinstance(item, PowerUpStone) else mpf("0")
+
+    def get_budget_band(self, coins):
+        # type: (mpf) -> tuple
+        """
+        Gets the band of the budget and the highest budget of the band, which buckets of the band are sized for.
+        :return: a tuple (band index, budget the band ends at)
+        """
+
+        band: int = int(floor(log(coins) / log(1 + self.BUDGET_BAND_WIDTH)))
+        if (1 + self.BUDGET_BAND_WIDTH) ** band > coins:  # rounding of the logarithm
+            band -= 1
+        elif (1 + self.BUDGET_BAND_WIDTH) ** (band + 1) <= coins:
+            band += 1
+        return band, (1 + self.BUDGET_BAND_WIDTH) ** (band + 1)
+
+    @staticmethod
+    def get_coin_denominator(coin_cost):
+        # type: (mpf) -> int
+        """
+        Gets the least power of 2 which makes the coin cost whole when multiplied by it.
+        """
+
+        sign, mantissa, exponent, bit_count = mpf(coin_cost)._mpf_
+        return 2 ** max(-exponent, 0)
+
+    @staticmethod
+    def __fill_coins_left(groups, copies, coins, fill_order):
+        # type: (list, list, mpf, list) -> list
+        """
+        Adds copies of every group in fill_order (by value per coin) with the coins not spent yet. A single group bought on its own
+        is taken instead if it is worth more, so no item the player can afford is dropped by the rounding of buckets.
+        :return: a list of the copies to buy of every group
+        """
+
+        copies = list(copies)
+        coins_left: mpf = coins - fsum(groups[i][0] * copies[i] for i in range(len(groups)))
+        for i in fill_order:
+            coin_cost, value, count = groups[i]
+            if coin_cost > 0 and copies[i] < count and coin_cost <= coins_left:
+                number_of_copies: int = int(min(floor(coins_left / coin_cost), count - copies[i]))
+                copies[i] += number_of_copies
+                coins_left -= coin_cost * number_of_copies
+
+        total_value: mpf = fsum(groups[i][1] * copies[i] for i in range(len(groups)))
+        for i, (coin_cost, value, count) in enumerate(groups):
+            if 0 < coin_cost <= coins:
+                number_of_copies = int(min(floor(coins / coin_cost), count))
+                if value * number_of_copies > total_value:
+                    copies = [other_count if other_coin_cost <= 0 else 0 for other_coin_cost, other_value, other_count
+                              in groups]
+                    copies[i] = number_of_copies
+                    total_value = value * number_of_copies
+        return copies
+
+    def __choose_copies(self, groups, bucket_size, number_of_buckets):
+        # type: (list, mpf, int) -> list
+        """
+        Runs the bounded knapsack DP over (coin cost, value, copies available) groups costing at least a bucket,
+        within number_of_buckets buckets. For every number of buckets used, the rest of the buckets are filled with
+        the cheaper groups by value per coin.
+        :return: a list of the copies to buy of every group, not counting copies bought with coins left over
+        """
+
+        max_value: mpf = max(value for coin_cost, value, count in groups)
+        copies: list = [0] * len(groups)
+        if number_of_buckets == 0:
+            return [count if coin_cost <= 0 else 0 for coin_cost, value, count in groups]
+
+        budget: mpf = bucket_size * number_of_buckets
+        bundles: list = []  # (group index, copies, buckets, relative value)
+        small_groups: list = []  # indices of groups costing less than a bucket
+        for i, (coin_cost, value, count) in enumerate(groups):
+            if coin_cost <= 0:
+                copies[i] = count  # free items are always taken
+            elif coin_cost < bucket_size:
+                small_groups.append(i)
+            else:
+                bundle_size: int = 1  # initial value
+                while count > 0:
+                    number_of_copies: int = min(bundle_size, count)
+                    buckets: mpf = ceil(coin_cost * number_of_copies / bucket_size)
+                    if buckets <= number_of_buckets:
+                        bundles.append((i, number_of_copies, int(buckets),
+                                        float(value / max_value) * number_of_copies))
+                    count -= number_of_copies
+                    bundle_size *= 2
+
+        best_values: list = [0.0] * (number_of_buckets + 1)  # most value for at most b buckets
+        taken: list = []  # initial value
+        for i, number_of_copies, buckets, relative_value in bundles:
+            taken_at: bytearray = bytearray(number_of_buckets + 1)
+            for b in range(number_of_buckets, buckets - 1, -1):
+                candidate_value: float = best_values[b - buckets] + relative_value
+                if candidate_value > best_values[b]:
+                    best_values[b] = candidate_value
+                    taken_at[b] = 1
+            taken.append(taken_at)
+
+        small_groups.sort(key=lambda i: groups[i][0] / groups[i][1])
+        small_costs: list = [0.0]  # relative cost of the first n small groups in full
+        small_values: list = [0.0]  # relative value of the first n small groups in full
+        for i in small_groups:
+            coin_cost, value, count = groups[i]
+            small_costs.append(small_costs[-1] + float(coin_cost / budget) * count)
+            small_values.append(small_values[-1] + float(value / max_value) * count)
+
+        def get_small_groups_value(relative_budget):
+            # type: (float) -> float
+            n: int = bisect.bisect_right(small_costs, relative_budget) - 1
+            if n == len(small_groups):
+                return small_values[n]
+            coin_cost, value, count = groups[small_groups[n]]
+            return small_values[n] + float(value / max_value) * \
+                min(int((relative_budget - small_costs[n]) / float(coin_cost / budget)), count)
+
+        best_b: int = max(range(number_of_buckets + 1), key=lambda b: best_values[b] + get_small_groups_value(
+            (number_of_buckets - b) / number_of_buckets))
+        b: int = best_b
+        for (i, number_of_copies, buckets, relative_value), taken_at in zip(reversed(bundles), reversed(taken)):
+            if taken_at[b]:
+                copies[i] += number_of_copies
+                b -= buckets
+        return copies
+
+    def get_best_purchase(self, item_shop, coins, value_function):
+        # type: (ItemShop, mpf, object) -> dict
+        """
+        Chooses the items to buy from the shop with at most coins coins for the most total value, where
+        value_function gives the value of one item, e.g. PurchaseOptimizer.get_exp_value.
+        :return: a dictionary with "purchases" (a list of (listed item, copies)), "coin_cost", "value" and
+        "budget_band"
+        """
+
+        groups: dict = {}  # (class name, name, coin cost, value) -> listed items
+        for item in item_shop.get_items_sold():
+            value: mpf = value_function(item)
+            if value > 0:
+                groups.setdefault((type(item).__name__, item.name, item.coin_cost, value), []).append(item)
+        group_keys: list = list(groups.keys())
+        if coins <= 0 or len(group_keys) == 0:
+            return {"purchases": [], "coin_cost": mpf("0"), "value": mpf("0"), "budget_band": None}
+
+        group_counts: list = [(coin_cost, value, len(groups[(class_name, name, coin_cost, value)]) *
+                               self.max_copies_per_listing) for class_name, name, coin_cost, value in group_keys]
+        band, band_end = self.get_budget_band(coins)
+        denominator: int = max(self.get_coin_denominator(coin_cost) for coin_cost, value, count in group_counts)
+        if coins * denominator <= self.number_of_coin_buckets:
+            bucket_size: mpf = mpf("1") / denominator  # every cost is a whole number of buckets, so the DP is exact
+        else:
+            bucket_size = band_end / self.number_of_coin_buckets
+        number_of_buckets: int = int(min(floor(coins / bucket_size), self.number_of_coin_buckets))
+        cache_key: tuple = (tuple((group_key, len(groups[group_key])) for group_key in group_keys), value_function,
+                            bucket_size, number_of_buckets)
+        cached_purchase: tuple or None = self.__purchases_cache.get(cache_key)
+        if cached_purchase is None:
+            cached_purchase = (self.__choose_copies(group_counts, bucket_size, number_of_buckets),
+                               sorted(range(len(group_counts)), key=lambda group_index:
+                                      group_counts[group_index][0] / group_counts[group_index][1]))
+            if len(self.__purchases_cache) >= self.MAX_CACHED_PURCHASES:
+                del self.__purchases_cache[next(iter(self.__purchases_cache))]
+            self.__purchases_cache[cache_key] = cached_purchase
+        copies: list = self.__fill_coins_left(group_counts, cached_purchase[0], coins, cached_purchase[1])
+
+        purchases: list = []  # initial value
+        for group_key, number_of_copies in zip(group_keys, copies):
+            listed_items: list = groups[group_key]
+            for i, item in enumerate(listed_items):
+                item_copies: int = min(max(number_of_copies - i * self.max_copies_per_listing, 0),
+                                       self.max_copies_per_listing)
+                if item_copies > 0:
+                    purchases.append((item, item_copies))
+
+        return {
+            "purchases": purchases,
+            "coin_cost": fsum(item.coin_cost * item_copies for item, item_copies in purchases),
+            "value": fsum(value_function(item) * item_copies for item, item_copies in purchases),
+            "budget_band": band
+        }
+
+    def clear_cache(self):
+        # type: () -> None
+        self.__purchases_cache.clear()
+
+
 class Game:
     """
     This class contains attributes of saved game data.
@@ -1661,20 +5128,443 @@ class Game:
         # type: () -> list
         return self.__potential_heroes
 
+    def get_hero_templates(self):
+        # type: () -> dict
+        return {hero.hero_id: hero for hero in self.__potential_heroes}
+
+    def convert_battle_areas_to_descriptors(self):
+        # type: () -> int
+        """
+        Turns the stages of every battle area given their enemies into lazy stages built from enemy descriptors, so
+        that neither the game in memory nor its saves keep enemies which can be built again from potential heroes.
+        :return: the number of stages converted
+        """
+
+        hero_templates: dict = self.get_hero_templates()
+        return sum(stage.convert_to_descriptors(hero_templates) for battle_area in self.__battle_areas
+                   for level in battle_area.get_levels() for stage in level.get_stages())
+
     def clone(self):
         # type: () -> Game
         return copy.deepcopy(self)
 
 
+class Profiler:
+    """
+    This class contains attributes of a profiler counting calls and timing hot paths of the game.
+
+    Hot paths are only wrapped while the profiler is enabled, so the game runs the original functions with no
+    overhead at all when profiling is disabled. Module functions are replaced on this module, so other modules have
+    to call them through it (e.g. ancient_invasion.save_game_data) rather than through names they imported.
+    """
+
+    INSTRUMENTED_FUNCTIONS: list = [
+        ("Action", "execute", lambda action, user, target, skill_to_use=None, rng=None: action.name
+         if skill_to_use is None else action.name + " " + type(skill_to_use).__name__),
+        ("DamageMultiplier", "calculate_normal_raw_damage_without_enemy_defense", None),
+        ("DamageMultiplier", "calculate_normal_raw_damage", None),
+        ("DamageMultiplier", "calculate_critical_raw_damage_without_enemy_defense", None),
+        ("DamageMultiplier", "calculate_critical_raw_damage", None),
+        ("Hero", "level_up", None),
+        ("Gear", "update_set_effect", None),
+        (None, "save_game_data", None),
+        (None, "load_game_data", None)
+    ]  # (class name or None for module functions, function name, function getting the branch name or None)
+    MAX_TRACE_EVENTS: int = 1000000
+
+    def __init__(self, record_trace=False):
+        # type: (bool) -> None
+        self.record_trace: bool = record_trace
+        self.is_enabled: bool = False
+        self.__call_counts: dict = {}  # initial value
+        self.__total_times: dict = {}  # initial value
+        self.__trace_events: list = []  # initial value
+        self.__original_functions: list = []  # initial value
+
+    def __wrap(self, name, function, get_branch):
+        # type: (str, callable, callable or None) -> callable
+        call_counts: dict = self.__call_counts
+        total_times: dict = self.__total_times
+        trace_events: list or None = self.__trace_events if self.record_trace else None
+        perf_counter: callable = time.perf_counter
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key: str = name if get_branch is None else name + "[" + get_branch(*args, **kwargs) + "]"
+            start_time: float = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed_time: float = perf_counter() - start_time
+                call_counts[key] = call_counts.get(key, 0) + 1
+                total_times[key] = total_times.get(key, 0.0) + elapsed_time
+                if trace_events is not None and len(trace_events) < self.MAX_TRACE_EVENTS:
+                    trace_events.append((key, start_time, elapsed_time, threading.get_ident()))
+
+        return wrapper
+
+    def enable(self):
+        # type: () -> bool
+        if self.is_enabled:
+            return False
+
+        module = sys.modules[__name__]
+        for class_name, function_name, get_branch in self.INSTRUMENTED_FUNCTIONS:
+            owner = module if class_name is None else getattr(module, class_name)
+            original_function: callable = owner.__dict__[function_name]
+            self.__original_functions.append((owner, function_name, original_function))
+            name: str = function_name if class_name is None else class_name + "." + function_name
+            setattr(owner, function_name, self.__wrap(name, original_function, get_branch))
+
+        self.is_enabled = True
+        return True
+
+    def disable(self):
+        # type: () -> bool
+        if not self.is_enabled:
+            return False
+
+        for owner, function_name, original_function in reversed(self.__original_functions):
+            setattr(owner, function_name, original_function)
+
+        self.__original_functions = []
+        self.is_enabled = False
+        return True
+
+    def __enter__(self):
+        # type: () -> Profiler
+        self.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # type: (type, Exception, object) -> None
+        self.disable()
+
+    def reset(self):
+        # type: () -> None
+        self.__call_counts.clear()
+        self.__total_times.clear()
+        self.__trace_events.clear()
+
+    def get_report(self):
+        # type: () -> list
+        """
+        Gets (name, number of calls, total seconds, mean microseconds per call) of every profiled function or branch.
+        :return: a list of rows sorted from the highest to the lowest total time
+        """
+
+        return sorted([(key, count, self.__total_times[key], self.__total_times[key] / count * 1e6)
+                       for key, count in self.__call_counts.items()], key=lambda row: row[2], reverse=True)
+
+    def get_flat_report(self):
+        # type: () -> str
+        lines: list = ["%-80s %12s %14s %14s" % ("NAME", "CALLS", "TOTAL (S)", "MEAN (US)")]
+        for name, count, total_time, mean_time in self.get_report():
+            lines.append("%-80s %12d %14.6f %14.3f" % (name, count, total_time, mean_time))
+        return "\n".join(lines)
+
+    def get_chrome_trace(self):
+        # type: () -> dict
+        process_id: int = os.getpid()
+        return {"traceEvents": [{"name": key, "ph": "X", "ts": start_time * 1e6, "dur": elapsed_time * 1e6,
+                                 "pid": process_id, "tid": thread_id}
+                                for key, start_time, elapsed_time, thread_id in self.__trace_events],
+                "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, file_name):
+        # type: (str) -> None
+        with open(file_name, "w") as file:
+            json.dump(self.get_chrome_trace(), file)
+
+
+def get_percentile(sorted_values, percentage):
+    # type: (list, float) -> float
+    if len(sorted_values) == 0:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * percentage / 100), len(sorted_values) - 1)]
+
+
+def to_json_value(value):
+    # type: (object) -> object
+    """
+    Converts mpf values into floats, or into strings if they are too large for a float, so they can be written as
+    JSON.
+    :return: the converted value
+    """
+
+    if isinstance(value, mpf):
+        return float(value) if isfinite(value) and abs(value) < mpf("1e308") else str(value)
+    return value
+
+
+def print_json_line(data):
+    # type: (dict) -> None
+    print(json.dumps({key: to_json_value(value) for key, value in data.items()}), flush=True)
+
+
+def print_throughput_summary(command, battle_seconds, total_seconds):
+    # type: (str, list, float) -> None
+    sorted_seconds: list = sorted(battle_seconds)
+    print_json_line({"summary": command, "battles": len(sorted_seconds), "seconds": total_seconds,
+                     "battles_per_second": len(sorted_seconds) / total_seconds if total_seconds > 0 else 0.0,
+                     "p50_battle_ms": get_percentile(sorted_seconds, 50) * 1000,
+                     "p99_battle_ms": get_percentile(sorted_seconds, 99) * 1000})
+
+
+def create_hero_from_dict(hero_data, rng):
+    # type: (dict, random.Random) -> Hero
+    """
+    Creates a hero described in a team file. A hero is either {"random": true} (optionally with "hero_id") or its
+    stats with "hero_id", "name", "element", "type", "rating", "max_hp", "max_magic_points", "attack_power",
+    "defense", "attack_speed" and optionally "skill_multiplier", "is_aoe" and "max_cooltime" of its basic skills.
+    :return: the hero
+    """
+
+    hero_id: str = str(hero_data.get("hero_id", uuid.uuid4()))
+    if hero_data.get("random", False):
+        return generate_random_hero(hero_id, rng)
+
+    skills: list = create_basic_skills(hero_id, mpf(str(hero_data.get("skill_multiplier", 1))),
+                                       bool(hero_data.get("is_aoe", False)), int(hero_data.get("max_cooltime", 3)))
+    return Hero(hero_id, str(hero_data.get("name", hero_id)), str(hero_data.get("element", "FIRE")),
+                str(hero_data.get("type", "ATTACK")), int(hero_data.get("rating", 1)),
+                *[mpf(str(hero_data[stat])) for stat in ["max_hp", "max_magic_points", "attack_power", "defense",
+                                                         "attack_speed"]],
+                skills, mpf("1e6"), AwakenBonus(*[mpf("0")] * 9, new_skill_gained=None),
+                SecondaryAwakenBonus(*[mpf("0")] * 4, new_upgraded_skills_list=[]))
+
+
+def load_team_file(file_name, rng):
+    # type: (str, random.Random) -> tuple
+    """
+    Loads a JSON team file of the form {"teams": [{"name": ..., "leader": index, "heroes": [...]}, ...],
+    "matches": [[team index, team index], ...]}. Every pair of teams meets once if "matches" is left out.
+    :return: a tuple (list of (name, team), list of (team index, team index))
+    """
+
+    with open(file_name) as file:
+        data: dict = json.load(file)
+
+    teams: list = []  # initial value
+    for i, team_data in enumerate(data["teams"]):
+        team: Team = Team([create_hero_from_dict(hero_data, rng) for hero_data in team_data["heroes"]])
+        if len(team.get_heroes_list()) > 0:
+            team.set_leader(team.get_heroes_list()[int(team_data.get("leader", 0))])
+        teams.append((str(team_data.get("name", i)), team))
+
+    matches: list = [tuple(match) for match in data["matches"]] if "matches" in data else \
+        list(itertools.combinations(range(len(teams)), 2))
+    return teams, matches
+
+
+def run_simulate_command(arguments):
+    # type: (argparse.Namespace) -> None
+    teams, matches = load_team_file(arguments.team_file, random.Random(arguments.seed))
+    battles: list = [(team1_index, team2_index) for repetition in range(arguments.repeat)
+                     for team1_index, team2_index in matches]
+    if arguments.limit is not None:
+        battles = battles[:arguments.limit]
+
+    payloads: list = [(str(arguments.seed) + ":" + str(i), teams[team1_index][1], teams[team2_index][1])
+                      for i, (team1_index, team2_index) in enumerate(battles)]
+    shard_size: int = max(len(payloads) // max(arguments.workers * 4, 1), 1)
+    shards: list = [payloads[i:i + shard_size] for i in range(0, len(payloads), shard_size)]
+    start_time: float = time.perf_counter()
+    if arguments.workers > 1:
+        with ProcessPoolExecutor(arguments.workers) as executor:
+            timed_results: list = [timed_result for shard_results in executor.map(
+                simulate_timed_matches, shards, [arguments.max_turns] * len(shards))
+                                   for timed_result in shard_results]
+    else:
+        timed_results = simulate_timed_matches(payloads, arguments.max_turns)
+
+    for i, ((team1_index, team2_index), (result, turns_taken, seconds)) in enumerate(zip(battles, timed_results)):
+        print_json_line({"battle": i, "team1": teams[team1_index][0], "team2": teams[team2_index][0],
+                         "result": result, "turns": turns_taken, "seconds": seconds})
+    print_throughput_summary("simulate", [seconds for result, turns_taken, seconds in timed_results],
+                             time.perf_counter() - start_time)
+
+
+def run_farm_command(arguments):
+    # type: (argparse.Namespace) -> None
+    game: Game = load_game_data(arguments.save_file)
+    battle_area: BattleArea = game.get_battle_areas()[arguments.area]
+    runner: AutoFarmRunner = AutoFarmRunner(game.player, battle_area, battle_area.get_levels()[arguments.level],
+                                            arguments.max_turns, rng=random.Random(arguments.seed))
+    run_seconds: list = []  # initial value
+    start_time: float = time.perf_counter()
+    run_start_time: float = start_time
+    for run_number, is_won, turns_taken in runner.run(arguments.limit if arguments.limit is not None else 1,
+                                                      stop_on_defeat=False):
+        run_seconds.append(time.perf_counter() - run_start_time)
+        print_json_line({"run": run_number, "is_won": is_won, "turns": turns_taken, "seconds": run_seconds[-1]})
+        run_start_time = time.perf_counter()
+
+    runner.apply_rewards()
+    if arguments.output is not None:
+        save_game_data(game, arguments.output)
+    print_throughput_summary("farm", run_seconds, time.perf_counter() - start_time)
+
+
+def run_arena_command(arguments):
+    # type: (argparse.Namespace) -> None
+    if arguments.save_file is not None:
+        trainers: list = load_game_data(arguments.save_file).get_opponent_trainers()
+    else:
+        rng: random.Random = random.Random(arguments.seed)
+        trainers = [generate_random_trainer("TRAINER " + str(i), rng) for i in range(arguments.trainers)]
+
+    simulator: ArenaSeasonSimulator = ArenaSeasonSimulator(
+        trainers, arguments.limit if arguments.limit is not None else 1, number_of_workers=arguments.workers,
+        seed=arguments.seed, max_turns=arguments.max_turns)
+    battle_seconds: list = []  # initial value
+    start_time: float = time.perf_counter()
+    last_round: int = 0  # initial value
+    for round_number, updated_trainers in simulator.run():
+        battle_seconds += [seconds for turns_taken, seconds in simulator.last_shard_timings]
+        last_round = round_number
+        print_json_line({"round": round_number, "battles": len(simulator.last_shard_timings),
+                         "leader": simulator.get_standings(1)[0].name,
+                         "leader_arena_points": simulator.get_standings(1)[0].arena_points})
+
+    print_json_line({"round": last_round, "rank_distribution": simulator.get_rank_distribution()})
+    print_throughput_summary("arena", battle_seconds, time.perf_counter() - start_time)
+
+
+def get_hero_summary(hero):
+    # type: (Hero) -> dict
+    return {"hero_id": hero.hero_id, "name": hero.name, "element": hero.element, "type": hero.type,
+            "rating": hero.rating, "level": hero.level, "max_hp": hero.max_hp,
+            "max_magic_points": hero.max_magic_points, "attack_power": hero.attack_power, "defense": hero.defense,
+            "attack_speed": hero.attack_speed}
+
+
+def get_game_summary(game):
+    # type: (Game) -> dict
+    item_counts: dict = {}  # initial value
+    for item in game.player.item_inventory.get_items():
+        item_counts[type(item).__name__] = item_counts.get(type(item).__name__, 0) + 1
+    return {"player": game.player.name, "level": game.player.level, "coins": game.player.coins,
+            "arena_points": game.player.arena_points, "rank": game.player.rank.value,
+            "heroes": len(game.player.hero_storage.get_heroes()), "items": item_counts,
+            "battle_areas": len(game.get_battle_areas()),
+            "levels": sum(len(battle_area.get_levels()) for battle_area in game.get_battle_areas()),
+            "opponent_trainers": len(game.get_opponent_trainers()),
+            "potential_heroes": len(game.get_potential_heroes())}
+
+
+def run_inspect_command(arguments):
+    # type: (argparse.Namespace) -> None
+    game: Game = load_game_data(arguments.save_file)
+    print_json_line(get_game_summary(game))
+    heroes: list = game.player.hero_storage.get_heroes()
+    for hero in heroes[:arguments.limit] if arguments.limit is not None else heroes:
+        print_json_line(get_hero_summary(hero))
+
+
+def run_convert_command(arguments):
+    # type: (argparse.Namespace) -> None
+    """
+    Converts a save into a JSON export if the output file name ends with ".json", and otherwise saves it again with
+    the highest pickle protocol.
+    :return: None
+    """
+
+    game: Game = load_game_data(arguments.save_file)
+    if arguments.output.endswith(".json"):
+        with open(arguments.output, "w") as file:
+            json.dump({"summary": {key: to_json_value(value) for key, value in get_game_summary(game).items()},
+                       "heroes": [{key: to_json_value(value) for key, value in get_hero_summary(hero).items()}
+                                  for hero in game.player.hero_storage.get_heroes()],
+                       "items": [{"class": type(item).__name__, "name": item.name,
+                                  "coin_cost": to_json_value(item.coin_cost)}
+                                 for item in game.player.item_inventory.get_items()]}, file)
+    else:
+        with open(arguments.output, "wb") as file:
+            pickle.dump(game, file, pickle.HIGHEST_PROTOCOL)
+    print_json_line({"converted": arguments.output, "bytes": os.path.getsize(arguments.output)})
+
+
+def add_common_arguments(parser, defaults=None):
+    # type: (argparse.ArgumentParser, dict or None) -> None
+    """
+    Adds the options shared by every command. Subcommands get them without defaults so that they can be given either
+    before or after the subcommand.
+    :return: None
+    """
+
+    if defaults is None:
+        defaults = {"workers": argparse.SUPPRESS, "seed": argparse.SUPPRESS, "limit": argparse.SUPPRESS,
+                    "max_turns": argparse.SUPPRESS}
+    parser.add_argument("--workers", type=int, default=defaults["workers"], help="worker processes for battles")
+    parser.add_argument("--seed", type=int, default=defaults["seed"])
+    parser.add_argument("--limit", type=int, default=defaults["limit"],
+                        help="maximum battles (simulate), runs (farm), rounds (arena) or heroes listed (inspect)")
+    parser.add_argument("--max-turns", type=int, default=defaults["max_turns"])
+
+
+def create_argument_parser():
+    # type: () -> argparse.ArgumentParser
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Ancient Invasion headless batch tools. "
+                                                                          "Every command writes JSON lines.")
+    add_common_arguments(parser, {"workers": 1, "seed": 0, "limit": None, "max_turns": Battle.MAX_TURNS})
+    subparsers: argparse._SubParsersAction = parser.add_subparsers(dest="command")
+
+    simulate_parser: argparse.ArgumentParser = subparsers.add_parser("simulate", help="battles between teams in a "
+                                                                                      "JSON team file")
+    simulate_parser.add_argument("team_file")
+    simulate_parser.add_argument("--repeat", type=int, default=1, help="times every match is played")
+    add_common_arguments(simulate_parser)
+    simulate_parser.set_defaults(function=run_simulate_command)
+
+    farm_parser: argparse.ArgumentParser = subparsers.add_parser("farm", help="replay a level of a save")
+    farm_parser.add_argument("save_file")
+    farm_parser.add_argument("--area", type=int, default=0, help="index of the battle area")
+    farm_parser.add_argument("--level", type=int, default=0, help="index of the level in the battle area")
+    farm_parser.add_argument("--output", help="save file to write the farmed game to")
+    add_common_arguments(farm_parser)
+    farm_parser.set_defaults(function=run_farm_command)
+
+    arena_parser: argparse.ArgumentParser = subparsers.add_parser("arena", help="run an arena season")
+    arena_parser.add_argument("save_file", nargs="?", help="save whose opponent trainers take part")
+    arena_parser.add_argument("--trainers", type=int, default=100, help="random trainers if no save is given")
+    add_common_arguments(arena_parser)
+    arena_parser.set_defaults(function=run_arena_command)
+
+    inspect_parser: argparse.ArgumentParser = subparsers.add_parser("inspect", help="summarise a save")
+    inspect_parser.add_argument("save_file")
+    add_common_arguments(inspect_parser)
+    inspect_parser.set_defaults(function=run_inspect_command)
+
+    convert_parser: argparse.ArgumentParser = subparsers.add_parser("convert", help="convert a save to JSON or "
+                                                                                    "to the latest pickle protocol")
+    convert_parser.add_argument("save_file")
+    convert_parser.add_argument("output")
+    add_common_arguments(convert_parser)
+    convert_parser.set_defaults(function=run_convert_command)
+    return parser
+
+
 # Creating main function to run the game.
 
 
-def main():
+def main(command_line_arguments=None):
+    # type: (list or None) -> None
     """
-    This function is used to run the game.
+    This function is used to run the game, or one of the headless batch commands if command line arguments are given.
     :return: None
     """
 
+    if command_line_arguments is None:
+        command_line_arguments = sys.argv[1:]
+    if len(command_line_arguments) > 0:
+        arguments: argparse.Namespace = create_argument_parser().parse_args(command_line_arguments)
+        if arguments.command is None:
+            create_argument_parser().print_help()
+            return
+        arguments.function(arguments)
+        return
+
     print("Welcome to 'Ancient Invasion' by 'DtjiSoftwareDeveloper'.")
     print("This game is a turn based strategy RPG where you use a team of heroes to battle ")
     print("against another team of heroes.")
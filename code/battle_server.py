@@ -0,0 +1,373 @@
+"""
+This file contains source code of the multiplayer battle server of the game "Ancient Invasion" and a load generator
+running simulated players against it.
+Author: DtjiSoftwareDeveloper
+"""
+
+
+# Importing necessary libraries
+
+import sys
+import json
+import time
+import struct
+import random
+import asyncio
+import itertools
+from ancient_invasion import *
+from memory_report import install_memory_report_signal_handler
+
+
+# Creating static functions to be used throughout the server.
+
+
+FRAME_HEADER: struct.Struct = struct.Struct("!I")  # every frame is a 4 byte big-endian length followed by JSON
+MAX_FRAME_SIZE: int = 4096  # bytes of JSON in a frame, far more than any join or action frame needs
+
+
+async def read_frame(reader):
+    # type: (asyncio.StreamReader) -> dict or None
+    """
+    Reads one frame. Frames longer than MAX_FRAME_SIZE or not holding a JSON object end the connection, as the
+    length of the next frame cannot be trusted after them.
+    :return: the message or None if the connection is closed or the frame is invalid
+    """
+
+    try:
+        header: bytes = await reader.readexactly(FRAME_HEADER.size)
+        frame_size: int = FRAME_HEADER.unpack(header)[0]
+        if frame_size > MAX_FRAME_SIZE:
+            return None
+        message: object = json.loads(await reader.readexactly(frame_size))
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        return None
+    return message if isinstance(message, dict) else None
+
+
+async def read_frames(reader, frames):
+    # type: (asyncio.StreamReader, asyncio.Queue) -> None
+    """
+    Reads every frame of a connection into a queue, ending it with None. Waiting on the queue rather than on the
+    stream lets a turn time out without cancelling a read halfway through a frame.
+    :return: None
+    """
+
+    while True:
+        message: dict or None = await read_frame(reader)
+        await frames.put(message)
+        if message is None:
+            return
+
+
+def write_frame(writer, message):
+    # type: (asyncio.StreamWriter, dict) -> None
+    payload: bytes = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    writer.write(FRAME_HEADER.pack(len(payload)) + payload)
+
+
+# Creating necessary classes.
+
+
+class BattleSession:
+    """
+    This class contains attributes of a battle between a connected player and an AI controlled trainer.
+    """
+
+    def __init__(self, session_id, player_team, opponent_team):
+        # type: (int, Team, Team) -> None
+        self.session_id: int = session_id
+        self.battle: Battle = Battle(player_team, opponent_team)
+        self.battle.start()
+        self.__heroes: list = self.battle.get_heroes()
+        self.__last_state: list = [None] * len(self.__heroes)
+
+    def get_heroes(self):
+        # type: () -> list
+        return self.__heroes
+
+    def is_player_hero(self, hero):
+        # type: (Hero) -> bool
+        return hero.curr_team is self.battle.team1
+
+    def get_state_delta(self):
+        # type: () -> list
+        """
+        Gets [hero index, current HP, current magic points, attack gauge] of the heroes changed since the last call.
+        :return: a list of changed hero states
+        """
+
+        delta: list = []  # initial value
+        for index, hero in enumerate(self.__heroes):
+            state: list = [float(hero.curr_hp), float(hero.curr_magic_points), float(hero.attack_gauge)]
+            if state != self.__last_state[index]:
+                self.__last_state[index] = state
+                delta.append([index] + state)
+        return delta
+
+    def perform_command(self, hero, command):
+        # type: (Hero, dict) -> bool
+        """
+        Makes the hero carry out an action sent by the client, as long as the action is one the client could have
+        chosen: attacks and skills against an alive enemy, normal heals on the hero itself and skills of the hero
+        which are off cooltime and affordable.
+        :return: True if the action was carried out, False otherwise
+        """
+
+        action_name: str = str(command.get("action", "NORMAL ATTACK"))
+        try:
+            target_index: int = int(command.get("target", 0))
+            skill_index: int or None = int(command["skill"]) if "skill" in command else None
+        except (ValueError, TypeError):
+            return False
+
+        skills: list = hero.get_skills()
+        if not 0 <= target_index < len(self.__heroes) or \
+                (skill_index is not None and not 0 <= skill_index < len(skills)):
+            return False
+
+        target: Hero = self.__heroes[target_index]
+        skill: Skill or None = skills[skill_index] if skill_index is not None else None
+        if action_name == "NORMAL HEAL":
+            if target != hero:
+                return False
+        elif action_name == "NORMAL ATTACK" or action_name == "USE SKILL":
+            if target.curr_team is hero.curr_team or not target.get_is_alive():
+                return False
+        else:
+            return False
+
+        if action_name == "USE SKILL":
+            if skill is None or hero.curr_magic_points < skill.magic_points_cost:
+                return False
+            if isinstance(skill, SpecialPower) and skill.cooltime != 0:
+                return False
+
+        return self.battle.perform_action(hero, action_name, target, skill)
+
+    def clone(self):
+        # type: () -> BattleSession
+        return copy.deepcopy(self)
+
+
+class BattleServer:
+    """
+    This class contains attributes of an asyncio server holding many concurrent battle sessions in memory. AI actions
+    are chosen on the event loop, as sending a battle to a worker process costs more than choosing its action, and
+    every turn yields to the other sessions.
+    """
+
+    def __init__(self, potential_heroes, turn_timeout=10.0):
+        # type: (list, float) -> None
+        self.__potential_heroes: list = potential_heroes
+        self.turn_timeout: float = turn_timeout
+        self.__sessions: dict = {}  # session ID -> BattleSession
+        self.__session_ids: iter = itertools.count(1)
+        self.__server: asyncio.AbstractServer or None = None
+        self.battles_finished: int = 0
+
+    def get_sessions(self):
+        # type: () -> dict
+        return self.__sessions
+
+    def create_team(self, rng):
+        # type: (random.Random) -> Team
+        return Team([hero.clone() for hero in rng.sample(self.__potential_heroes, Team.MAX_HEROES)])
+
+    async def start(self, host="127.0.0.1", port=0):
+        # type: (str, int) -> int
+        self.__server = await asyncio.start_server(self.handle_client, host, port)
+        return self.__server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        # type: () -> None
+        if self.__server is not None:
+            self.__server.close()
+            await self.__server.wait_closed()
+
+    async def handle_client(self, reader, writer):
+        # type: (asyncio.StreamReader, asyncio.StreamWriter) -> None
+        """
+        Runs one battle session per connection. The client sends a "join" frame, then answers every "turn" frame
+        with an "action" frame carrying the same turn number before the turn times out, after which the AI moves for
+        the client's hero. Actions for earlier turns are dropped. Every action is followed by a "state" frame with the
+        heroes that changed and the session ends with an "end" frame.
+        :return: None
+        """
+
+        session: BattleSession or None = None
+        frames: asyncio.Queue = asyncio.Queue()
+        frame_reader: asyncio.Task = asyncio.ensure_future(read_frames(reader, frames))
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        try:
+            join_message: dict or None = await frames.get()
+            if join_message is None or join_message.get("type") != "join":
+                return
+
+            rng: random.Random = random.Random(join_message.get("seed"))
+            session = BattleSession(next(self.__session_ids), self.create_team(rng), self.create_team(rng))
+            self.__sessions[session.session_id] = session
+            write_frame(writer, {"type": "joined", "session": session.session_id, "state": session.get_state_delta()})
+            battle: Battle = session.battle
+            while not battle.get_is_over() and battle.turns_taken < battle.MAX_TURNS:
+                hero: Hero = battle.get_someone_to_move()
+                battle.whose_turn = hero
+                hero_index: int = session.get_heroes().index(hero)
+                is_performed: bool = not battle.begin_turn(hero)  # heroes unable to move skip their turns
+                if not is_performed and session.is_player_hero(hero):
+                    turn: int = battle.turns_taken
+                    write_frame(writer, {"type": "turn", "turn": turn, "hero": hero_index,
+                                         "timeout": self.turn_timeout})
+                    await writer.drain()
+                    deadline: float = loop.time() + self.turn_timeout
+                    while loop.time() < deadline:
+                        try:
+                            command: dict or None = await asyncio.wait_for(frames.get(), deadline - loop.time())
+                        except asyncio.TimeoutError:
+                            break
+                        if command is None:
+                            return
+                        if command.get("type") == "action" and command.get("turn") == turn:
+                            is_performed = session.perform_command(hero, command)
+                            break
+
+                if not is_performed:
+                    ai_action: tuple or None = battle.choose_ai_action(hero)
+                    if ai_action is not None:
+                        action_name, skill, target = ai_action
+                        battle.perform_action(hero, action_name, target, skill)
+
+                battle.end_turn(hero)
+                write_frame(writer, {"type": "state", "hero": hero_index, "changes": session.get_state_delta()})
+                await writer.drain()
+                await asyncio.sleep(0)  # drain only waits for slow clients, so AI turns yield here
+
+            winner: int = 1 if battle.winner is battle.team1 else 2 if battle.winner is battle.team2 else 0
+            write_frame(writer, {"type": "end", "winner": winner, "turns": battle.turns_taken})
+            await writer.drain()
+            self.battles_finished += 1
+        except ConnectionError:
+            pass
+        finally:
+            frame_reader.cancel()
+            if session is not None:
+                self.__sessions.pop(session.session_id, None)
+            writer.close()
+
+
+class LoadGenerator:
+    """
+    This class contains attributes of a load generator running simulated players against a local battle server.
+    """
+
+    def __init__(self, port, number_of_clients, battles_per_client=1, seed=0, host="127.0.0.1"):
+        # type: (int, int, int, int, str) -> None
+        self.host: str = host
+        self.port: int = port
+        self.number_of_clients: int = number_of_clients
+        self.battles_per_client: int = battles_per_client
+        self.seed: int = seed
+        self.__turn_latencies: list = []  # seconds between sending an action and receiving its state frame
+        self.battles_finished: int = 0
+        self.turns_played: int = 0
+
+    async def play_battle(self, rng):
+        # type: (random.Random) -> None
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            write_frame(writer, {"type": "join", "seed": rng.randrange(2 ** 32)})
+            await writer.drain()
+            number_of_heroes: int = 2 * Team.MAX_HEROES
+            sent_at: float or None = None
+            while True:
+                message: dict or None = await read_frame(reader)
+                if message is None:
+                    return
+                if message["type"] == "turn":
+                    write_frame(writer, {"type": "action", "turn": message["turn"], "action": "NORMAL ATTACK",
+                                         "target": rng.randrange(Team.MAX_HEROES, number_of_heroes)})
+                    await writer.drain()
+                    sent_at = time.perf_counter()
+                elif message["type"] == "state" and sent_at is not None:
+                    self.__turn_latencies.append(time.perf_counter() - sent_at)
+                    self.turns_played += 1
+                    sent_at = None
+                elif message["type"] == "end":
+                    self.battles_finished += 1
+                    return
+        finally:
+            writer.close()
+
+    async def run_client(self, client_number):
+        # type: (int) -> None
+        rng: random.Random = random.Random(str(self.seed) + ":" + str(client_number))
+        for i in range(self.battles_per_client):
+            await self.play_battle(rng)
+
+    async def run(self):
+        # type: () -> dict
+        """
+        Runs all simulated players concurrently.
+        :return: a report of throughput and turn latency percentiles
+        """
+
+        start_time: float = time.perf_counter()
+        await asyncio.gather(*[self.run_client(i) for i in range(self.number_of_clients)])
+        elapsed_time: float = time.perf_counter() - start_time
+        latencies: list = sorted(self.__turn_latencies)
+        return {
+            "clients": self.number_of_clients,
+            "battles": self.battles_finished,
+            "turns": self.turns_played,
+            "seconds": elapsed_time,
+            "battles_per_second": self.battles_finished / elapsed_time if elapsed_time > 0 else 0.0,
+            "turns_per_second": self.turns_played / elapsed_time if elapsed_time > 0 else 0.0,
+            "p50_turn_latency_ms": get_percentile(latencies, 50) * 1000,
+            "p99_turn_latency_ms": get_percentile(latencies, 99) * 1000
+        }
+
+
+# Creating main function to run the server.
+
+
+async def run_load_test(number_of_clients, battles_per_client, seed):
+    # type: (int, int, int) -> dict
+    rng: random.Random = random.Random(seed)
+    server: BattleServer = BattleServer([generate_random_hero(str(i), rng) for i in range(50)])
+    port: int = await server.start()
+    try:
+        return await LoadGenerator(port, number_of_clients, battles_per_client, seed).run()
+    finally:
+        await server.stop()
+
+
+async def serve(port, seed):
+    # type: (int, int) -> None
+    rng: random.Random = random.Random(seed)
+    server: BattleServer = BattleServer([generate_random_hero(str(i), rng) for i in range(50)])
+    print("Serving battles on port " + str(await server.start(port=port)) + ".")
+    if install_memory_report_signal_handler("battle_server_memory_report.json", loop=asyncio.get_running_loop()):
+        print("Send SIGUSR1 to write a memory report to battle_server_memory_report.json.")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main():
+    """
+    This function is used to run the server ("serve [port]") or a load test against a local server
+    ("load [clients] [battles per client]").
+    :return: None
+    """
+
+    arguments: list = sys.argv[1:]
+    if len(arguments) > 0 and arguments[0] == "serve":
+        asyncio.run(serve(int(arguments[1]) if len(arguments) > 1 else 8765, 0))
+    else:
+        options: list = arguments[1:] if len(arguments) > 0 and arguments[0] == "load" else []
+        print(json.dumps(asyncio.run(run_load_test(int(options[0]) if len(options) > 0 else 1000,
+                                                   int(options[1]) if len(options) > 1 else 1, 0))))
+
+
+if __name__ == '__main__':
+    main()
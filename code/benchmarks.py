@@ -0,0 +1,397 @@
+"""
+This file contains reproducible benchmarks of the battle, progression and persistence hot paths of the game
+"Ancient Invasion".
+Author: DtjiSoftwareDeveloper
+"""
+
+
+# Importing necessary libraries
+
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+import ancient_invasion
+from ancient_invasion import *
+
+
+# Creating static functions to be used throughout the benchmarks.
+
+
+def create_team(name, rng, is_aoe=None):
+    # type: (str, random.Random, bool or None) -> Team
+    team: Team = Team([generate_random_hero(name + "-" + str(i), rng) for i in range(Team.MAX_HEROES)])
+    if is_aoe is not None:
+        for hero in team.get_heroes_list():
+            for skill in hero.get_skills():
+                if isinstance(skill, ActiveSkill):
+                    skill.is_aoe = is_aoe
+    return team
+
+
+def create_synthetic_game(number_of_heroes, number_of_items, rng):
+    # type: (int, int, random.Random) -> Game
+    player: Player = Player("BENCHMARK PLAYER")
+    for i in range(number_of_heroes):
+        player.hero_storage.add_hero(generate_random_hero(str(i), rng))
+
+    for i in range(number_of_items):
+        kind: int = i % 4
+        if kind == 0:
+            player.item_inventory.add_item(Gear("GEAR " + str(i), "", mpf(rng.randint(1000, 9000)),
+                                                rng.randint(Gear.MIN_RATING, Gear.MAX_RATING),
+                                                rng.randint(Gear.MIN_SLOT_NUMBER, Gear.MAX_SLOT_NUMBER),
+                                                rng.choice(Gear.POSSIBLE_SET_NAMES),
+                                                rng.choice(Gear.POSSIBLE_PRIMARY_ATTRIBUTES)))
+        elif kind == 1:
+            player.item_inventory.add_item(EXPShard("EXP SHARD", "", mpf("1000"), mpf(rng.randint(1, 100)) * 1000))
+        elif kind == 2:
+            player.item_inventory.add_item(PowerUpStone("POWER UP STONE", "", mpf("500"), mpf("0.1")))
+        else:
+            player.item_inventory.add_item(AwakenShard("AWAKEN SHARD", "", mpf("2000"),
+                                                       str(rng.randrange(number_of_heroes))))
+
+    return Game(player, [], [], [])
+
+
+# Creating necessary classes.
+
+
+class BenchmarkScenario:
+    """
+    This class contains attributes of a benchmark scenario: a set-up function building the state from a seeded
+    random number generator and an operation which is timed repeatedly on that state. Operations changing the state
+    they are timed on (e.g. levelling up enemies) have a reset function, which puts the state back before every
+    operation outside of the timed and traced code.
+    """
+
+    def __init__(self, name, set_up, run_once, number_of_operations, reset=None):
+        # type: (str, callable, callable, int, callable or None) -> None
+        self.name: str = name
+        self.set_up: callable = set_up
+        self.run_once: callable = run_once
+        self.number_of_operations: int = number_of_operations
+        self.reset: callable or None = reset
+
+    def time_operations(self, state):
+        # type: (object) -> float
+        if self.reset is None:
+            start_time: float = time.perf_counter()
+            for j in range(self.number_of_operations):
+                self.run_once(state)
+            return time.perf_counter() - start_time
+
+        elapsed_time: float = 0.0  # initial value
+        for j in range(self.number_of_operations):
+            self.reset(state)
+            start_time = time.perf_counter()
+            self.run_once(state)
+            elapsed_time += time.perf_counter() - start_time
+        return elapsed_time
+
+    def measure(self, seed, rounds):
+        # type: (int, int) -> dict
+        """
+        Times the operation over the best of the given rounds, then runs it once more under tracemalloc. CPython does
+        not count every allocation made, so an operation is described by the blocks and bytes tracemalloc sees it
+        leave allocated once cyclic garbage is collected (snapshot statistics by line, with the lines allocating the
+        most bytes), the net change of sys.getallocatedblocks (which also sees allocations outside tracemalloc) and the
+        peak traced memory of an operation, which includes the temporary allocations freed before it ends.
+        :return: a dictionary of results
+        """
+
+        best_time: float = float('inf')
+        for i in range(rounds):
+            random.seed(seed)
+            state: object = self.set_up(random.Random(seed))
+            best_time = min(best_time, self.time_operations(state))
+
+        random.seed(seed)
+        state = self.set_up(random.Random(seed))
+        retained_blocks: int = 0  # initial value
+        traced_blocks: int = 0  # initial value
+        traced_bytes: int = 0  # initial value
+        bytes_by_line: dict = {}  # "file:line" -> bytes left allocated by the operations
+        peak_memory: int = 0  # initial value
+        # The snapshots themselves are allocated here and in tracemalloc, so those files are left out.
+        snapshot_filters: list = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        tracemalloc.start()
+        try:
+            for j in range(self.number_of_operations):
+                if self.reset is not None:
+                    self.reset(state)
+                gc.collect()
+                start_snapshot: tracemalloc.Snapshot = tracemalloc.take_snapshot().filter_traces(snapshot_filters)
+                gc.collect()  # again, for the garbage of taking the snapshot
+                tracemalloc.reset_peak()
+                start_memory: int = tracemalloc.get_traced_memory()[0]
+                start_blocks: int = sys.getallocatedblocks()
+                self.run_once(state)
+                peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1] - start_memory)
+                gc.collect()
+                retained_blocks += sys.getallocatedblocks() - start_blocks
+                for statistic in tracemalloc.take_snapshot().filter_traces(snapshot_filters).compare_to(
+                        start_snapshot, "lineno"):
+                    traced_blocks += statistic.count_diff
+                    traced_bytes += statistic.size_diff
+                    line: str = os.path.basename(statistic.traceback[0].filename) + ":" + \
+                        str(statistic.traceback[0].lineno)
+                    bytes_by_line[line] = bytes_by_line.get(line, 0) + statistic.size_diff
+        finally:
+            tracemalloc.stop()
+
+        return {
+            "name": self.name,
+            "operations": self.number_of_operations,
+            "seconds": best_time,
+            "ops_per_second": self.number_of_operations / best_time if best_time > 0 else float('inf'),
+            "retained_blocks_per_operation": retained_blocks / self.number_of_operations,
+            "traced_blocks_per_operation": traced_blocks / self.number_of_operations,
+            "traced_bytes_per_operation": traced_bytes / self.number_of_operations,
+            "top_allocating_lines": [line for line in sorted(bytes_by_line, key=lambda line: -bytes_by_line[line])
+                                     if bytes_by_line[line] > 0][:3],
+            "peak_memory_bytes": peak_memory
+        }
+
+
+class NormalAttackState:
+    """
+    This class contains attributes of the state of the 1v1 normal attack benchmark.
+    """
+
+    def __init__(self, rng):
+        # type: (random.Random) -> None
+        self.battle: Battle = Battle(create_team("A", rng), create_team("B", rng))
+        self.battle.start()
+        self.attacker: Hero = self.battle.team1.get_heroes_list()[0]
+        self.defender: Hero = self.battle.team2.get_heroes_list()[0]
+
+    def run_once(self):
+        # type: () -> None
+        self.attacker.normal_attack(self.defender)
+        if not self.defender.get_is_alive():
+            self.defender.restore()
+
+
+class AoESkillState:
+    """
+    This class contains attributes of the state of the 5v5 AoE active skill exchange benchmark.
+    """
+
+    def __init__(self, rng):
+        # type: (random.Random) -> None
+        self.battle: Battle = Battle(create_team("A", rng, True), create_team("B", rng, True))
+        self.battle.start()
+
+    def run_once(self):
+        # type: () -> None
+        for attackers, defenders in [(self.battle.team1, self.battle.team2), (self.battle.team2, self.battle.team1)]:
+            target: Hero = defenders.get_heroes_list()[0]
+            for hero in attackers.get_heroes_list():
+                skill: ActiveSkill = [skill for skill in hero.get_skills() if isinstance(skill, ActiveSkill)][0]
+                hero.curr_magic_points = hero.max_magic_points
+                hero.use_skill(target, skill)
+
+        for hero in self.battle.get_heroes():
+            if not hero.get_is_alive():
+                hero.restore()
+
+
+class SpecialPowerState:
+    """
+    This class contains attributes of the state of the special power burst benchmark.
+    """
+
+    def __init__(self, rng):
+        # type: (random.Random) -> None
+        self.battle: Battle = Battle(create_team("A", rng), create_team("B", rng))
+        self.battle.start()
+        self.target: Hero = self.battle.team2.get_heroes_list()[0]
+
+    def run_once(self):
+        # type: () -> None
+        for hero in self.battle.team1.get_heroes_list():
+            special_power: SpecialPower = [skill for skill in hero.get_skills() if isinstance(skill, SpecialPower)][0]
+            special_power.cooltime = 0
+            hero.use_skill(self.target, special_power)
+
+        if not self.target.get_is_alive():
+            self.target.restore()
+
+
+class EffectChurnState:
+    """
+    This class contains attributes of the state of the 5v5 buff and debuff application and expiry benchmark.
+    """
+
+    def __init__(self, rng):
+        # type: (random.Random) -> None
+        self.battle: Battle = Battle(create_team("A", rng), create_team("B", rng))
+        for hero in self.battle.get_heroes():
+            skill: ActiveSkill = [skill for skill in hero.get_skills() if isinstance(skill, ActiveSkill)][0]
+            skill.get_buffs_to_self().append(Buff("INCREASE ATTACK", 2))
+            skill.get_debuffs_to_enemies().append(Debuff("DECREASE DEFENSE", 2))
+        self.battle.start()
+
+    def run_once(self):
+        # type: () -> None
+        for hero in self.battle.get_heroes():
+            skill: ActiveSkill = [skill for skill in hero.get_skills() if isinstance(skill, ActiveSkill)][0]
+            self.battle.apply_skill_effects(hero, self.battle.get_enemy_team(hero).get_heroes_list()[0], skill)
+            self.battle.end_turn(hero)
+
+
+class LevelGetBeatenState:
+    """
+    This class contains attributes of the state of the Level.get_beaten benchmark at a fixed times_beaten. The level
+    is beaten times_beaten times while setting up, and every operation beats a fresh copy of it once more, so its
+    enemies are at the levels they would have in the game rather than at their max level.
+    """
+
+    def __init__(self, rng, times_beaten):
+        # type: (random.Random, int) -> None
+        self.__beaten_level: Level = Level("BENCHMARK LEVEL", [LevelStage(create_team("STAGE " + str(i),
+                                                                                      rng).get_heroes_list())
+                                                               for i in range(3)])
+        for i in range(times_beaten):
+            self.__beaten_level.get_beaten()
+        self.level: Level = self.__beaten_level.clone()
+
+    def reset(self):
+        # type: () -> None
+        self.level = self.__beaten_level.clone()
+
+    def run_once(self):
+        # type: () -> None
+        self.level.get_beaten()
+
+
+class SaveLoadState:
+    """
+    This class contains attributes of the state of the save_game_data/load_game_data benchmark.
+    """
+
+    def __init__(self, rng, number_of_heroes, number_of_items):
+        # type: (random.Random, int, int) -> None
+        self.game: Game = create_synthetic_game(number_of_heroes, number_of_items, rng)
+        self.file_name: str = os.path.join(tempfile.gettempdir(), "ancient_invasion_benchmark.sav")
+
+    def run_once(self):
+        # type: () -> None
+        # Called through the module so that an enabled Profiler sees them.
+        ancient_invasion.save_game_data(self.game, self.file_name)
+        ancient_invasion.load_game_data(self.file_name)
+
+
+def get_scenarios(scale):
+    # type: (float) -> list
+    def count(n):
+        # type: (int) -> int
+        return max(int(n * scale), 1)
+
+    scenarios: list = [
+        BenchmarkScenario("normal_attack_1v1", NormalAttackState, NormalAttackState.run_once, count(2000)),
+        BenchmarkScenario("aoe_active_skill_5v5", AoESkillState, AoESkillState.run_once, count(50)),
+        BenchmarkScenario("special_power_burst", SpecialPowerState, SpecialPowerState.run_once, count(200)),
+        BenchmarkScenario("effect_churn_5v5", EffectChurnState, EffectChurnState.run_once, count(200))
+    ]
+    for times_beaten in [0, 4, 8, 12]:
+        scenarios.append(BenchmarkScenario("level_get_beaten_" + str(times_beaten),
+                                           lambda rng, t=times_beaten: LevelGetBeatenState(rng, t),
+                                           LevelGetBeatenState.run_once, count(5), LevelGetBeatenState.reset))
+    scenarios.append(BenchmarkScenario("save_load_game_data",
+                                       lambda rng: SaveLoadState(rng, count(5000), count(50000)),
+                                       SaveLoadState.run_once, count(5)))
+    return scenarios
+
+
+def measure_hero_roster_memory(seed, number_of_heroes, number_of_templates=50):
+    # type: (int, int, int) -> dict
+    """
+    Measures the memory taken by a roster of heroes summoned as clones of a few potential heroes, like a player's
+    hero storage.
+    :return: a dictionary of results
+    """
+
+    rng: random.Random = random.Random(seed)
+    potential_heroes: list = [generate_random_hero(str(i), rng) for i in range(number_of_templates)]
+    tracemalloc.start()
+    try:
+        start_memory: int = tracemalloc.get_traced_memory()[0]
+        roster: list = [rng.choice(potential_heroes).clone() for i in range(number_of_heroes)]
+        roster_memory: int = tracemalloc.get_traced_memory()[0] - start_memory
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "name": "hero_roster_memory",
+        "heroes": len(roster),
+        "bytes_per_hero": roster_memory / number_of_heroes
+    }
+
+
+def compare_with_baseline(results, baseline, threshold):
+    # type: (list, dict, float) -> list
+    """
+    Compares ops/sec of every result with the stored baseline.
+    :return: a list of (name, baseline ops/sec, current ops/sec) of scenarios slower than the threshold allows
+    """
+
+    regressions: list = []  # initial value
+    for result in results:
+        if result["name"] in baseline:
+            baseline_ops_per_second: float = baseline[result["name"]]["ops_per_second"]
+            if result["ops_per_second"] < baseline_ops_per_second * (1 - threshold):
+                regressions.append((result["name"], baseline_ops_per_second, result["ops_per_second"]))
+    return regressions
+
+
+# Creating main function to run the benchmarks.
+
+
+def main():
+    """
+    This function is used to run the benchmarks, print one JSON line per scenario and compare them with a baseline.
+    :return: None
+    """
+
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Ancient Invasion benchmarks")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier of operations and data sizes")
+    parser.add_argument("--scenario", action="append", help="only run scenarios with these names")
+    parser.add_argument("--baseline", help="JSON file of baseline results to compare with")
+    parser.add_argument("--save-baseline", help="JSON file to save the results to as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed ops/sec slowdown, 0.1 means 10%%")
+    arguments: argparse.Namespace = parser.parse_args()
+
+    results: list = []  # initial value
+    for scenario in get_scenarios(arguments.scale):
+        if arguments.scenario is None or scenario.name in arguments.scenario:
+            result: dict = scenario.measure(arguments.seed, arguments.rounds)
+            print(json.dumps(result))
+            results.append(result)
+
+    if arguments.scenario is None or "hero_roster_memory" in arguments.scenario:
+        print(json.dumps(measure_hero_roster_memory(arguments.seed, max(int(10000 * arguments.scale), 1))))
+
+    if arguments.save_baseline is not None:
+        with open(arguments.save_baseline, "w") as file:
+            json.dump({result["name"]: result for result in results}, file, indent=2)
+
+    if arguments.baseline is not None:
+        with open(arguments.baseline) as file:
+            regressions: list = compare_with_baseline(results, json.load(file), arguments.threshold)
+        for name, baseline_ops_per_second, ops_per_second in regressions:
+            print("REGRESSION " + name + ": " + str(round(baseline_ops_per_second, 3)) + " -> " +
+                  str(round(ops_per_second, 3)) + " ops/sec", file=sys.stderr)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,373 @@
+"""
+This file contains a golden-outcome regression harness of the game "Ancient Invasion", recording the final state of a
+fixed corpus of seeded battles, level ups and gear set resolutions and checking the engine, or an alternative
+implementation of it, against it.
+Author: DtjiSoftwareDeveloper
+"""
+
+
+# Importing necessary libraries
+
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import importlib
+from concurrent.futures import ProcessPoolExecutor
+from ancient_invasion import *
+
+
+# Creating static functions to be used throughout the harness.
+
+
+HERO_STATE_ATTRIBUTES: list = ["level", "exp", "required_exp", "curr_hp", "max_hp", "curr_magic_points",
+                               "max_magic_points", "attack_power", "defense", "attack_speed", "crit_rate",
+                               "crit_damage", "resistance", "accuracy", "attack_gauge", "crits_dealt"]
+NUMBER_TYPES: tuple = (mpf, float)  # compared with tolerance, everything else has to be equal
+DEFAULT_RELATIVE_TOLERANCE: float = 1e-9
+DIGEST_BINS: int = 32767  # bins of number digests, so that a number's sign and bin fit in 4 hex digits
+
+
+def add_hero_state(state, label, hero):
+    # type: (list, str, Hero) -> None
+    for attribute in HERO_STATE_ATTRIBUTES:
+        state.append((label + "." + attribute, getattr(hero, attribute)))
+    state.append((label + ".buffs", tuple(sorted(buff.name for buff in hero.get_buffs()))))
+    state.append((label + ".debuffs", tuple(sorted(debuff.name for debuff in hero.get_debuffs()))))
+
+
+def create_case_heroes(engine, rng, number_of_heroes, prefix):
+    # type: (object, random.Random, int, str) -> list
+    return [engine.generate_random_hero(prefix + str(i), rng) for i in range(number_of_heroes)]
+
+
+def run_battle_case(engine, rng, max_turns):
+    # type: (object, random.Random, int) -> list
+    team1: Team = engine.Team(create_case_heroes(engine, rng, rng.randint(1, engine.Team.MAX_HEROES), "A"))
+    team2: Team = engine.Team(create_case_heroes(engine, rng, rng.randint(1, engine.Team.MAX_HEROES), "B"))
+    battle: Battle = engine.Battle(team1, team2)
+    battle.run_headless(max_turns)
+    state: list = [("turns", battle.turns_taken),
+                   ("winner", 1 if battle.winner is team1 else -1 if battle.winner is team2 else 0)]
+    for team_label, team in [("team1", team1), ("team2", team2)]:
+        for i, hero in enumerate(team.get_heroes_list()):
+            add_hero_state(state, team_label + "." + str(i), hero)
+    return state
+
+
+def run_action_case(engine, rng, max_turns):
+    # type: (object, random.Random, int) -> list
+    """
+    Executes random actions between two heroes of different teams, so that Action.execute and DamageMultiplier are
+    covered without the turn order of Battle in between.
+    :return: the final state
+    """
+
+    user, target = create_case_heroes(engine, rng, 2, "H")
+    engine.Battle(engine.Team([user]), engine.Team([target]))  # puts the heroes in their teams without taking any turn
+    state: list = []  # initial value
+    for i in range(rng.randint(1, 30)):
+        action_name: str = rng.choice(engine.Action.POSSIBLE_NAMES)
+        if action_name == "USE SKILL":
+            skill: Skill = rng.choice(user.get_skills())
+            state.append(("action." + str(i), skill.name))
+            user.use_skill(target, skill)
+        else:
+            state.append(("action." + str(i), action_name))
+            engine.Action(action_name).execute(user, target)
+        if not target.get_is_alive():
+            target.restore()
+    add_hero_state(state, "user", user)
+    add_hero_state(state, "target", target)
+    return state
+
+
+def run_level_up_case(engine, rng, max_turns):
+    # type: (object, random.Random, int) -> list
+    hero: Hero = create_case_heroes(engine, rng, 1, "H")[0]
+    for i in range(rng.randint(1, 12)):
+        hero.exp += hero.required_exp * rng.choice([engine.mpf("0.5"), engine.mpf("1"), engine.mpf("2")])
+        hero.level_up()
+    state: list = []  # initial value
+    add_hero_state(state, "hero", hero)
+    return state
+
+
+def run_level_beaten_case(engine, rng, max_turns):
+    # type: (object, random.Random, int) -> list
+    level: Level = engine.Level("GOLDEN LEVEL", [engine.LevelStage(create_case_heroes(
+        engine, rng, rng.randint(1, engine.Team.MAX_HEROES), "S" + str(i) + "-")) for i in range(rng.randint(1, 3))])
+    for i in range(rng.randint(1, 4)):
+        level.get_beaten()
+    state: list = [("times_beaten", level.times_beaten)]
+    for i, stage in enumerate(level.get_stages()):
+        for j, enemy in enumerate(stage.get_enemies_list()):
+            add_hero_state(state, "stage" + str(i) + "." + str(j), enemy)
+    return state
+
+
+def run_gear_sets_case(engine, rng, max_turns):
+    # type: (object, random.Random, int) -> list
+    heroes: list = create_case_heroes(engine, rng, engine.Team.MAX_HEROES, "H")
+    team: Team = engine.Team(heroes)
+    state: list = []  # initial value
+    gear_class: type = engine.Gear
+    for i, hero in enumerate(heroes):
+        set_names: list = rng.sample(gear_class.POSSIBLE_SET_NAMES, 2)
+        for slot_number in rng.sample(range(gear_class.MIN_SLOT_NUMBER, gear_class.MAX_SLOT_NUMBER + 1),
+                                      rng.randint(2, 8)):
+            hero.equip_gear(gear_class("GEAR", "", engine.mpf("1000"), rng.randint(gear_class.MIN_RATING,
+                                                                                   gear_class.MAX_RATING),
+                                       slot_number, rng.choice(set_names),
+                                       rng.choice(gear_class.POSSIBLE_PRIMARY_ATTRIBUTES),
+                                       engine.StatIncrease(*[engine.mpf(rng.randint(0, 50)) for j in range(13)])))
+        if rng.random() < 0.5:
+            hero.unequip_gear(rng.choice(list(hero.get_gears().keys())))
+        state.append(("hero" + str(i) + ".active_sets", tuple(sorted(
+            (gear.slot_number, gear.set_name) for gear in hero.get_gears().values() if gear.set_effect_is_active))))
+
+    for i, hero in enumerate(team.get_heroes_list()):
+        add_hero_state(state, "hero" + str(i), hero)
+    return state
+
+
+GOLDEN_CASE_KINDS: dict = {
+    "BATTLE": run_battle_case,
+    "ACTION": run_action_case,
+    "LEVEL UP": run_level_up_case,
+    "LEVEL BEATEN": run_level_beaten_case,
+    "GEAR SETS": run_gear_sets_case
+}
+
+
+def get_value_text(value):
+    # type: (object) -> str
+    """
+    Gets an exact text of a value of a state. Numbers are written with the exact binary value of an mpf.
+    :return: the text
+    """
+
+    if isinstance(value, mpf):
+        sign, mantissa, exponent, bit_count = value._mpf_
+        return "mpf(" + str(sign) + "," + str(mantissa) + "," + str(exponent) + ")"
+    return repr(value)
+
+
+def get_state_hash(entries):
+    # type: (list) -> str
+    digest = hashlib.sha256()
+    for label, value in entries:
+        digest.update((label + "=" + get_value_text(value) + ";").encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def get_number_digest(numbers, relative_tolerance):
+    # type: (list, float) -> str
+    """
+    Gets a compact digest of numbers, 4 hex digits per number: 0 for zero, otherwise its sign and the bin of log2 of
+    its magnitude modulo DIGEST_BINS, with bins -log2(1 - relative_tolerance) wide. Numbers within the relative
+    tolerance of each other fall into the same or neighbouring bins, and numbers more than twice the tolerance apart
+    never do, unless their bins differ by a multiple of DIGEST_BINS.
+    :return: the digest
+    """
+
+    bin_width: mpf = -log(1 - mpf(relative_tolerance), 2)
+    codes: list = []  # initial value
+    for number in numbers:
+        value: mpf = mpf(number)
+        if value == 0:
+            codes.append(0)
+        else:
+            number_bin: int = int(floor(log(abs(value), 2) / bin_width)) % DIGEST_BINS
+            codes.append(1 + 2 * number_bin + (1 if value < 0 else 0))
+    return "".join("%04x" % code for code in codes)
+
+
+def get_different_numbers(golden_digest, digest):
+    # type: (str, str) -> list
+    """
+    Finds the numbers whose codes in two digests of the same relative tolerance are not in the same or neighbouring
+    bins.
+    :return: a list of the indices of the numbers
+    """
+
+    different_numbers: list = []  # initial value
+    for i in range(0, len(digest), 4):
+        golden_code: int = int(golden_digest[i:i + 4], 16)
+        code: int = int(digest[i:i + 4], 16)
+        if golden_code == 0 or code == 0 or golden_code % 2 != code % 2:
+            if golden_code != code:
+                different_numbers.append(i // 4)
+        elif ((code - golden_code) // 2) % DIGEST_BINS not in (0, 1, DIGEST_BINS - 1):
+            different_numbers.append(i // 4)
+    return different_numbers
+
+
+def run_engine_case(engine_module, kind, rng, max_turns):
+    # type: (object, str, random.Random, int) -> list
+    return GOLDEN_CASE_KINDS[kind](engine_module, rng, max_turns)
+
+
+def load_engine(engine):
+    # type: (object) -> object
+    """
+    Gets the function running a case, called with (kind, random number generator, max turns) and returning the final
+    state as a list of (label, value). The engine is either such a function, "module:function" naming one, or the
+    path of a module implementing the engine API of ancient_invasion, which the built-in cases are run against.
+    :return: the function
+    """
+
+    if callable(engine):
+        return engine
+
+    module_name, separator, function_name = engine.partition(":")
+    module: object = importlib.import_module(module_name)
+    if separator != "":
+        return getattr(module, function_name)
+    return lambda kind, rng, max_turns: run_engine_case(module, kind, rng, max_turns)
+
+
+def run_golden_case(case, max_turns=Battle.MAX_TURNS, engine="ancient_invasion",
+                    relative_tolerance=DEFAULT_RELATIVE_TOLERANCE):
+    # type: (tuple, int, object, float) -> dict
+    """
+    Runs a (kind, seed) case of the corpus with the engine (see load_engine). Both the generated heroes and the
+    global random number generator used by the engine are seeded from the case, so a case gives the same state
+    whichever worker runs it.
+    :return: a dictionary with "case", the "hash" of the whole final state, the "discrete_hash" of everything but
+    its numbers, the "number_digest" of its numbers and the "labels" of the numbers, which are left out of golden
+    files
+    """
+
+    kind, seed = case
+    case_seed: str = kind + ":" + str(seed)
+    random.seed(case_seed)
+    state: list = load_engine(engine)(kind, random.Random(case_seed), max_turns)
+    numbers: list = [(label, value) for label, value in state if isinstance(value, NUMBER_TYPES)]
+    return {
+        "case": kind + ":" + str(seed),
+        "hash": get_state_hash(state),
+        "discrete_hash": get_state_hash([(label, value) for label, value in state
+                                         if not isinstance(value, NUMBER_TYPES)]),
+        "number_digest": get_number_digest([value for label, value in numbers], relative_tolerance),
+        "labels": [label for label, value in numbers]
+    }
+
+
+def run_golden_cases(cases, max_turns, engine="ancient_invasion", relative_tolerance=DEFAULT_RELATIVE_TOLERANCE):
+    # type: (list, int, object, float) -> list
+    return [run_golden_case(case, max_turns, engine, relative_tolerance) for case in cases]
+
+
+def create_corpus(cases_per_kind, seed=0):
+    # type: (int, int) -> list
+    return [(kind, seed * cases_per_kind + i) for kind in GOLDEN_CASE_KINDS for i in range(cases_per_kind)]
+
+
+def run_corpus(cases, number_of_workers=1, max_turns=Battle.MAX_TURNS, engine="ancient_invasion",
+               relative_tolerance=DEFAULT_RELATIVE_TOLERANCE):
+    # type: (list, int, int, object, float) -> list
+    """
+    Runs every case of the corpus, in a process pool when number_of_workers is more than 1, in which case an engine
+    given as a function has to be a module level one so that it can be sent to the workers.
+    :return: a list of the results of the cases in the same order
+    """
+
+    if number_of_workers <= 1:
+        return run_golden_cases(cases, max_turns, engine, relative_tolerance)
+
+    shard_size: int = max(len(cases) // (number_of_workers * 4), 1)
+    shards: list = [cases[i:i + shard_size] for i in range(0, len(cases), shard_size)]
+    with ProcessPoolExecutor(number_of_workers) as executor:
+        return [result for shard_results in executor.map(run_golden_cases, shards, [max_turns] * len(shards),
+                                                         [engine] * len(shards), [relative_tolerance] * len(shards))
+                for result in shard_results]
+
+
+def compare_with_golden(golden_results, results):
+    # type: (list, list) -> list
+    """
+    Compares results with golden results of the same cases, whose number digests have the same relative tolerance.
+    A case is "EXACT" if its state hash is the same, "WITHIN TOLERANCE" if only numbers differ and the digests place
+    all of them within the tolerance, and "MISMATCH" otherwise.
+    :return: a list of dictionaries with "case", "status" and "detail" of every case
+    """
+
+    golden_results_by_case: dict = {golden_result["case"]: golden_result for golden_result in golden_results}
+    comparisons: list = []  # initial value
+    for result in results:
+        golden_result: dict or None = golden_results_by_case.get(result["case"])
+        if golden_result is None:
+            comparisons.append({"case": result["case"], "status": "MISMATCH", "detail": "not in the golden file"})
+        elif golden_result["hash"] == result["hash"]:
+            comparisons.append({"case": result["case"], "status": "EXACT", "detail": ""})
+        elif golden_result["discrete_hash"] != result["discrete_hash"] or \
+                len(golden_result["number_digest"]) != len(result["number_digest"]):
+            comparisons.append({"case": result["case"], "status": "MISMATCH",
+                                "detail": "turns, winners, levels, names or effects differ"})
+        else:
+            different_labels: list = [result["labels"][i] for i in get_different_numbers(
+                golden_result["number_digest"], result["number_digest"])]
+            comparisons.append({"case": result["case"],
+                                "status": "MISMATCH" if len(different_labels) > 0 else "WITHIN TOLERANCE",
+                                "detail": ", ".join(different_labels[:5])})
+    return comparisons
+
+
+# Creating main function to run the harness.
+
+
+def main():
+    """
+    This function is used to record the golden outcomes of the corpus ("record FILE") or to check the engine against
+    them ("check FILE"), exiting with status 1 on any mismatch. Golden files hold the hashes and number digests of
+    the cases, and the relative tolerance of the digests is chosen when recording.
+    :return: None
+    """
+
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Golden-outcome regression harness of "
+                                                                          "Ancient Invasion.")
+    parser.add_argument("mode", choices=["record", "check"])
+    parser.add_argument("golden_file")
+    parser.add_argument("--cases", type=int, default=50, help="cases of every kind in the corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--max-turns", type=int, default=Battle.MAX_TURNS)
+    parser.add_argument("--relative-tolerance", type=float, default=DEFAULT_RELATIVE_TOLERANCE,
+                        help="relative tolerance of the number digests recorded")
+    parser.add_argument("--engine", default="ancient_invasion",
+                        help="module implementing the engine, or module:function running a case")
+    arguments: argparse.Namespace = parser.parse_args()
+
+    start_time: float = time.perf_counter()
+    if arguments.mode == "record":
+        results: list = run_corpus(create_corpus(arguments.cases, arguments.seed), arguments.workers,
+                                   arguments.max_turns, arguments.engine, arguments.relative_tolerance)
+        with open(arguments.golden_file, "w") as file:
+            json.dump({"cases": arguments.cases, "seed": arguments.seed, "max_turns": arguments.max_turns,
+                       "relative_tolerance": arguments.relative_tolerance,
+                       "results": [{key: value for key, value in result.items() if key != "labels"}
+                                   for result in results]}, file)
+        print("Recorded " + str(len(results)) + " cases in " + str(round(time.perf_counter() - start_time, 3)) +
+              " seconds.")
+        return
+
+    with open(arguments.golden_file) as file:
+        golden: dict = json.load(file)
+    results = run_corpus(create_corpus(golden["cases"], golden["seed"]), arguments.workers, golden["max_turns"],
+                         arguments.engine, golden["relative_tolerance"])
+    comparisons: list = compare_with_golden(golden["results"], results)
+    statuses: list = [comparison["status"] for comparison in comparisons]
+    print(json.dumps({status: statuses.count(status) for status in ["EXACT", "WITHIN TOLERANCE", "MISMATCH"]}) +
+          " in " + str(round(time.perf_counter() - start_time, 3)) + " seconds")
+    for comparison in comparisons:
+        if comparison["status"] == "MISMATCH":
+            print("MISMATCH " + comparison["case"] + ": " + comparison["detail"], file=sys.stderr)
+    if "MISMATCH" in statuses:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
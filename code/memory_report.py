@@ -0,0 +1,290 @@
+"""
+This file contains source code of the per-class memory accounting report of the game "Ancient Invasion".
+Author: DtjiSoftwareDeveloper
+"""
+
+
+# Importing necessary libraries
+
+import gc
+import sys
+import json
+import types
+import signal
+import asyncio
+import argparse
+import ancient_invasion
+from ancient_invasion import *
+
+
+# Creating static functions to be used throughout the memory report.
+
+
+GAME_MODULES: tuple = ("ancient_invasion", "__main__")  # modules whose classes are reported
+SKIPPED_TYPES: tuple = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+                        types.CodeType, types.FrameType)  # shared by the whole program rather than owned by objects
+VALUE_TYPES: tuple = (int, float, complex, str, bytes, bool, type(None))
+
+
+def is_game_object(obj):
+    # type: (object) -> bool
+    return type(obj).__module__ in GAME_MODULES and not isinstance(obj, SKIPPED_TYPES)
+
+
+def get_attributes(obj):
+    # type: (object) -> dict
+    """
+    Gets the attributes of an object, both those in its __dict__ and those in the __slots__ of its classes.
+    :return: a dictionary of attribute name -> value
+    """
+
+    attributes: dict = dict(getattr(obj, "__dict__", {}))
+    for cls in type(obj).__mro__:
+        slots: tuple = cls.__dict__.get("__slots__", ())
+        for slot in [slots] if isinstance(slots, str) else slots:
+            name: str = "_" + cls.__name__.lstrip("_") + slot if slot.startswith("__") and \
+                not slot.endswith("__") else slot
+            if slot != "__dict__" and slot != "__weakref__" and hasattr(obj, name):
+                attributes[name] = getattr(obj, name)
+    return attributes
+
+
+def get_fingerprint(obj, memo):
+    # type: (object, dict) -> object
+    """
+    Gets a hashable description of the value of an object, so that objects with the same fingerprint are equal in
+    every attribute, including those of the objects they contain.
+    :return: the fingerprint
+    """
+
+    if isinstance(obj, VALUE_TYPES):
+        return obj
+    if isinstance(obj, mpf):
+        return "mpf", obj._mpf_
+
+    fingerprint: object = memo.get(id(obj))
+    if fingerprint is not None:
+        return fingerprint
+
+    memo[id(obj)] = ("cycle", id(obj))  # objects containing themselves are only equal to themselves
+    if isinstance(obj, (list, tuple)):
+        fingerprint = type(obj).__name__, tuple(get_fingerprint(value, memo) for value in obj)
+    elif isinstance(obj, (set, frozenset)):
+        fingerprint = type(obj).__name__, tuple(sorted((get_fingerprint(value, memo) for value in obj), key=repr))
+    elif isinstance(obj, dict):
+        fingerprint = "dict", tuple(sorted(((get_fingerprint(key, memo), get_fingerprint(value, memo))
+                                            for key, value in obj.items()), key=repr))
+    elif is_game_object(obj):
+        fingerprint = type(obj).__name__, tuple(sorted((name, get_fingerprint(value, memo))
+                                                       for name, value in get_attributes(obj).items()))
+    else:
+        fingerprint = "id", id(obj)
+
+    memo[id(obj)] = fingerprint
+    return fingerprint
+
+
+def load_game_memory_report(file_name, candidate_class_names=None):
+    # type: (str, list or None) -> dict
+    accountant: MemoryAccountant = MemoryAccountant(candidate_class_names)
+    accountant.add_root(ancient_invasion.load_game_data(file_name))
+    return accountant.get_report()
+
+
+def get_process_memory_report(candidate_class_names=None):
+    # type: (list or None) -> dict
+    """
+    Accounts for every object of the game in the running process. Objects reached from Game instances are visited
+    first so that they are owned the same way as in a report of a save.
+    :return: the report
+    """
+
+    accountant: MemoryAccountant = MemoryAccountant(candidate_class_names)
+    game_objects: list = [obj for obj in gc.get_objects() if is_game_object(obj)]
+    for obj in sorted(game_objects, key=lambda game_object: not isinstance(game_object, Game)):
+        accountant.add_root(obj)
+    return accountant.get_report()
+
+
+def write_process_memory_report(file_name):
+    # type: (str) -> None
+    with open(file_name, "w") as file:
+        json.dump(get_process_memory_report(), file, indent=2)
+
+
+def install_memory_report_signal_handler(file_name, signal_number=getattr(signal, "SIGUSR1", None), loop=None):
+    # type: (str, int or None, asyncio.AbstractEventLoop or None) -> bool
+    """
+    Makes the running process write a memory report of itself to file_name whenever it gets the signal
+    (by default SIGUSR1, e.g. "kill -USR1 <pid>"). Given an asyncio event loop, the report is written by the loop
+    between its callbacks rather than inside the signal handler, so it never runs in the middle of a task.
+    :return: True if the handler is installed, False if the platform has no such signal
+    """
+
+    if signal_number is None:
+        return False
+
+    if loop is not None:
+        try:
+            loop.add_signal_handler(signal_number, write_process_memory_report, file_name)
+        except NotImplementedError:  # event loops without signal support
+            return False
+        return True
+
+    signal.signal(signal_number, lambda received_signal_number, frame: write_process_memory_report(file_name))
+    return True
+
+
+def print_memory_report(report, top_n=20):
+    # type: (dict, int) -> None
+    print("Total: " + str(report["total_bytes"]) + " bytes in " + str(report["total_objects"]) + " objects")
+    print("{:<24}{:>12}{:>16}{:>16}".format("CLASS", "INSTANCES", "SHALLOW BYTES", "RETAINED BYTES"))
+    for statistics in report["classes"][:top_n]:
+        print("{:<24}{:>12}{:>16}{:>16}".format(statistics["class"], statistics["instances"],
+                                                statistics["shallow_bytes"], statistics["retained_bytes"]))
+
+    print("Duplicated objects (estimated savings from sharing them: " + str(report["estimated_savings_bytes"]) +
+          " bytes)")
+    print("{:<24}{:>12}{:>12}{:>16}".format("CLASS", "INSTANCES", "DISTINCT", "SAVINGS BYTES"))
+    for duplicates in report["duplicates"][:top_n]:
+        print("{:<24}{:>12}{:>12}{:>16}".format(duplicates["class"], duplicates["instances"], duplicates["distinct"],
+                                                duplicates["estimated_savings_bytes"]))
+
+
+# Creating necessary classes.
+
+
+class MemoryAccountant:
+    """
+    This class contains attributes of a walk over an object graph accounting memory to the classes of the game.
+
+    Every object reached is owned by the nearest object of the game reaching it first, so the retained bytes of a
+    class are the shallow sizes of its instances and of the lists, dictionaries, numbers and strings they own. Game
+    objects inside other game objects (e.g. the skills of a hero) are reported under their own classes, so the
+    retained bytes of all classes add up to the total. Instances of candidate classes are also grouped by value to
+    find duplicates which could be shared, and the savings of sharing them are estimated as the retained bytes of all
+    but one instance of every group.
+    """
+
+    DEFAULT_CANDIDATE_CLASS_NAMES: list = ["DamageMultiplier", "StatIncrease", "SetEffect", "Skill", "ActiveSkill",
+                                           "PassiveSkill", "LeaderSkill", "SpecialPower", "PassiveEffect",
+                                           "LeaderEffect", "AwakenBonus", "SecondaryAwakenBonus", "Buff", "Debuff",
+                                           "Reward", "HeroTemplate"]
+
+    def __init__(self, candidate_class_names=None):
+        # type: (list or None) -> None
+        self.candidate_class_names: list = self.DEFAULT_CANDIDATE_CLASS_NAMES if candidate_class_names is None \
+            else candidate_class_names
+        self.__visited_ids: set = set()
+        self.__class_statistics: dict = {}  # class name -> [instances, shallow bytes, retained bytes]
+        self.__candidates: list = []  # (class name, object) of every instance of a candidate class
+        self.__retained_bytes: dict = {}  # id of a candidate -> retained bytes
+        self.total_bytes: int = 0
+        self.total_objects: int = 0
+
+    def add_root(self, root):
+        # type: (object) -> None
+        """
+        Walks every object reachable from root which has not been visited yet.
+        :return: None
+        """
+
+        stack: list = [(root, None)]
+        while len(stack) > 0:
+            obj, owner = stack.pop()
+            if id(obj) in self.__visited_ids or isinstance(obj, SKIPPED_TYPES):
+                continue
+
+            self.__visited_ids.add(id(obj))
+            size: int = sys.getsizeof(obj, 0)
+            self.total_bytes += size
+            self.total_objects += 1
+            if is_game_object(obj):
+                owner = obj
+                class_name: str = type(obj).__name__
+                statistics: list = self.__class_statistics.setdefault(class_name, [0, 0, 0])
+                statistics[0] += 1
+                statistics[1] += size
+                if class_name in self.candidate_class_names:
+                    self.__candidates.append((class_name, obj))
+                    self.__retained_bytes[id(obj)] = 0
+
+            owner_class_name: str = "(no owner)" if owner is None else type(owner).__name__
+            self.__class_statistics.setdefault(owner_class_name, [0, 0, 0])[2] += size
+            if id(owner) in self.__retained_bytes:
+                self.__retained_bytes[id(owner)] += size
+
+            for referent in gc.get_referents(obj):
+                if id(referent) not in self.__visited_ids:
+                    stack.append((referent, owner))
+
+    def get_class_statistics(self):
+        # type: () -> list
+        return sorted(({"class": class_name, "instances": statistics[0], "shallow_bytes": statistics[1],
+                        "retained_bytes": statistics[2]}
+                       for class_name, statistics in self.__class_statistics.items()),
+                      key=lambda class_statistics: -class_statistics["retained_bytes"])
+
+    def get_duplicates(self):
+        # type: () -> list
+        """
+        Groups the instances of candidate classes by their fingerprints.
+        :return: a list of dictionaries with "class", "instances", "distinct" and "estimated_savings_bytes" of every
+        candidate class having duplicates, the largest savings first
+        """
+
+        memo: dict = {}  # initial value
+        groups: dict = {}  # (class name, fingerprint) -> retained bytes of every instance
+        for class_name, obj in self.__candidates:
+            groups.setdefault((class_name, get_fingerprint(obj, memo)), []).append(self.__retained_bytes[id(obj)])
+
+        duplicates: dict = {}  # class name -> [instances, distinct, estimated savings bytes]
+        for (class_name, fingerprint), retained_bytes in groups.items():
+            class_duplicates: list = duplicates.setdefault(class_name, [0, 0, 0])
+            class_duplicates[0] += len(retained_bytes)
+            class_duplicates[1] += 1
+            class_duplicates[2] += sum(retained_bytes) - retained_bytes[0]
+
+        return sorted(({"class": class_name, "instances": instances, "distinct": distinct,
+                        "estimated_savings_bytes": savings}
+                       for class_name, (instances, distinct, savings) in duplicates.items() if instances > distinct),
+                      key=lambda class_duplicates: -class_duplicates["estimated_savings_bytes"])
+
+    def get_report(self):
+        # type: () -> dict
+        duplicates: list = self.get_duplicates()
+        return {
+            "total_bytes": self.total_bytes,
+            "total_objects": self.total_objects,
+            "classes": self.get_class_statistics(),
+            "duplicates": duplicates,
+            "estimated_savings_bytes": sum(class_duplicates["estimated_savings_bytes"]
+                                           for class_duplicates in duplicates)
+        }
+
+
+# Creating main function to run the memory report.
+
+
+def main():
+    """
+    This function is used to report where the memory of a saved game goes.
+    :return: None
+    """
+
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Per-class memory accounting report of "
+                                                                          "an Ancient Invasion save.")
+    parser.add_argument("save_file")
+    parser.add_argument("--top", type=int, default=20, help="classes listed in every table")
+    parser.add_argument("--classes", nargs="+", help="classes checked for duplicates")
+    parser.add_argument("--json", action="store_true", help="print the whole report as JSON")
+    arguments: argparse.Namespace = parser.parse_args()
+    report: dict = load_game_memory_report(arguments.save_file, arguments.classes)
+    if arguments.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_memory_report(report, arguments.top)
+
+
+if __name__ == '__main__':
+    main()
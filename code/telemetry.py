@@ -0,0 +1,283 @@
+"""
+This file contains source code of the streaming battle telemetry export of the game "Ancient Invasion".
+Author: DtjiSoftwareDeveloper
+"""
+
+
+# Importing necessary libraries
+
+import sys
+import csv
+import struct
+import random
+from array import array
+from ancient_invasion import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # columns fall back to the array module
+
+
+# Creating static functions to be used throughout the telemetry export.
+
+
+def read_columnar_file(file_name):
+    # type: (str) -> iter
+    """
+    Reads a file written by ColumnarTelemetryWriter in the "BINARY" format one chunk at a time.
+    :return: a generator yielding a dictionary of column name -> list of values for every chunk
+    """
+
+    with open(file_name, "rb") as file:
+        if file.read(len(ColumnarTelemetryWriter.MAGIC)) != ColumnarTelemetryWriter.MAGIC:
+            raise ValueError("Not a columnar telemetry file: " + str(file_name))
+
+        version, number_of_columns = struct.unpack("<HH", file.read(4))
+        columns: list = []  # initial value
+        for i in range(number_of_columns):
+            kind, name_length = struct.unpack("<cH", file.read(3))
+            columns.append((file.read(name_length).decode("utf-8"), kind.decode("ascii")))
+
+        strings: list = []  # dictionary of every string column, codes are indices
+        while True:
+            header: bytes = file.read(8)
+            if len(header) < 8:
+                return
+
+            number_of_rows, number_of_new_strings = struct.unpack("<II", header)
+            for i in range(number_of_new_strings):
+                string_length: int = struct.unpack("<I", file.read(4))[0]
+                strings.append(file.read(string_length).decode("utf-8"))
+
+            chunk: dict = {}  # initial value
+            for name, kind in columns:
+                values: array = array(ColumnBuffer.ARRAY_TYPECODES[kind])
+                values.frombytes(file.read(number_of_rows * ColumnBuffer.ITEM_SIZES[kind]))
+                if sys.byteorder == "big":
+                    values.byteswap()
+                chunk[name] = [strings[code] for code in values] if kind == "s" else \
+                    [bool(value) for value in values] if kind == "b" else values.tolist()
+            yield chunk
+
+
+# Creating necessary classes.
+
+
+class ColumnBuffer:
+    """
+    This class contains attributes of a fixed-size buffer of one column of a chunk.
+
+    Kinds are "i" (32-bit integer), "f" (64-bit float), "b" (boolean) and "s" (string). Values are kept in a NumPy
+    array if NumPy is installed and in an array.array otherwise. Strings are kept as 32-bit codes into the writer's
+    string dictionary when is_coded is True, and as they are otherwise.
+    """
+
+    POSSIBLE_KINDS: list = ["i", "f", "b", "s"]
+    NUMPY_TYPES: dict = {"i": "<i4", "f": "<f8", "b": "u1", "s": "<u4"}
+    ARRAY_TYPECODES: dict = {"i": "i", "f": "d", "b": "B", "s": "I"}
+    ITEM_SIZES: dict = {"i": 4, "f": 8, "b": 1, "s": 4}
+
+    def __init__(self, name, kind, chunk_size, is_coded=True):
+        # type: (str, str, int, bool) -> None
+        self.name: str = name
+        self.kind: str = kind if kind in self.POSSIBLE_KINDS else self.POSSIBLE_KINDS[0]
+        self.chunk_size: int = chunk_size
+        if self.kind == "s" and not is_coded:
+            self.__values: object = [""] * chunk_size
+        elif numpy is not None:
+            self.__values = numpy.zeros(chunk_size, self.NUMPY_TYPES[self.kind])
+        else:
+            self.__values = array(self.ARRAY_TYPECODES[self.kind], bytes(chunk_size * self.ITEM_SIZES[self.kind]))
+
+    def set_value(self, index, value):
+        # type: (int, object) -> None
+        self.__values[index] = value
+
+    def get_values(self, number_of_rows):
+        # type: (int) -> list
+        values: object = self.__values[:number_of_rows]
+        return values if isinstance(values, list) else values.tolist()
+
+    def to_bytes(self, number_of_rows):
+        # type: (int) -> bytes
+        if numpy is not None:
+            return self.__values[:number_of_rows].tobytes()
+
+        values: array = self.__values[:number_of_rows]
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values.tobytes()
+
+
+class ColumnarTelemetryWriter:
+    """
+    This class contains attributes of a writer streaming rows to a CSV or binary columnar file.
+
+    Rows go into fixed-size column buffers which are written out whenever chunk_size rows are buffered, so memory use
+    stays the same however many rows are written. The binary format is MAGIC, the version, the columns and then one
+    block per chunk: the number of rows, the strings new to the dictionary (each after its 4 byte length) and every
+    column as little-endian values.
+    """
+
+    MAGIC: bytes = b"AICT"
+    VERSION: int = 1
+    POSSIBLE_FORMATS: list = ["CSV", "BINARY"]
+
+    def __init__(self, file_name, columns, file_format="CSV", chunk_size=4096):
+        # type: (str, list, str, int) -> None
+        self.file_name: str = file_name
+        self.file_format: str = file_format if file_format in self.POSSIBLE_FORMATS else self.POSSIBLE_FORMATS[0]
+        self.chunk_size: int = chunk_size
+        self.__columns: list = [ColumnBuffer(name, kind, chunk_size, self.file_format == "BINARY")
+                                for name, kind in columns]
+        self.__number_of_rows: int = 0  # rows in the current chunk
+        self.rows_written: int = 0
+        self.__string_codes: dict = {}  # string -> code in the dictionary
+        self.__new_strings: list = []  # strings added to the dictionary since the last chunk
+        if self.file_format == "CSV":
+            self.__file: object = open(file_name, "w", newline="")
+            self.__csv_writer: object = csv.writer(self.__file)
+            self.__csv_writer.writerow([column.name for column in self.__columns])
+        else:
+            self.__file = open(file_name, "wb")
+            self.__file.write(self.MAGIC + struct.pack("<HH", self.VERSION, len(self.__columns)))
+            for column in self.__columns:
+                name: bytes = column.name.encode("utf-8")
+                self.__file.write(struct.pack("<cH", column.kind.encode("ascii"), len(name)) + name)
+
+    def __enter__(self):
+        # type: () -> ColumnarTelemetryWriter
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # type: (type, Exception, object) -> None
+        self.close()
+
+    def get_columns(self):
+        # type: () -> list
+        return self.__columns
+
+    def __get_string_code(self, string):
+        # type: (str) -> int
+        code: int or None = self.__string_codes.get(string)
+        if code is None:
+            code = len(self.__string_codes)
+            self.__string_codes[string] = code
+            self.__new_strings.append(string)
+        return code
+
+    def write_row(self, values):
+        # type: (list or tuple) -> None
+        for column, value in zip(self.__columns, values):
+            if column.kind == "s":
+                value = self.__get_string_code(str(value)) if self.file_format == "BINARY" else str(value)
+            elif column.kind == "f":
+                value = float(value)
+            column.set_value(self.__number_of_rows, value)
+
+        self.__number_of_rows += 1
+        if self.__number_of_rows == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        # type: () -> None
+        """
+        Writes the buffered rows out as one chunk.
+        :return: None
+        """
+
+        if self.__number_of_rows == 0:
+            return
+
+        if self.file_format == "CSV":
+            self.__csv_writer.writerows(zip(*[column.get_values(self.__number_of_rows)
+                                              for column in self.__columns]))
+        else:
+            self.__file.write(struct.pack("<II", self.__number_of_rows, len(self.__new_strings)))
+            for string in self.__new_strings:
+                encoded_string: bytes = string.encode("utf-8")
+                self.__file.write(struct.pack("<I", len(encoded_string)) + encoded_string)
+            self.__new_strings.clear()
+            for column in self.__columns:
+                self.__file.write(column.to_bytes(self.__number_of_rows))
+
+        self.rows_written += self.__number_of_rows
+        self.__number_of_rows = 0
+        self.__file.flush()
+
+    def close(self):
+        # type: () -> None
+        if not self.__file.closed:
+            self.flush()
+            self.__file.close()
+
+
+class BattleTelemetryRecorder:
+    """
+    This class contains attributes of a recorder subscribing to the event buses of battles and writing one row per
+    action and one row per battle.
+    """
+
+    TURN_COLUMNS: list = [("battle_id", "i"), ("turn", "i"), ("hero_id", "s"), ("action", "s"), ("skill", "s"),
+                          ("target_id", "s"), ("is_performed", "b"), ("damage", "f"), ("crits", "i")]
+    BATTLE_COLUMNS: list = [("battle_id", "i"), ("team1_hero_ids", "s"), ("team2_hero_ids", "s"), ("turns", "i"),
+                            ("winner", "i")]
+
+    def __init__(self, turn_writer, battle_writer):
+        # type: (ColumnarTelemetryWriter, ColumnarTelemetryWriter) -> None
+        self.turn_writer: ColumnarTelemetryWriter = turn_writer
+        self.battle_writer: ColumnarTelemetryWriter = battle_writer
+
+    @staticmethod
+    def create(file_name_prefix, file_format="CSV", chunk_size=4096):
+        # type: (str, str, int) -> BattleTelemetryRecorder
+        extension: str = ".csv" if file_format == "CSV" else ".aict"
+        return BattleTelemetryRecorder(
+            ColumnarTelemetryWriter(file_name_prefix + "_turns" + extension, BattleTelemetryRecorder.TURN_COLUMNS,
+                                    file_format, chunk_size),
+            ColumnarTelemetryWriter(file_name_prefix + "_battles" + extension,
+                                    BattleTelemetryRecorder.BATTLE_COLUMNS, file_format, chunk_size))
+
+    def attach(self, battle, battle_id):
+        # type: (Battle, int) -> None
+        """
+        Subscribes to the event bus of the battle, which must not have started yet.
+        :return: None
+        """
+
+        def on_action_executed(hero, action_name, target, skill, is_performed, damage_dealt, number_of_crits):
+            # type: (Hero, str, Hero, Skill or None, bool, mpf, int) -> None
+            self.turn_writer.write_row((battle_id, battle.turns_taken, hero.hero_id, action_name,
+                                        skill.name if skill is not None else "", target.hero_id, is_performed,
+                                        damage_dealt, number_of_crits))
+
+        def on_battle_end(winner):
+            # type: (Team or None) -> None
+            self.battle_writer.write_row((battle_id, " ".join(hero.hero_id for hero in battle.team1.get_heroes_list()),
+                                          " ".join(hero.hero_id for hero in battle.team2.get_heroes_list()),
+                                          battle.turns_taken, 1 if winner is battle.team1 else -1
+                                          if winner is battle.team2 else 0))
+
+        battle.event_bus.subscribe("ACTION EXECUTED", on_action_executed)
+        battle.event_bus.subscribe("BATTLE END", on_battle_end)
+
+    def record_battles(self, matches, max_turns=Battle.MAX_TURNS, first_battle_id=0):
+        # type: (iter, int, int) -> int
+        """
+        Runs headless battles for (seed, team1, team2) matches, which may come from a generator, and records them.
+        :return: the number of battles recorded
+        """
+
+        number_of_battles: int = 0  # initial value
+        for seed, team1, team2 in matches:
+            battle: Battle = Battle(team1, team2, random.Random(seed))
+            self.attach(battle, first_battle_id + number_of_battles)
+            battle.run_headless(max_turns)
+            number_of_battles += 1
+        return number_of_battles
+
+    def close(self):
+        # type: () -> None
+        self.turn_writer.close()
+        self.battle_writer.close()
@@ -0,0 +1,26 @@
+import ancient_invasion
+from golden_outcomes import *
+
+
+def run_case_slightly_off(kind, rng, max_turns):
+    return [(label, value * (1 + mpf("1e-12")) if isinstance(value, mpf) else value)
+            for label, value in run_engine_case(ancient_invasion, kind, rng, max_turns)]
+
+
+def test_number_digests_find_numbers_out_of_tolerance():
+    numbers = [mpf("0"), mpf("5000"), mpf("-3.5"), mpf("1e500")]
+    golden_digest = get_number_digest(numbers, 1e-9)
+    assert len(golden_digest) == 4 * len(numbers)
+    assert get_different_numbers(golden_digest, get_number_digest(
+        [number * (1 + mpf("1e-10")) for number in numbers], 1e-9)) == []
+    assert get_different_numbers(golden_digest, get_number_digest(
+        [mpf("1e-300"), mpf("5000.01"), mpf("3.5"), mpf("1e500")], 1e-9)) == [0, 1, 2]
+
+
+def test_cases_of_an_injected_engine_are_within_tolerance():
+    cases = create_corpus(2)
+    golden_results = run_corpus(cases)
+    assert [comparison["status"] for comparison in compare_with_golden(
+        golden_results, run_corpus(cases, engine=run_case_slightly_off))] == ["WITHIN TOLERANCE"] * len(cases)
+    assert [comparison["status"] for comparison in compare_with_golden(
+        golden_results, run_corpus(cases, engine="ancient_invasion"))] == ["EXACT"] * len(cases)
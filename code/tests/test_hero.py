@@ -0,0 +1,35 @@
+import random
+
+from ancient_invasion import *
+
+
+def test_restore_uses_max_hp_with_modifiers():
+    hero = generate_random_hero("HERO", random.Random(2))
+    hero.stat_modifiers.add_layer("AWAKEN", StatModifierStack.create_modifiers([
+        ("max_hp", "PERCENTAGE UP", mpf("20")), ("max_hp", "FLAT", mpf("500"))]))
+    hero.prepare_for_battle()
+    assert hero.curr_hp == hero.max_hp * mpf("1.2") + 500
+    hero.curr_hp = mpf("1")
+    hero.restore()
+    assert hero.curr_hp == hero.get_final_stat("max_hp")
+
+
+def test_heroes_with_the_same_values_share_a_template():
+    hero = generate_random_hero("SHARED", random.Random(4))
+    assert generate_random_hero("SHARED", random.Random(4)).get_template() is hero.get_template()
+    assert generate_random_hero("SHARED", random.Random(5)).get_template() is not hero.get_template()
+
+
+def test_hero_pickled_before_templates_is_loaded():
+    hero = generate_random_hero("OLD SAVE", random.Random(6))
+    old_state = {name: getattr(hero, name) for name in ["hero_id", "name", "element", "type", "rating", "max_hp",
+                                                         "curr_hp", "max_magic_points", "attack_power", "defense",
+                                                         "attack_speed", "secondary_awaken_exp_required",
+                                                         "awaken_bonus", "secondary_awaken_bonus"]}
+    old_state.update({"_Hero__skills": list(hero.get_template().get_skills()), "_Hero__immunities": [],
+                      "level": 3, "curr_hp": mpf("7")})
+    loaded_hero = Hero.__new__(Hero)
+    loaded_hero.__setstate__(old_state)
+    assert loaded_hero.get_template() is hero.get_template()
+    assert loaded_hero.level == 3 and loaded_hero.curr_hp == 7 and loaded_hero.exp == 0
+    assert pickle.loads(pickle.dumps(loaded_hero)).curr_hp == 7
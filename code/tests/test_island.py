@@ -0,0 +1,43 @@
+from ancient_invasion import *
+
+
+def create_bank():
+    return Bank("BANK", "", mpf("10"), mpf("2"))
+
+
+def test_tile_views_write_back_to_the_island():
+    player_base = PlayerBase()
+    island = Island()
+    player_base.add_island(island)
+    bank = create_bank()
+    island.get_tiles()[1][2].building = bank
+    assert island.get_building_at(2, 1) is bank
+    assert island.get_tile_at(2, 1).building is bank
+    assert player_base.get_buildings_of_type(Bank) == [bank]
+
+    island.get_tile_at(2, 1).building = None
+    assert island.get_building_at(2, 1) is None
+    assert player_base.get_buildings_of_type(Bank) == []
+
+
+def test_building_stays_indexed_while_placed_on_another_tile():
+    player_base = PlayerBase()
+    island = Island()
+    player_base.add_island(island)
+    bank = create_bank()
+    island.set_building_at(0, 0, bank)
+    island.set_building_at(3, 3, bank)
+    island.set_building_at(0, 0, None)
+    assert player_base.get_buildings_of_type(Bank) == [bank]
+    assert player_base.get_coin_per_second() == mpf("2")
+
+    island.set_building_at(3, 3, None)
+    assert player_base.get_buildings_of_type(Bank) == []
+
+
+def test_set_tile_places_a_detached_tile():
+    island = Island()
+    bank = create_bank()
+    assert island.set_tile(4, 5, Tile(bank))
+    assert island.get_building_at(4, 5) is bank
+    assert island.get_building_positions() == [(4, 5, bank)]
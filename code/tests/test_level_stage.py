@@ -0,0 +1,52 @@
+import random
+
+from ancient_invasion import *
+
+
+def create_game(rng, times_beaten):
+    potential_heroes = [generate_random_hero(str(i), rng) for i in range(5)]
+    for hero in potential_heroes:
+        hero.rating = Hero.MAX_RATING
+        hero.max_level = triangular(hero.rating) * 10
+    level = Level("LEVEL", [LevelStage([rng.choice(potential_heroes).clone() for j in range(4)]) for i in range(2)])
+    for i in range(times_beaten):
+        level.get_beaten()
+    return Game(Player("PLAYER"), [], [MapArea("AREA", [level], None)], potential_heroes)
+
+
+def get_enemy_stats(level):
+    return [(enemy.hero_id, enemy.level, enemy.max_hp, enemy.attack_power) for stage in level.get_stages()
+            for enemy in stage.get_enemies_list()]
+
+
+def test_converted_stages_build_the_same_enemies():
+    for times_beaten in range(6):
+        eager_game = create_game(random.Random(times_beaten), times_beaten)
+        lazy_game = create_game(random.Random(times_beaten), times_beaten)
+        assert lazy_game.convert_battle_areas_to_descriptors() == 2
+        eager_level = eager_game.get_battle_areas()[0].get_levels()[0]
+        lazy_level = lazy_game.get_battle_areas()[0].get_levels()[0]
+        for i in range(2):
+            for eager_stats, lazy_stats in zip(get_enemy_stats(eager_level), get_enemy_stats(lazy_level)):
+                assert eager_stats[:2] == lazy_stats[:2]
+                assert all(almosteq(eager_stat, lazy_stat, 1e-12) for eager_stat, lazy_stat
+                           in zip(eager_stats[2:], lazy_stats[2:]))
+            eager_level.get_beaten()
+            lazy_level.get_beaten()
+
+
+def test_stages_with_changed_enemies_are_not_converted():
+    game = create_game(random.Random(7), 1)
+    stage = game.get_battle_areas()[0].get_levels()[0].get_stages()[0]
+    stage.get_enemies_list()[0].attack_power *= 2
+    assert game.convert_battle_areas_to_descriptors() == 1
+    assert not stage.get_is_lazy()
+
+
+def test_saves_hold_enemy_descriptors(tmp_path):
+    game = create_game(random.Random(8), 2)
+    save_game_data(game, str(tmp_path / "game.sav"))
+    loaded_game = load_game_data(str(tmp_path / "game.sav"))
+    assert all(stage.get_is_lazy() for stage in loaded_game.get_battle_areas()[0].get_levels()[0].get_stages())
+    assert get_enemy_stats(loaded_game.get_battle_areas()[0].get_levels()[0]) == \
+        get_enemy_stats(game.get_battle_areas()[0].get_levels()[0])
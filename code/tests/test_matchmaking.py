@@ -0,0 +1,76 @@
+import random
+
+from ancient_invasion import *
+
+
+def create_index(rng, number_of_trainers, max_points):
+    index = ArenaMatchmakingIndex()
+    trainers = []
+    for i in range(number_of_trainers):
+        trainer = Player("TRAINER " + str(i))
+        trainer.arena_points = rng.choice([rng.randint(0, 3000), rng.randint(0, max_points),
+                                           ArenaMatchmakingIndex.MAX_TREE_POINTS - 1,
+                                           ArenaMatchmakingIndex.MAX_TREE_POINTS])
+        trainers.append(trainer)
+        index.add_trainer(trainer)
+    return index, trainers
+
+
+def test_fenwick_tree_matches_brute_force():
+    rng = random.Random(1)
+    tree = FenwickTree(8)
+    counts = [0] * 8
+    for i in range(500):
+        if rng.random() < 0.05 and tree.size < 256:
+            tree.grow(tree.size * 2)
+            counts += [0] * (tree.size - len(counts))
+        position = rng.randrange(tree.size)
+        tree.add(position, 1)
+        counts[position] += 1
+        index = rng.randrange(tree.size)
+        assert tree.prefix_sum(index) == sum(counts[:index + 1])
+        order = rng.randrange(sum(counts))
+        assert tree.find_by_order(order) == next(position for position in range(len(counts))
+                                                 if sum(counts[:position + 1]) > order)
+
+
+def test_index_matches_sorted_trainers_with_huge_points():
+    rng = random.Random(3)
+    index, trainers = create_index(rng, 400, 10 ** 15)
+    for trainer in rng.sample(trainers, 100):
+        trainer.arena_points = rng.choice([rng.randint(0, 3000), rng.randint(0, 10 ** 15)])
+        index.update_trainer(trainer)
+    for trainer in rng.sample(trainers, 50):
+        index.remove_trainer(trainer)
+        trainers.remove(trainer)
+
+    assert [index.get_trainer_by_order(i).arena_points for i in range(len(trainers))] == \
+        sorted(trainer.arena_points for trainer in trainers)
+    for points in [0, 1, 100, 3000, 65535, 65536, 65537, 10 ** 11, 10 ** 16]:
+        assert index.count_trainers_with_points_below(points) == \
+            sum(1 for trainer in trainers if trainer.arena_points < points)
+    assert index.get_trainers_count_in_range(1000, 10 ** 12) == \
+        sum(1 for trainer in trainers if 1000 <= trainer.arena_points < 10 ** 12)
+
+
+def test_index_tree_stays_capped():
+    index, trainers = create_index(random.Random(5), 50, 10 ** 30)
+    assert index._ArenaMatchmakingIndex__counts.size <= ArenaMatchmakingIndex.MAX_TREE_POINTS
+
+
+def test_nearest_trainers_match_brute_force():
+    rng = random.Random(7)
+    index, trainers = create_index(rng, 300, 10 ** 6)
+    for i in range(50):
+        points = rng.randint(0, 10 ** 6)
+        nearest = index.get_nearest_trainers(points, 5, 10 ** 5)
+        distances = sorted(abs(trainer.arena_points - points) for trainer in trainers
+                           if abs(trainer.arena_points - points) <= 10 ** 5)[:5]
+        assert sorted(abs(trainer.arena_points - points) for trainer in nearest) == distances
+
+
+def test_random_trainer_in_range_uses_given_rng():
+    index, trainers = create_index(random.Random(4), 200, 5000)
+    chosen = [index.get_random_trainer_in_range(0, 3000, random.Random(seed)) for seed in range(20)]
+    assert chosen == [index.get_random_trainer_in_range(0, 3000, random.Random(seed)) for seed in range(20)]
+    assert all(0 <= trainer.arena_points < 3000 for trainer in chosen)
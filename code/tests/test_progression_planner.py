@@ -0,0 +1,58 @@
+import random
+
+from ancient_invasion import *
+
+
+def create_limit_broken_hero():
+    hero = generate_random_hero("HERO", random.Random(3))
+    hero.rating = Hero.MAX_RATING
+    hero.max_level = triangular(hero.rating) * 10
+    hero.level = hero.max_level
+    assert hero.apply_limit_break()
+    return hero
+
+
+def create_planner(heroes, items):
+    hero_storage = HeroStorage()
+    for hero in heroes:
+        hero_storage.add_hero(hero)
+    inventory = Inventory()
+    inventory.get_items().extend(items)
+    return ProgressionPlanner(inventory, hero_storage)
+
+
+def test_limit_broken_hero_without_target_level_has_no_level_goal():
+    hero = create_limit_broken_hero()
+    planner = create_planner([hero], [EXPShard("EXP SHARD", "", mpf("5"), mpf("1e6"))])
+    plan = planner.plan(ProgressionGoal([hero.hero_id], is_awakened=False, is_limit_broken=True))
+    assert plan["is_feasible"] and plan["steps"] == []
+
+
+def test_limit_broken_hero_with_target_level_is_planned():
+    hero = create_limit_broken_hero()
+    planner = create_planner([hero], [EXPShard("EXP SHARD", "", mpf("5"), mpf("1e6"))])
+    plan = planner.plan(ProgressionGoal([hero.hero_id], target_level=hero.level + 1, is_awakened=False,
+                                        is_limit_broken=True))
+    assert plan["is_feasible"] and [step_name for hero_id, step_name, items in plan["steps"]] == ["EXP SHARDS"]
+
+
+def test_infinite_target_level_is_reported_missing():
+    hero = create_limit_broken_hero()
+    planner = create_planner([hero], [EXPShard("EXP SHARD", "", mpf("5"), mpf("1e6"))])
+    plan = planner.plan(ProgressionGoal([hero.hero_id], target_level=float('inf'), is_awakened=False,
+                                        is_limit_broken=True))
+    assert not plan["is_feasible"]
+    assert plan["missing"] == ["EXP or LEVEL UP SHARDS to reach level inf for " + hero.hero_id]
+
+
+def test_heroes_do_not_share_exp_shards():
+    random_generator = random.Random(1)
+    first_hero = generate_random_hero("FIRST", random_generator)
+    second_hero = generate_random_hero("SECOND", random_generator)
+    planner = create_planner([first_hero, second_hero],
+                             [EXPShard("EXP SHARD", "", mpf("1"), first_hero.required_exp),
+                              LevelUpShard("LEVEL UP SHARD", "", mpf("100"))])
+    plan = planner.plan(ProgressionGoal([first_hero.hero_id, second_hero.hero_id], target_level=2,
+                                        is_awakened=False))
+    assert plan["is_feasible"] and plan["coin_cost"] == 101
+    assert sorted(step_name for hero_id, step_name, items in plan["steps"]) == ["EXP SHARDS", "LEVEL UP SHARDS"]
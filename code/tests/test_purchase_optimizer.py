@@ -0,0 +1,65 @@
+import itertools
+import random
+
+from ancient_invasion import *
+
+
+def create_shop(specifications):
+    return ItemShop("SHOP", "", mpf("0"), [EXPShard("EXP SHARD " + str(i), "", mpf(coin_cost), mpf(exp_gain))
+                                           for i, (coin_cost, exp_gain) in enumerate(specifications)])
+
+
+def get_best_value(specifications, coins):
+    best_value = 0
+    for chosen in itertools.product([False, True], repeat=len(specifications)):
+        if sum(coin_cost for is_chosen, (coin_cost, exp_gain) in zip(chosen, specifications) if is_chosen) <= coins:
+            best_value = max(best_value, sum(exp_gain for is_chosen, (coin_cost, exp_gain)
+                                             in zip(chosen, specifications) if is_chosen))
+    return best_value
+
+
+def test_buys_an_item_costing_exactly_the_coins():
+    purchase = PurchaseOptimizer().get_best_purchase(create_shop([(17, 69)]), mpf("17"),
+                                                     PurchaseOptimizer.get_exp_value)
+    assert purchase["value"] == 69 and purchase["coin_cost"] == 17
+
+
+def test_whole_coin_costs_match_brute_force():
+    rng = random.Random(5)
+    optimizer = PurchaseOptimizer()
+    for i in range(300):
+        specifications = [(rng.randint(1, 60), rng.randint(1, 100)) for j in range(rng.randint(1, 10))]
+        coins = rng.randint(1, 150)
+        purchase = optimizer.get_best_purchase(create_shop(specifications), mpf(coins),
+                                               PurchaseOptimizer.get_exp_value)
+        assert purchase["coin_cost"] <= coins
+        assert purchase["value"] == get_best_value(specifications, coins)
+
+
+def test_purchases_are_affordable_for_any_costs():
+    rng = random.Random(6)
+    optimizer = PurchaseOptimizer()
+    for i in range(100):
+        specifications = [(rng.uniform(0.5, 60), rng.randint(1, 100)) for j in range(rng.randint(1, 10))]
+        coins = rng.uniform(1, 150)
+        purchase = optimizer.get_best_purchase(create_shop(specifications), mpf(coins),
+                                               PurchaseOptimizer.get_exp_value)
+        assert purchase["coin_cost"] <= coins
+
+
+def test_half_coin_costs_are_exact():
+    purchase = PurchaseOptimizer().get_best_purchase(create_shop([("25.5", 66), (1, 59), (26, 72)]), mpf("27"),
+                                                     PurchaseOptimizer.get_exp_value)
+    assert purchase["value"] == 131 and purchase["coin_cost"] == 27
+
+
+def test_quarter_coin_costs_match_brute_force():
+    rng = random.Random(7)
+    optimizer = PurchaseOptimizer()
+    for i in range(300):
+        specifications = [(rng.randint(1, 240) / 4, rng.randint(1, 100)) for j in range(rng.randint(1, 10))]
+        coins = rng.randint(4, 600) / 4
+        purchase = optimizer.get_best_purchase(create_shop(specifications), mpf(coins),
+                                               PurchaseOptimizer.get_exp_value)
+        assert purchase["coin_cost"] <= coins
+        assert purchase["value"] == get_best_value(specifications, coins)
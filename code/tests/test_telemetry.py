@@ -0,0 +1,16 @@
+from telemetry import *
+
+
+def test_binary_format_round_trips_long_strings(tmp_path):
+    file_name = str(tmp_path / "telemetry.bin")
+    writer = ColumnarTelemetryWriter(file_name, [("name", "s"), ("turns", "i"), ("damage", "f"), ("crit", "b")],
+                                     "BINARY", chunk_size=2)
+    rows = [("x" * 70000, 1, 1.5, True), ("short", 2, 2.5, False), ("x" * 70000, 3, 3.5, True)]
+    for row in rows:
+        writer.write_row(row)
+    writer.close()
+
+    chunks = list(read_columnar_file(file_name))
+    assert [len(chunk["turns"]) for chunk in chunks] == [2, 1]
+    assert [tuple(chunk[name][i] for name in ["name", "turns", "damage", "crit"])
+            for chunk in chunks for i in range(len(chunk["turns"]))] == rows